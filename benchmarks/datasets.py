@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+
+import random
+import typing
+
+from google.protobuf import descriptor_pb2, descriptor_pool, message_factory
+from google.protobuf.descriptor import Descriptor
+from google.protobuf.descriptor_pb2 import FieldDescriptorProto
+from google.protobuf.message import Message
+
+from tests.document_pb2 import Document
+from tests.utils import _random_string, create_random_doc
+
+
+class Dataset(object):
+    """ Synthetic records of one schema shape, with the fields scanned by benchmarks. """
+    def __init__(self, name: str, desc: Descriptor, create_record: typing.Callable[[], Message],
+                 scan_fields: typing.List[str]) -> None:
+        super().__init__()
+        self.name = name
+        self.desc = desc
+        self.create_record = create_record
+        self.scan_fields = scan_fields
+
+    def records(self, num_records: int, seed: int = 0) -> typing.List[Message]:
+        random.seed(seed)
+        return [self.create_record() for _ in range(num_records)]
+
+
+def _message_class(file_proto: descriptor_pb2.FileDescriptorProto, name: str) -> type:
+    pool = descriptor_pool.DescriptorPool()
+    pool.Add(file_proto)
+    desc = pool.FindMessageTypeByName(name)
+    if hasattr(message_factory, 'GetMessageClass'):
+        return message_factory.GetMessageClass(desc)
+    return message_factory.MessageFactory(pool).GetPrototype(desc)
+
+
+def _add_field(msg_proto, name: str, number: int, type: int, label: int = FieldDescriptorProto.LABEL_OPTIONAL,
+               type_name: typing.Optional[str] = None) -> None:
+    field = msg_proto.field.add()
+    field.name = name
+    field.number = number
+    field.type = type
+    field.label = label
+    if type_name:
+        field.type_name = type_name
+
+
+def document_dataset() -> Dataset:
+    """ Records of the paper, as in tests. """
+    return Dataset('document', Document.DESCRIPTOR, create_random_doc,
+                   ['doc_id', 'name.url', 'name.language.code'])
+
+
+def repeated_dataset(repeat: int = 8) -> Dataset:
+    """ Records of the paper with about `repeat` times more names and links. """
+    def create_record():
+        doc = create_random_doc()
+        for _ in range(repeat - 1):
+            other = create_random_doc()
+            doc.name.extend(other.name)
+            doc.links.forward.extend(other.links.forward)
+            doc.links.backward.extend(other.links.backward)
+        return doc
+    return Dataset('repeated', Document.DESCRIPTOR, create_record,
+                   ['doc_id', 'name.url', 'name.language.code', 'name.language.country'])
+
+
+def wide_dataset(width: int = 100) -> Dataset:
+    """ Flat records of `width` optional fields, integers and strings by turns. """
+    file_proto = descriptor_pb2.FileDescriptorProto(name=f'wide_{width}.proto', package='benchmarks',
+                                                    syntax='proto2')
+    msg_proto = file_proto.message_type.add(name='Wide')
+    for i in range(width):
+        type = FieldDescriptorProto.TYPE_INT64 if i % 2 == 0 else FieldDescriptorProto.TYPE_STRING
+        _add_field(msg_proto, f'f{i}', i + 1, type)
+    cls = _message_class(file_proto, 'benchmarks.Wide')
+
+    def create_record():
+        msg = cls()
+        for i in range(width):
+            if random.random() < 0.9:
+                setattr(msg, f'f{i}', random.randint(0, 999999) if i % 2 == 0 else _random_string(8))
+        return msg
+    return Dataset('wide', cls.DESCRIPTOR, create_record, [f'f{i}' for i in range(width)])
+
+
+def deep_dataset(depth: int = 8) -> Dataset:
+    """ Records of `depth` nested optional messages, each with an integer, cut at random depths. """
+    file_proto = descriptor_pb2.FileDescriptorProto(name=f'deep_{depth}.proto', package='benchmarks',
+                                                    syntax='proto2')
+    for i in range(depth):
+        msg_proto = file_proto.message_type.add(name=f'Level{i}')
+        _add_field(msg_proto, 'value', 1, FieldDescriptorProto.TYPE_INT64)
+        if i + 1 < depth:
+            _add_field(msg_proto, 'child', 2, FieldDescriptorProto.TYPE_MESSAGE,
+                       type_name=f'.benchmarks.Level{i + 1}')
+        else:
+            _add_field(msg_proto, 'name', 2, FieldDescriptorProto.TYPE_STRING)
+    cls = _message_class(file_proto, 'benchmarks.Level0')
+
+    def create_record():
+        msg = cls()
+        current = msg
+        for i in range(depth):
+            current.value = random.randint(0, 999999)
+            if i + 1 == depth:
+                current.name = _random_string(8)
+            elif random.random() < 0.9:
+                current = current.child
+            else:
+                break
+        return msg
+    fields = ['.'.join(['child'] * i + ['value']) for i in range(depth)] + \
+        ['.'.join(['child'] * (depth - 1) + ['name'])]
+    return Dataset('deep', cls.DESCRIPTOR, create_record, fields)
+
+
+DATASETS = {
+    'document': document_dataset,
+    'repeated': repeated_dataset,
+    'wide': wide_dataset,
+    'deep': deep_dataset,
+}
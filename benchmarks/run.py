@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+
+import argparse
+import datetime
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+import typing
+
+from benchmarks.datasets import DATASETS, Dataset
+from benchmarks.startup import run_startup
+from dremel.assembly import MessageAssemblyBuilder, assemble
+from dremel.chunked import create_chunked_storage
+from dremel.encoding import INT_ENCODINGS, PLAIN, decode_values, encode_values, is_integer_type
+from dremel.reader import scan
+
+DEFAULT_SIZES = [10 ** 4]
+STAGES = ['shred', 'scan', 'assemble', 'encode']
+
+
+class BenchmarkError(Exception):
+    pass
+
+
+def _shred(dataset: Dataset, records, storage):
+    return create_chunked_storage(dataset.desc, records)
+
+
+def _scan(dataset: Dataset, records, storage):
+    for _ in scan(storage, dataset.scan_fields):
+        pass
+
+
+def _assemble(dataset: Dataset, records, storage):
+    builder = MessageAssemblyBuilder(storage.field_graph, dataset.desc._concrete_class)
+    assemble(storage, builder)
+    return builder.get_msgs()
+
+
+def _encode(dataset: Dataset, records, storage):
+    """ Round trips of integer columns through every bit-packed encoding. """
+    for row_group in storage.row_groups():
+        for path, chunk in row_group.columns.items():
+            cpp_type = storage.field_graph.get_field(path).descriptor.cpp_type
+            if not is_integer_type(cpp_type):
+                continue
+            for encoding in INT_ENCODINGS:
+                if encoding != PLAIN:
+                    decode_values(cpp_type, encode_values(cpp_type, chunk.values, encoding), encoding)
+
+
+_STAGE_FUNCS = {
+    'shred': _shred,
+    'scan': _scan,
+    'assemble': _assemble,
+    'encode': _encode,
+}
+
+
+def _measure(func: typing.Callable[[], typing.Any], repeat: int, memory: bool) -> typing.Tuple[float, typing.Optional[int]]:
+    """ Best wall time of `repeat` runs, and the peak of traced allocations of one more run if `memory`. """
+    seconds = min(_timed(func) for _ in range(repeat))
+    peak = None
+    if memory:
+        # NOTE(me): tracing slows allocations down, so it is never timed
+        tracemalloc.start()
+        try:
+            func()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    return seconds, peak
+
+
+def _timed(func: typing.Callable[[], typing.Any]) -> float:
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def run_benchmarks(datasets: typing.List[str], sizes: typing.List[int], stages: typing.List[str] = STAGES,
+                   repeat: int = 3, memory: bool = True, seed: int = 0,
+                   log: typing.Optional[typing.TextIO] = None) -> typing.List[dict]:
+    """ Results of every stage on every dataset and size, as plain dicts. """
+    for name in datasets:
+        if name not in DATASETS:
+            raise BenchmarkError(f'Unknown dataset: {name}, choose from {sorted(DATASETS)}')
+    for stage in stages:
+        if stage not in _STAGE_FUNCS:
+            raise BenchmarkError(f'Unknown stage: {stage}, choose from {STAGES}')
+
+    results = []
+    for name in datasets:
+        dataset = DATASETS[name]()
+        for size in sizes:
+            records = dataset.records(size, seed)
+            storage = create_chunked_storage(dataset.desc, records)
+            for stage in stages:
+                func = _STAGE_FUNCS[stage]
+                seconds, peak = _measure(lambda: func(dataset, records, storage), repeat, memory)
+                result = {
+                    'dataset': name,
+                    'records': size,
+                    'stage': stage,
+                    'seconds': seconds,
+                    'records_per_second': size / seconds if seconds else None,
+                    'us_per_record': seconds / size * 1e6 if size else None,
+                    'peak_bytes': peak,
+                }
+                results.append(result)
+                if log is not None:
+                    print(_format(result), file=log)
+    return results
+
+
+def _format(result: dict) -> str:
+    peak = f'{result["peak_bytes"] / (1 << 20):9.1f} MiB' if result['peak_bytes'] is not None else ''
+    latency = f'{result["us_per_record"]:9.1f} us/record' if result['us_per_record'] is not None else ''
+    return f'{result["dataset"]:>10} {result["records"]:>9} {result["stage"]:>9} ' \
+           f'{result["seconds"]:9.3f} s {latency} {peak}'
+
+
+def _git_commit() -> typing.Optional[str]:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def create_report(results: typing.List[dict]) -> dict:
+    return {
+        'commit': _git_commit(),
+        'time': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+    }
+
+
+def compare_reports(base: dict, current: dict, threshold: float = 0.1) -> typing.List[dict]:
+    """ Time ratios of results in both reports, flagging the ones slower by more than `threshold`. """
+    key = lambda r: (r['dataset'], r['records'], r['stage'])
+    base_results = dict((key(r), r) for r in base['results'])
+    rows = []
+    for r in current['results']:
+        b = base_results.get(key(r))
+        if b is None or not b['seconds']:
+            continue
+        ratio = r['seconds'] / b['seconds']
+        rows.append({
+            'dataset': r['dataset'],
+            'records': r['records'],
+            'stage': r['stage'],
+            'base_seconds': b['seconds'],
+            'seconds': r['seconds'],
+            'ratio': ratio,
+            'regression': ratio > 1 + threshold,
+        })
+    return rows
+
+
+def main(argv: typing.Optional[typing.List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Benchmarks of shredding, scans and assembly.')
+    parser.add_argument('--datasets', nargs='+', default=sorted(DATASETS), choices=sorted(DATASETS))
+    parser.add_argument('--records', nargs='+', type=int, default=DEFAULT_SIZES,
+                        help='numbers of records, like 10000 100000 1000000')
+    parser.add_argument('--stages', nargs='+', default=STAGES, choices=STAGES)
+    parser.add_argument('--repeat', type=int, default=3, help='runs per stage, the best one is kept')
+    parser.add_argument('--no-memory', action='store_true', help='skip measuring peak memory')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--startup', action='store_true', help='measure import times of entry points too')
+    parser.add_argument('--output', help='write results as json into this file')
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'CURRENT'),
+                        help='compare two result files instead, failing on regressions')
+    parser.add_argument('--threshold', type=float, default=0.1, help='slowdown ratio taken as a regression')
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        reports = []
+        for path in args.compare:
+            with open(path) as fd:
+                reports.append(json.load(fd))
+        rows = compare_reports(*reports, threshold=args.threshold)
+        for row in rows:
+            mark = '  REGRESSION' if row['regression'] else ''
+            print(f'{row["dataset"]:>10} {row["records"]:>9} {row["stage"]:>9} '
+                  f'{row["base_seconds"]:9.3f} s -> {row["seconds"]:9.3f} s  x{row["ratio"]:.2f}{mark}')
+        return 1 if any(row['regression'] for row in rows) else 0
+
+    results = run_benchmarks(args.datasets, args.records, args.stages, args.repeat, not args.no_memory,
+                             args.seed, log=sys.stderr)
+    if args.startup:
+        for result in run_startup(repeat=args.repeat):
+            results.append(result)
+            print(_format(result), file=sys.stderr)
+    report = json.dumps(create_report(results), indent=2)
+    if args.output:
+        with open(args.output, 'w') as fd:
+            fd.write(report)
+    else:
+        print(report)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
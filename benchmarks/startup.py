@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+
+import json
+import subprocess
+import sys
+import typing
+
+# modules imported by typical entry points
+ENTRY_POINTS = {
+    'scan': ['dremel.file', 'dremel.reader'],
+    'table': ['dremel.table'],
+    'shred': ['dremel.chunked', 'dremel.writer'],
+    'assemble': ['dremel.assembly', 'dremel.file'],
+}
+
+_SCRIPT = '''
+import json, sys, time
+start = time.perf_counter()
+for name in sys.argv[1:]:
+    __import__(name)
+seconds = time.perf_counter() - start
+print(json.dumps([seconds, 'google.protobuf' in sys.modules]))
+'''
+
+
+def measure_import(modules: typing.List[str]) -> typing.Tuple[float, bool]:
+    """ Seconds to import `modules` in a new interpreter, and whether protobuf got loaded. """
+    output = subprocess.check_output([sys.executable, '-c', _SCRIPT] + modules)
+    seconds, protobuf = json.loads(output.decode().strip().splitlines()[-1])
+    return seconds, protobuf
+
+
+def run_startup(entry_points: typing.Optional[typing.List[str]] = None, repeat: int = 5) -> typing.List[dict]:
+    """ Best import time of each entry point in new interpreters, in the result format of `run_benchmarks`. """
+    results = []
+    for name in entry_points or sorted(ENTRY_POINTS):
+        runs = [measure_import(ENTRY_POINTS[name]) for _ in range(repeat)]
+        results.append({
+            'dataset': 'startup',
+            'records': 0,
+            'stage': name,
+            'seconds': min(seconds for seconds, _ in runs),
+            'records_per_second': None,
+            'us_per_record': None,
+            'peak_bytes': None,
+            'protobuf': runs[0][1],
+        })
+    return results
+
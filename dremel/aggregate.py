@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+
+import collections
+import math
+import typing
+
+from dremel.reader import FieldStorage, prune_row_groups, read_batches, read_records
+from dremel.sampling import Sample
+
+# z-score of the two-sided 95% confidence interval
+Z_95 = 1.96
+
+
+class Estimate(collections.namedtuple('Estimate', ['value', 'error'])):
+    """ Aggregated value with the half width of its 95% confidence interval. """
+    __slots__ = ()
+
+    @property
+    def lower(self) -> float:
+        return self.value - self.error
+
+    @property
+    def upper(self) -> float:
+        return self.value + self.error
+
+
+def _estimate(storage: FieldStorage, field: str,
+              measure: typing.Callable[[typing.List[typing.Any]], float],
+              batch_measure: typing.Callable[[typing.Sequence[int], typing.Sequence[typing.Any]], float],
+              sample: typing.Optional[Sample]) -> Estimate:
+    if sample is None:
+        # exact results from bulk reads
+        return Estimate(sum(batch_measure(reps, values)
+                            for reps, _, values in read_batches(storage, field)), 0.0)
+
+    # Horvitz-Thompson estimation over sampling units (blocks of records, or row groups)
+    units = collections.defaultdict(float)
+    if sample.by_row_group:
+        for index, (row_group, _) in enumerate(prune_row_groups(storage, None, sample=sample)):
+            units[index] = sum(batch_measure(reps, values) for reps, _, values in read_batches(row_group, field))
+    else:
+        for index, values in read_records(storage, field, sample):
+            units[index // sample.block_size] += measure(values)
+    total = sum(units.values())
+    variance = (1.0 - sample.rate) * sum(y * y for y in units.values())
+    return Estimate(sample.scale(total), Z_95 * sample.scale(math.sqrt(variance)))
+
+
+def count_records(storage: FieldStorage, field: str, sample: typing.Optional[Sample] = None) -> Estimate:
+    """ Number of records, reading levels of `field` only. """
+    return _estimate(storage, field, lambda values: 1, lambda reps, values: reps.count(0), sample)
+
+
+def count_values(storage: FieldStorage, field: str, sample: typing.Optional[Sample] = None) -> Estimate:
+    """ Number of defined (non-NULL) values of `field`. """
+    return _estimate(storage, field, len, lambda reps, values: len(values), sample)
+
+
+def sum_values(storage: FieldStorage, field: str, sample: typing.Optional[Sample] = None) -> Estimate:
+    return _estimate(storage, field, sum, lambda reps, values: sum(values), sample)
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+
+import asyncio
+import collections
+import concurrent.futures
+import typing
+
+from dremel.consts import *
+from dremel.assembly import AssemblyBuilder, AssemblyError, assemble_readers, construct_fsm
+from dremel.chunked import ColumnChunk, RowGroup
+from dremel.predicate import Predicate
+from dremel.profiling import bind_profile
+from dremel.reader import FieldStorage, check_fields, create_selection, prune_row_groups, scan_row_group
+from dremel.sampling import Sample
+
+DEFAULT_READAHEAD = 2
+
+
+def _load_chunk(chunk: ColumnChunk) -> ColumnChunk:
+    """ Read and decode a whole column chunk, like one of a column file. """
+    values = chunk.values
+    return ColumnChunk(chunk.repetition_levels, chunk.definition_levels, values[0:len(values)],
+                       chunk.statistics)
+
+
+async def load_row_group(row_group: FieldStorage, paths: typing.List[str],
+                         executor: typing.Optional[concurrent.futures.Executor] = None) -> FieldStorage:
+    """ Row group with column chunks of `paths` read and decoded concurrently in `executor`.
+
+    Storages which are not made of column chunks are returned as they are.
+    """
+    if not isinstance(row_group, RowGroup):
+        return row_group
+    loop = asyncio.get_running_loop()
+    paths = [p for p in paths if p in row_group.columns]
+    load_chunk = bind_profile(_load_chunk)
+    chunks = await asyncio.gather(*[loop.run_in_executor(executor, load_chunk, row_group.columns[p])
+                                    for p in paths])
+    return RowGroup(row_group.field_graph, row_group.num_records(), dict(zip(paths, chunks)))
+
+
+async def _prefetch(row_groups: typing.Iterable[typing.Tuple[FieldStorage, int]], paths: typing.List[str],
+                    readahead: int, executor: typing.Optional[concurrent.futures.Executor]) ->\
+    typing.AsyncGenerator[typing.Tuple[FieldStorage, int], None]:
+    """ Yield loaded row groups in order, keeping up to `readahead` more loading meanwhile. """
+    pending = collections.deque()
+    try:
+        for row_group, offset in row_groups:
+            pending.append((asyncio.ensure_future(load_row_group(row_group, paths, executor)), offset))
+            if len(pending) > readahead:
+                task, offset = pending.popleft()
+                yield await task, offset
+        while pending:
+            task, offset = pending.popleft()
+            yield await task, offset
+    finally:
+        for task, _ in pending:
+            task.cancel()
+
+
+async def scan_async(storage: FieldStorage, project_fields: typing.List[str],
+                     predicates: typing.Optional[typing.List[Predicate]] = None,
+                     limit: typing.Optional[int] = None,
+                     sample: typing.Optional[Sample] = None,
+                     readahead: int = DEFAULT_READAHEAD,
+                     executor: typing.Optional[concurrent.futures.Executor] = None) ->\
+    typing.AsyncGenerator[typing.Tuple[typing.List[typing.Any], int], None]:
+    """ Same as `reader.scan`, with columns of the next `readahead` row groups read concurrently.
+
+    Columns of filters and projections are read as a whole per row group, so
+    I/O latency of columns overlaps each other and the scan of the current
+    row group, at the cost of reading projected values of rejected records.
+    """
+    groups = check_fields(storage, project_fields)
+    paths = [f'{ROOT}.{f}' for f in project_fields]
+    paths += [f'{ROOT}.{p.field}' for p in predicates or [] if f'{ROOT}.{p.field}' not in paths]
+    num_records = 0
+    row_groups = _prefetch(prune_row_groups(storage, predicates, sample=sample), paths, readahead, executor)
+    try:
+        async for row_group, offset in row_groups:
+            if limit is not None and num_records >= limit:
+                return
+            selection = create_selection(row_group, predicates, sample, offset)
+            rest = limit - num_records if limit is not None else None
+            for values, fetch_level in scan_row_group(row_group, project_fields, groups, selection, rest):
+                if fetch_level == 0:
+                    num_records += 1
+                yield values, fetch_level
+    finally:
+        await row_groups.aclose()
+
+
+async def assemble_async(storage: FieldStorage, builder: AssemblyBuilder, fields=None,
+                         readahead: int = DEFAULT_READAHEAD,
+                         executor: typing.Optional[concurrent.futures.Executor] = None) -> None:
+    """ Same as `assembly.assemble`, row group by row group, reading columns of the next ones concurrently. """
+    fsm, field_nodes = construct_fsm(storage.field_graph, fields)
+    paths = [node.path for node in field_nodes]
+    row_groups = _prefetch(prune_row_groups(storage, None), paths, readahead, executor)
+    try:
+        async for row_group, _ in row_groups:
+            readers = []
+            for path in paths:
+                r = row_group.create_field_reader(path)
+                if not r:
+                    raise AssemblyError(f'No such field {path} in storage')
+                readers.append(r)
+            assemble_readers(fsm, readers, builder)
+    finally:
+        await row_groups.aclose()
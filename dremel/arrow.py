@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+
+import array
+import typing
+
+from dremel.consts import *
+from dremel.encoding import fixed_width_typecode
+from dremel.field_graph import FieldNode
+from dremel.reader import FieldStorage, ReadError
+
+# cpp_type => arrow type of leaf values
+_LEAF_TYPES = {
+    CPPTYPE_INT32: 'int32',
+    CPPTYPE_INT64: 'int64',
+    CPPTYPE_UINT32: 'uint32',
+    CPPTYPE_UINT64: 'uint64',
+    CPPTYPE_DOUBLE: 'double',
+    CPPTYPE_FLOAT: 'float',
+    CPPTYPE_BOOL: 'bool',
+    CPPTYPE_ENUM: 'int32',
+    CPPTYPE_STRING: 'string',
+}
+
+
+class ExportError(Exception):
+    pass
+
+
+def _bitmap(bits: typing.List[bool]) -> bytes:
+    """ Bits packed from the least significant bit of the first byte, like validity bitmaps of Arrow. """
+    if not bits:
+        return b''
+    n = int(''.join('1' if b else '0' for b in reversed(bits)), 2)
+    return n.to_bytes((len(bits) + 7) // 8, 'little')
+
+
+class ArrowColumn(object):
+    """ Arrow layout of a column in plain buffers.
+
+    `validity` is a bitmap (None if no NULLs), `offsets` are int32 offsets of
+    lists and strings, `values` are fixed width values, bits of bools or the
+    data of strings, and `children` are the element of lists or the fields of
+    structs.
+    """
+    def __init__(self, name: str, type: str, length: int,
+                 validity: typing.Optional[bytes] = None, null_count: int = 0,
+                 offsets: typing.Optional[array.array] = None,
+                 values: typing.Optional[typing.Union[array.array, bytes]] = None,
+                 children: typing.Optional[typing.List['ArrowColumn']] = None) -> None:
+        super().__init__()
+        self.name = name
+        self.type = type
+        self.length = length
+        self.validity = validity
+        self.null_count = null_count
+        self.offsets = offsets
+        self.values = values
+        self.children = children or []
+
+    def is_valid(self, index: int) -> bool:
+        return self.validity is None or bool(self.validity[index >> 3] >> (index & 7) & 1)
+
+    def to_pylist(self) -> typing.List[typing.Any]:
+        """ Python values of the column, mostly for checks. """
+        if self.type == 'struct':
+            fields = [(c.name, c.to_pylist()) for c in self.children]
+            items = [dict((name, values[i]) for name, values in fields) for i in range(self.length)]
+        elif self.type == 'list':
+            elements = self.children[0].to_pylist()
+            items = [elements[self.offsets[i]:self.offsets[i + 1]] for i in range(self.length)]
+        elif self.type == 'bool':
+            items = [bool(self.values[i >> 3] >> (i & 7) & 1) for i in range(self.length)]
+        elif self.type in ('string', 'binary'):
+            items = [self.values[self.offsets[i]:self.offsets[i + 1]] for i in range(self.length)]
+            if self.type == 'string':
+                items = [v.decode('utf-8') for v in items]
+        else:
+            items = list(self.values)
+        return [v if self.is_valid(i) else None for i, v in enumerate(items)]
+
+    def __repr__(self) -> str:
+        return f'<ArrowColumn:{self.name} {self.type} length={self.length} nulls={self.null_count}>'
+
+
+class _NodeBuilder(object):
+    """ Slots of a node from one pass over a leaf column under it. """
+    def __init__(self, node: FieldNode) -> None:
+        super().__init__()
+        desc = node.descriptor
+        self.node = node
+        self.repeated = desc.label == LABEL_REPEATED
+        self.repetition_level = desc.max_repetition_level
+        self.definition_level = desc.definition_level
+        self.validity = []  # of list slots if repeated
+        self.offsets = []  # starts of lists
+        self.num_elements = 0
+        self.values = []  # of leaves
+
+
+def _path_from_root(node: FieldNode) -> typing.List[FieldNode]:
+    path = []
+    while node.parent is not None:
+        path.append(node)
+        node = node.parent
+    return path[::-1]
+
+
+def _convert_leaf(storage: FieldStorage, leaf: FieldNode) -> typing.Tuple[typing.List[_NodeBuilder], int]:
+    """ One linear pass over levels of a leaf column, building slots of all nodes on its path. """
+    reader = storage.create_field_reader(leaf.path)
+    if reader is None:
+        raise ReadError(f'No field named "{leaf.path}"')
+    builders = [_NodeBuilder(node) for node in _path_from_root(leaf)]
+    leaf_builder = builders[-1]
+    num_records = 0
+    while True:
+        batch = reader.read_batch()
+        if batch is None:
+            break
+        reps, defs, values = batch
+        value_index = 0
+        for r, d in zip(reps, defs):
+            # whether the parent got a new slot (list element or struct) by this entry
+            created = r == 0
+            if created:
+                num_records += 1
+            for b in builders:
+                if b.repeated:
+                    if created:
+                        b.offsets.append(b.num_elements)
+                        b.validity.append(d >= b.definition_level - 1)
+                    if (created or r == b.repetition_level) and d >= b.definition_level:
+                        b.num_elements += 1
+                        created = True
+                    else:
+                        created = False
+                elif created:
+                    b.validity.append(d >= b.definition_level)
+            if created:
+                if d == leaf_builder.definition_level:
+                    leaf_builder.values.append(values[value_index])
+                    value_index += 1
+                else:
+                    leaf_builder.values.append(None)
+    return builders, num_records
+
+
+def _leaf_column(name: str, builder: _NodeBuilder, validity: typing.List[bool]) -> ArrowColumn:
+    cpp_type = builder.node.descriptor.cpp_type
+    values = builder.values
+    type = _LEAF_TYPES.get(cpp_type)
+    if type is None:
+        raise ExportError(f'Unsupported cpp type: {cpp_type}')
+    null_count = validity.count(False)
+    column = ArrowColumn(name, type, len(values), _bitmap(validity) if null_count else None, null_count)
+    typecode = fixed_width_typecode(cpp_type)
+    if typecode is not None:
+        column.values = array.array(typecode, (0 if v is None else v for v in values))
+    elif type == 'bool':
+        column.values = _bitmap([bool(v) for v in values])
+    else:
+        if any(isinstance(v, bytes) for v in values):
+            column.type = 'binary'
+        blobs = [b'' if v is None else v if isinstance(v, bytes) else v.encode('utf-8') for v in values]
+        offsets = array.array('i', [0])
+        for blob in blobs:
+            offsets.append(offsets[-1] + len(blob))
+        column.offsets = offsets
+        column.values = b''.join(blobs)
+    return column
+
+
+def _build_column(node: FieldNode, builders: typing.Dict[FieldNode, _NodeBuilder],
+                  selected: typing.Set[FieldNode]) -> ArrowColumn:
+    builder = builders[node]
+    name = node.name
+    if node.is_leaf():
+        if not builder.repeated:
+            return _leaf_column(name, builder, builder.validity)
+        element = _leaf_column('item', builder, [True] * len(builder.values))
+    else:
+        children = [_build_column(c, builders, selected) for c in node.child_nodes if c in selected]
+        if not builder.repeated:
+            null_count = builder.validity.count(False)
+            return ArrowColumn(name, 'struct', len(builder.validity),
+                               _bitmap(builder.validity) if null_count else None, null_count,
+                               children=children)
+        element = ArrowColumn('item', 'struct', builder.num_elements, children=children)
+
+    offsets = array.array('i', builder.offsets)
+    offsets.append(builder.num_elements)
+    null_count = builder.validity.count(False)
+    return ArrowColumn(name, 'list', len(builder.offsets), _bitmap(builder.validity) if null_count else None,
+                       null_count, offsets=offsets, children=[element])
+
+
+def export_columns(storage: FieldStorage, fields: typing.Optional[typing.List[str]] = None) -> ArrowColumn:
+    """ Nested Arrow layout of leaf `fields` (all by default) as a struct column of records.
+
+    Levels are converted to validity bitmaps and list offsets by one pass over
+    each leaf column, without assembling records. Repeated fields are lists
+    which are never NULL, and optional fields are nullable.
+    """
+    graph = storage.field_graph
+    if fields is None:
+        leaves = graph.root.leaf_nodes
+    else:
+        leaves = []
+        for f in fields:
+            node = graph.get_field(f'{ROOT}.{f}')
+            if node is None or not node.is_leaf():
+                raise ReadError(f'No field named "{f}"')
+            leaves.append(node)
+
+    builders = dict()
+    selected = set()
+    num_records = 0
+    for leaf in leaves:
+        leaf_builders, num_records = _convert_leaf(storage, leaf)
+        for b in leaf_builders:
+            # NOTE(me): every leaf under a node tells the same slots of the node
+            if b.node not in builders or b.node is leaf:
+                builders[b.node] = b
+            selected.add(b.node)
+    children = [_build_column(c, builders, selected) for c in graph.root.child_nodes if c in selected]
+    return ArrowColumn(ROOT, 'struct', num_records, children=children)
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        raise ExportError('pyarrow is required, try: pip install pyarrow')
+    return pyarrow
+
+
+def _to_pyarrow_array(pa, column: ArrowColumn):
+    validity = pa.py_buffer(column.validity) if column.validity is not None else None
+    if column.type == 'struct':
+        children = [_to_pyarrow_array(pa, c) for c in column.children]
+        type = pa.struct([pa.field(c.name, a.type) for c, a in zip(column.children, children)])
+        return pa.Array.from_buffers(type, column.length, [validity], column.null_count, children=children)
+    if column.type == 'list':
+        element = _to_pyarrow_array(pa, column.children[0])
+        return pa.Array.from_buffers(pa.list_(element.type), column.length,
+                                     [validity, pa.py_buffer(column.offsets)], column.null_count,
+                                     children=[element])
+    type = {
+        'int32': pa.int32(), 'int64': pa.int64(), 'uint32': pa.uint32(), 'uint64': pa.uint64(),
+        'double': pa.float64(), 'float': pa.float32(), 'bool': pa.bool_(),
+        'string': pa.string(), 'binary': pa.binary(),
+    }[column.type]
+    buffers = [validity]
+    if column.offsets is not None:
+        buffers.append(pa.py_buffer(column.offsets))
+    buffers.append(pa.py_buffer(column.values))
+    return pa.Array.from_buffers(type, column.length, buffers, column.null_count)
+
+
+def to_pyarrow(storage: FieldStorage, fields: typing.Optional[typing.List[str]] = None):
+    """ `pyarrow.RecordBatch` of leaf `fields`, built from the buffers of `export_columns`. """
+    pa = _import_pyarrow()
+    column = export_columns(storage, fields)
+    arrays = [_to_pyarrow_array(pa, c) for c in column.children]
+    return pa.RecordBatch.from_arrays(arrays, [c.name for c in column.children])
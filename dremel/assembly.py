@@ -2,12 +2,12 @@
 
 import logging
 import typing
-from google.protobuf.descriptor import FieldDescriptor
 
+from dremel import profiling
 from dremel.node import Node
 from dremel.consts import *
 from dremel.field_graph import FieldGraph, FieldNode
-from dremel.reader import FieldStorage, FieldValueMixin, FieldReader
+from dremel.reader import FieldStorage, FieldValueMixin, FieldReader, _ProfiledFieldReader
 
 
 class AssemblyError(Exception):
@@ -60,59 +60,81 @@ class MessageAssemblyBuilder(AssemblyBuilder):
         self._stack = []
 
     def assign_value(self, field: FieldValueMixin):
-        logging.debug(f'Move from: {self._stack[-1][1].descriptor.path} to: {field.field_node.descriptor.path}')
-        logging.debug(f'Value: {field}')
+        # NOTE(me): arguments are formatted only if debug logging is enabled, messages are large.
+        logging.debug('Move from: %s to: %s', self._stack[-1][1].path, field.field_node.path)
+        logging.debug('Value: %s', field)
 
         # move up to level
         current_node = field.field_node
         barrier = current_node.lowest_common_ancestor_node_with(self._stack[-1][1])
         # When back links are found, some repetition levels should be restarted.
         if self._last_node is not None and current_node.field_index <= self._last_node.field_index:
-            while barrier != self._field_graph.root and barrier.descriptor.max_repetition_level >= field.repetition_level():
+            while barrier != self._field_graph.root and barrier.max_repetition_level >= field.repetition_level():
                 barrier = barrier.parent
-        logging.debug(f'Barrier: {barrier}')
+        logging.debug('Barrier: %s', barrier)
         while self._stack[-1][1] != barrier:
             self._stack.pop()
-        logging.debug(f'Up: {self._stack}')
+        logging.debug('Up: %s', self._stack)
 
         # then go down
         path = current_node.get_path_to(barrier)[::-1]
-        while path and path[0].descriptor.definition_level <= field.definition_level():
-            logging.debug(f'Down: path={path} stack_last={self._stack[-1]}')
+        while path and path[0].definition_level <= field.definition_level():
+            logging.debug('Down: path=%s stack_last=%s', path, self._stack[-1])
             last = self._stack[-1][0]
             node, path = path[0], path[1:]
             if node.is_leaf():
                 if node != current_node:
                     raise AssemblyError(f'Unexpected leaf node {node} before {current_node}')
                 assert len(path) == 0, path
-                # set value
-                if node.descriptor.label == FieldDescriptor.LABEL_REPEATED:
-                    #last.setdefault(node.name, []).append(field.value())
-                    getattr(last, node.name).append(field.value())
-                else:
-                    #last[node.name] = field.value()
-                    setattr(last, node.name, field.value())
-
-                logging.debug(f'set last={last} root={self._stack[0][0]}')
+                self._set_value(last, node, field.value())
+                logging.debug('set last=%s root=%s', last, self._stack[0][0])
             else:
-                # create sub-messages
-                msg = dict()
-                if node.descriptor.label == FieldDescriptor.LABEL_REPEATED:
-                    #last.setdefault(node.name, []).append(msg)
-                    msg = getattr(last, node.name).add()
-                else:
-                    #last[node.name] = msg
-                    getattr(last, node.name).SetInParent()
-                    msg = getattr(last, node.name)
-                self._stack.append((msg, node))
+                self._stack.append((self._add_message(last, node), node))
 
         self._last_node = current_node
 
+    def _set_value(self, last, node: FieldNode, value) -> None:
+        if node.label == LABEL_REPEATED:
+            #last.setdefault(node.name, []).append(value)
+            getattr(last, node.name).append(value)
+        else:
+            #last[node.name] = value
+            setattr(last, node.name, value)
+
+    def _add_message(self, last, node: FieldNode):
+        """ Create a sub-message. """
+        if node.label == LABEL_REPEATED:
+            #last.setdefault(node.name, []).append(dict())
+            return getattr(last, node.name).add()
+        #last[node.name] = dict()
+        getattr(last, node.name).SetInParent()
+        return getattr(last, node.name)
+
+
+class _ProfiledAssemblyBuilder(AssemblyBuilder):
+    """ Builder timing values assigned into a profile, and protobuf mutations of message builders apart. """
+    def __init__(self, builder: AssemblyBuilder, profile: profiling.Profile):
+        super().__init__()
+        self._builder = builder
+        self.start = builder.start
+        self.rollback = builder.rollback
+        self.done = builder.done
+        self.assign_value = profile.timer('assemble').wrap(builder.assign_value)
+        if isinstance(builder, MessageAssemblyBuilder):
+            timer = profile.timer('protobuf')
+            builder._set_value = timer.wrap(builder._set_value)
+            builder._add_message = timer.wrap(builder._add_message)
+
+    def close(self):
+        # NOTE(me): back to the methods of the class
+        self._builder.__dict__.pop('_set_value', None)
+        self._builder.__dict__.pop('_add_message', None)
+
 
 def _dfs(graph: FieldGraph, fields=None):
     """ DFS but also preserve definition orders. """
     field_set = set([f'{ROOT}.{f}' for f in fields]) if fields else None
-    return [node for node in graph.root.leaf_nodes if field_set is None or node.descriptor.path in field_set]
+    return [node for node in graph.root.leaf_nodes if field_set is None or node.path in field_set]
 
 
 FSM = typing.Dict[FieldNode, typing.List[FieldNode]]
@@ -123,7 +145,7 @@ def construct_fsm(graph: FieldGraph, fields=None, end_node=None) -> typing.Tuple
     states = dict()
 
     for i, current in enumerate(field_nodes):
-        max_level = current.descriptor.max_repetition_level
+        max_level = current.max_repetition_level
         barrier = field_nodes[i+1] if i+1 < len(field_nodes) else end_node
         barrier_level = current.common_repetition_level_with(barrier) if barrier else 0
         logging.debug(f'Field: {current}')
@@ -132,7 +154,7 @@ def construct_fsm(graph: FieldGraph, fields=None, end_node=None) -> typing.Tuple
         to_fields = [None] * (max_level+1)
 
         # TODO(me): Can optimize by caching for the previous one?
-        pre_fields = [f for f in field_nodes[:i+1] if f.descriptor.max_repetition_level > barrier_level]
+        pre_fields = [f for f in field_nodes[:i+1] if f.max_repetition_level > barrier_level]
         for pre_field in pre_fields:
             back_level = current.common_repetition_level_with(pre_field)
             if to_fields[back_level] is None:
@@ -155,18 +177,28 @@ def assemble(storage: FieldStorage, builder: AssemblyBuilder, fields=None):
     fsm, field_nodes = construct_fsm(storage.field_graph, fields)
     readers = []
     for node in field_nodes:
-        r = storage.create_field_reader(node.descriptor.path)
+        r = storage.create_field_reader(node.path)
         if not r:
-            raise AssemblyError(f'No such field {node.descriptor.path} in storage')
+            raise AssemblyError(f'No such field {node.path} in storage')
         readers.append(r)
-    _assemble(fsm, readers, builder)
-
-def _assemble(fsm: FSM, field_readers: typing.List[FieldReader], builder: AssemblyBuilder):
-    reader_map = dict((f.descriptor.path, f) for f in field_readers)
+    profile = profiling.get_profile()
+    if profile is None:
+        assemble_readers(fsm, readers, builder)
+        return
+    readers = [_ProfiledFieldReader(r, profile, time_fetch=True) for r in readers]
+    builder = _ProfiledAssemblyBuilder(builder, profile)
+    try:
+        assemble_readers(fsm, readers, builder)
+    finally:
+        builder.close()
+
+def assemble_readers(fsm: FSM, field_readers: typing.List[FieldReader], builder: AssemblyBuilder):
+    """ Assemble records from readers of the fields of `fsm`, in the order of fields of `construct_fsm`. """
+    reader_map = dict((f.field_node.path, f) for f in field_readers)
     fsm_readers = dict()
     for k,v in fsm.items():
-        key = reader_map[k.descriptor.path]
-        values = [reader_map[e.descriptor.path] if e else None for e in v]
+        key = reader_map[k.path]
+        values = [reader_map[e.path] if e else None for e in v]
         fsm_readers[key] = values
 
     def _read_message():
@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+
+import array
+import collections
+import collections.abc
+import copy
+import functools
+import threading
+import types
+import typing
+
+from dremel.predicate import Predicate
+from dremel.sampling import Sample
+
+if typing.TYPE_CHECKING:
+    import inspect
+
+DEFAULT_COLUMN_CACHE_BYTES = 256 << 20
+DEFAULT_RESULT_CACHE_ENTRIES = 1024
+DEFAULT_RESULT_CACHE_BYTES = 64 << 20
+
+_REFERENCE_SIZE = 8
+
+
+def sizeof(value: typing.Any) -> int:
+    """ Rough number of bytes held by decoded column data. """
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return len(value)
+    if isinstance(value, array.array):
+        return value.itemsize * len(value)
+    if isinstance(value, str):
+        return len(value)
+    if isinstance(value, (tuple, list)):
+        return sum(_REFERENCE_SIZE + sizeof(v) for v in value)
+    return _REFERENCE_SIZE
+
+
+class LRUCache(object):
+    """ Thread-safe cache evicting the least recently used entries beyond `max_bytes`.
+
+    Values are shared by all callers, which should not modify them.
+    """
+    def __init__(self, max_bytes: int, max_entries: typing.Optional[int] = None,
+                 sizeof: typing.Callable[[typing.Any], int] = sizeof) -> None:
+        super().__init__()
+        self._max_bytes = max_bytes
+        self._max_entries = max_entries
+        self._sizeof = sizeof
+        self._entries = collections.OrderedDict()  # key => (value, size)
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    @property
+    def max_bytes(self) -> int:
+        return self._max_bytes
+
+    @property
+    def size(self) -> int:
+        """ Bytes held by cached values. """
+        return self._size
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: typing.Hashable) -> bool:
+        return key in self._entries
+
+    def get(self, key: typing.Hashable, load: typing.Callable[[], typing.Any]) -> typing.Any:
+        """ Cached value of `key`, or the one returned by `load()` which is cached then. """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+        # NOTE(me): load without the lock, concurrent misses of a key may load it twice
+        value = load()
+        self.put(key, value)
+        return value
+
+    def put(self, key: typing.Hashable, value: typing.Any) -> None:
+        size = self._sizeof(value)
+        if size > self._max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= old[1]
+            self._entries[key] = (value, size)
+            self._size += size
+            while self._size > self._max_bytes or \
+                    (self._max_entries is not None and len(self._entries) > self._max_entries):
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._size -= evicted_size
+                self.evictions += 1
+
+    def evict(self, match: typing.Callable[[typing.Hashable], bool]) -> int:
+        """ Drop entries whose keys `match`, returning how many. """
+        with self._lock:
+            keys = [key for key in self._entries if match(key)]
+            for key in keys:
+                self._size -= self._entries.pop(key)[1]
+            self.evictions += len(keys)
+            return len(keys)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self) -> typing.Dict[str, int]:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': len(self._entries),
+            'bytes': self._size,
+        }
+
+
+class ColumnCache(LRUCache):
+    """ Decoded levels and value pages of column files, keyed by (file, row group, column path, part). """
+    def __init__(self, max_bytes: int = DEFAULT_COLUMN_CACHE_BYTES) -> None:
+        super().__init__(max_bytes)
+
+
+def _normalize(value: typing.Any) -> typing.Hashable:
+    if isinstance(value, Predicate):
+        return value.key()
+    if isinstance(value, Sample):
+        return ('sample', value.rate, value.seed, value.block_size, value.by_row_group)
+    if isinstance(value, (list, tuple)):
+        items = tuple(_normalize(v) for v in value)
+        if value and all(isinstance(v, Predicate) for v in value):
+            # conjunctions of predicates are the same in any order
+            return ('and', frozenset(items))
+        return items
+    if isinstance(value, (set, frozenset)):
+        return frozenset(_normalize(v) for v in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, _normalize(v)) for k, v in value.items()))
+    return value
+
+
+@functools.lru_cache(maxsize=None)
+def _signature(func: typing.Callable) -> 'inspect.Signature':
+    import inspect
+    return inspect.signature(func)
+
+
+def normalize_query(func: typing.Callable, storage: typing.Any, *args, **kwargs) -> typing.Hashable:
+    """ Hashable query of `func(storage, *args, **kwargs)`, the same however arguments are passed. """
+    arguments = _signature(func).bind(storage, *args, **kwargs)
+    arguments.apply_defaults()
+    params = list(arguments.arguments.items())[1:]
+    return (func,) + tuple((name, _normalize(value)) for name, value in params)
+
+
+def _freeze(value: typing.Any) -> typing.Any:
+    if isinstance(value, list) or type(value) is tuple:
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+def _materialize(result: typing.Any) -> typing.Any:
+    """ Results as immutable values, with rows of iterators (like scans) copied into tuples. """
+    if isinstance(result, (types.GeneratorType, collections.abc.Iterator)):
+        return tuple(_freeze(item) for item in result)
+    return _freeze(result)
+
+
+_IMMUTABLE_TYPES = (type(None), bool, int, float, complex, str, bytes, frozenset)
+
+
+def _is_frozen(value: typing.Any) -> bool:
+    if isinstance(value, tuple):
+        return all(_is_frozen(v) for v in value)
+    return isinstance(value, _IMMUTABLE_TYPES)
+
+
+def _sizeof_result(entry: typing.Tuple[typing.Any, bool]) -> int:
+    return sizeof(entry[0])
+
+
+class ResultCache(LRUCache):
+    """ Query results keyed by the snapshot of the storage queried and the normalized query.
+
+    Entries of older snapshots of a storage are dropped once a newer one is
+    queried, and storages without snapshot keys are never cached. Results
+    which are not made of immutable values (like sketches) are copied for
+    every caller, others are shared.
+    """
+    def __init__(self, max_entries: int = DEFAULT_RESULT_CACHE_ENTRIES,
+                 max_bytes: int = DEFAULT_RESULT_CACHE_BYTES) -> None:
+        super().__init__(max_bytes, max_entries, _sizeof_result)
+        self._snapshots = dict()  # storage id => latest snapshot id
+        self._snapshots_lock = threading.Lock()
+
+    def _invalidate(self, storage_id: typing.Hashable, snapshot_id: int) -> None:
+        with self._snapshots_lock:
+            latest = self._snapshots.get(storage_id)
+            if latest is not None and latest >= snapshot_id:
+                return
+            self._snapshots[storage_id] = snapshot_id
+        if latest is not None:
+            self.evict(lambda key: key[0][0] == storage_id and key[0][1] < snapshot_id)
+
+    def query(self, func: typing.Callable, storage: typing.Any, *args, **kwargs) -> typing.Any:
+        """ Result of `func(storage, *args, **kwargs)`, with rows of scans in a tuple. """
+        snapshot_key = storage.snapshot_key()
+        if snapshot_key is None:
+            return _materialize(func(storage, *args, **kwargs))
+        self._invalidate(*snapshot_key)
+        key = (snapshot_key, normalize_query(func, storage, *args, **kwargs))
+        result, frozen = self.get(key, lambda: self._load(func, storage, *args, **kwargs))
+        return result if frozen else copy.deepcopy(result)
+
+    @staticmethod
+    def _load(func: typing.Callable, storage: typing.Any, *args, **kwargs) -> typing.Tuple[typing.Any, bool]:
+        result = _materialize(func(storage, *args, **kwargs))
+        return result, _is_frozen(result)
+
+
+_column_cache = None
+
+
+def get_column_cache() -> typing.Optional[ColumnCache]:
+    return _column_cache
+
+
+def set_column_cache(cache: typing.Optional[ColumnCache]) -> typing.Optional[ColumnCache]:
+    """ Install the process-wide column cache, or disable it with None. Returns the previous one. """
+    global _column_cache
+    previous, _column_cache = _column_cache, cache
+    return previous
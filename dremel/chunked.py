@@ -0,0 +1,522 @@
+#!/usr/bin/env python
+
+import array
+import base64
+import itertools
+import threading
+import typing
+import uuid
+
+from dremel import profiling
+from dremel.consts import *
+from dremel.encoding import as_array, as_buffer, as_sequence, decode_values, encode_values
+from dremel.field_graph import FieldGraph, FieldGraphError, FieldNode
+from dremel.predicate import Predicate
+from dremel.reader import ColumnBuffers, FieldStorage, FieldReader, ReadError
+from dremel.sketch import BloomFilter
+
+if typing.TYPE_CHECKING:
+    from google.protobuf.descriptor import Descriptor
+    from google.protobuf.message import Message
+    from dremel.schema_pb2 import SchemaFieldDescriptor
+    from dremel.writer import MessageWriter
+
+DEFAULT_ROW_GROUP_SIZE = 10000
+
+
+class ColumnStatistics(object):
+    """ Min/max of defined values and NULL counts of a column chunk. """
+    def __init__(self, num_values: int = 0, null_count: int = 0,
+                 min_value: typing.Any = None, max_value: typing.Any = None) -> None:
+        super().__init__()
+        self.num_values = num_values
+        self.null_count = null_count
+        self.min_value = min_value
+        self.max_value = max_value
+
+    def __repr__(self) -> str:
+        return f'<Statistics:n={self.num_values} nulls={self.null_count} min={self.min_value!r} max={self.max_value!r}>'
+
+
+def encode_statistics(cpp_type: int, statistics: ColumnStatistics) -> dict:
+    """ Statistics of a column chunk as a plain dict, for footers and headers of storages. """
+    meta = {'num_values': statistics.num_values, 'null_count': statistics.null_count}
+    if statistics.min_value is not None:
+        data = encode_values(cpp_type, [statistics.min_value, statistics.max_value])
+        meta['min_max'] = base64.b64encode(data).decode('ascii')
+    return meta
+
+
+def decode_statistics(cpp_type: int, meta: dict) -> ColumnStatistics:
+    """ Statistics saved by `encode_statistics`. """
+    statistics = ColumnStatistics(meta['num_values'], meta['null_count'])
+    if 'min_max' in meta:
+        min_max = decode_values(cpp_type, base64.b64decode(meta['min_max']))
+        statistics.min_value, statistics.max_value = min_max[0], min_max[1]
+    return statistics
+
+
+class ColumnChunk(object):
+    """ Levels of one column within a row group, with only defined values kept. """
+    def __init__(self, repetition_levels: typing.Sequence[int],
+                 definition_levels: typing.Sequence[int],
+                 values: typing.Sequence[typing.Any],
+                 statistics: ColumnStatistics,
+                 bloom_filter: typing.Optional[BloomFilter] = None) -> None:
+        super().__init__()
+        self._repetition_levels = repetition_levels
+        self._definition_levels = definition_levels
+        self._values = values
+        self._statistics = statistics
+        self._bloom_filter = bloom_filter
+
+    @property
+    def repetition_levels(self) -> typing.Sequence[int]:
+        return self._repetition_levels
+
+    @property
+    def definition_levels(self) -> typing.Sequence[int]:
+        return self._definition_levels
+
+    @property
+    def values(self) -> typing.Sequence[typing.Any]:
+        return self._values
+
+    @property
+    def statistics(self) -> ColumnStatistics:
+        return self._statistics
+
+    @property
+    def bloom_filter(self) -> typing.Optional[BloomFilter]:
+        return self._bloom_filter
+
+    @property
+    def num_values(self) -> int:
+        return len(self._repetition_levels)
+
+    @property
+    def num_pages(self) -> int:
+        """ Units of levels and values read apart, all at once in memory. """
+        return 1
+
+    def prefetch(self) -> None:
+        """ Hint that the chunk is read next, which may start reading it in the background. """
+        pass
+
+    def release(self) -> None:
+        """ Hint that readers moved past the chunk, which may stop reading it in the background. """
+        pass
+
+    def buffers(self) -> ColumnBuffers:
+        """ Zero-copy views of the chunk, like for `numpy.frombuffer`. """
+        return ColumnBuffers(as_buffer(self.repetition_levels), as_buffer(self.definition_levels),
+                             as_buffer(self.values))
+
+
+class RowGroup(FieldStorage):
+    """ Column chunks of a run of consecutive records. """
+    def __init__(self, field_graph: FieldGraph, num_records: int,
+                 columns: typing.Dict[str, ColumnChunk]) -> None:
+        super().__init__()
+        self._field_graph = field_graph
+        self._num_records = num_records
+        self._columns = columns
+
+    @property
+    def columns(self) -> typing.Dict[str, ColumnChunk]:
+        return self._columns
+
+    def num_records(self) -> int:
+        return self._num_records
+
+    def create_field_reader(self, field_path: str) -> FieldReader:
+        field_node = self._field_graph.get_field(field_path)
+        if field_path in self._columns and field_node:
+            return ChunkedFieldReader([self._columns[field_path]], field_node)
+        return None
+
+    def list_fields(self) -> typing.List[str]:
+        return list(self._columns.keys())
+
+    @property
+    def field_graph(self):
+        return self._field_graph
+
+    def can_skip(self, predicates: typing.List[Predicate]) -> bool:
+        for predicate in predicates:
+            chunk = self._columns.get(f'{ROOT}.{predicate.field}')
+            if chunk is not None and predicate.can_skip(chunk.statistics, chunk.bloom_filter):
+                return True
+        return False
+
+
+def check_same_fields(expected: FieldGraph, actual: FieldGraph) -> None:
+    """ Row groups can only be mixed if columns are shredded the same way. """
+    if expected.fingerprint != actual.fingerprint:
+        raise FieldGraphError('Fields of row groups mismatch')
+
+
+class ChunkedFieldStorage(FieldStorage):
+    """ Storage made of row groups, which can be pruned by chunk metadata in scans.
+
+    Row groups are replaced as a whole on appends, so readers and scans already
+    started keep reading the snapshot they began with.
+    """
+    def __init__(self, field_graph: FieldGraph, row_groups: typing.List[RowGroup],
+                 snapshot_id: int = 0) -> None:
+        super().__init__()
+        self._field_graph = field_graph
+        self._row_groups = row_groups
+        self._snapshot_id = snapshot_id
+        self._publish_lock = threading.Lock()
+        self._storage_id = uuid.uuid4().hex
+
+    @property
+    def snapshot_id(self) -> int:
+        """ Bumped by every change of row groups. """
+        return self._snapshot_id
+
+    def snapshot_key(self) -> typing.Tuple[str, int]:
+        with self._publish_lock:
+            return self._storage_id, self._snapshot_id
+
+    def row_groups(self) -> typing.List[RowGroup]:
+        return list(self._row_groups)
+
+    def append(self, storage: 'ChunkedFieldStorage') -> int:
+        """ Add row groups of `storage` after ours, returning the new snapshot id. """
+        check_same_fields(self._field_graph, storage.field_graph)
+        row_groups = [RowGroup(self._field_graph, g.num_records(), g.columns) for g in storage.row_groups()]
+        with self._publish_lock:
+            return self._publish(self._row_groups + row_groups)
+
+    def _replace(self, old: typing.List[RowGroup], new: typing.List[RowGroup]) -> int:
+        """ Publish a snapshot with leading row groups `old` replaced by `new`. """
+        with self._publish_lock:
+            current = self._row_groups
+            if len(current) < len(old) or any(a is not b for a, b in zip(old, current)):
+                raise ReadError('Row groups changed by another writer')
+            return self._publish(new + current[len(old):])
+
+    def _publish(self, row_groups: typing.List[RowGroup]) -> int:
+        # NOTE(me): a single assignment, so concurrent readers see either snapshot
+        self._row_groups = row_groups
+        self._snapshot_id += 1
+        return self._snapshot_id
+
+    def num_records(self) -> int:
+        return sum(g.num_records() for g in self._row_groups)
+
+    def create_field_reader(self, field_path: str) -> FieldReader:
+        field_node = self._field_graph.get_field(field_path)
+        if field_node is None or field_node.field_index is None:
+            # not a leaf
+            return None
+        return ChunkedFieldReader([g.columns[field_path] for g in self._row_groups], field_node)
+
+    def list_fields(self) -> typing.List[str]:
+        return [node.path for node in self._field_graph.root.leaf_nodes]
+
+    @property
+    def field_graph(self):
+        return self._field_graph
+
+    def can_skip(self, predicates: typing.List[Predicate]) -> bool:
+        return all(g.can_skip(predicates) for g in self._row_groups)
+
+
+class ChunkedFieldReader(FieldReader):
+    def __init__(self, chunks: typing.List[ColumnChunk], node: FieldNode) -> None:
+        super().__init__()
+        self._chunks = chunks
+        self._node = node
+        self._max_definition_level = node.definition_level
+        self._chunk_index = 0
+        self._pos = -1  # need an initial fetch()/next()
+        self._value_index = 0
+        self._load_chunk(0)
+
+    @property
+    def descriptor(self) -> 'SchemaFieldDescriptor':
+        return self._node.descriptor
+
+    @property
+    def field_node(self) -> FieldNode:
+        return self._node
+
+    def _load_chunk(self, index: int) -> None:
+        if 0 < index <= len(self._chunks):
+            self._chunks[index - 1].release()
+        self._chunk_index = index
+        self._value_index = 0
+        self._buffers = None
+        if index < len(self._chunks):
+            chunk = self._chunks[index]
+            if index + 1 < len(self._chunks):
+                self._chunks[index + 1].prefetch()
+            self._repetition_levels = chunk.repetition_levels
+            self._definition_levels = chunk.definition_levels
+            self._values = chunk.values
+        else:
+            self._repetition_levels = self._definition_levels = self._values = ()
+
+    def repetition_level(self) -> int:
+        if not self.done():
+            self._check_pos()
+            return self._repetition_levels[self._pos]
+        return 0
+
+    def next_repetition_level(self) -> int:
+        if self._pos + 1 < len(self._repetition_levels):
+            return self._repetition_levels[self._pos + 1]
+        # a new chunk always starts a new record
+        return 0
+
+    def definition_level(self) -> int:
+        if not self.done():
+            self._check_pos()
+            return self._definition_levels[self._pos]
+        return 0
+
+    def value(self) -> typing.Any:
+        if not self.done():
+            self._check_pos()
+            if self._definition_levels[self._pos] == self._max_definition_level:
+                return self._values[self._value_index]
+        return None
+
+    def done(self) -> bool:
+        return self._chunk_index >= len(self._chunks)
+
+    def next(self) -> None:
+        if self.done():
+            return
+        if self._pos >= 0 and self._definition_levels[self._pos] == self._max_definition_level:
+            self._value_index += 1
+        self._pos += 1
+        while self._pos >= len(self._repetition_levels) and not self.done():
+            self._load_chunk(self._chunk_index + 1)
+            self._pos = 0
+
+    def read_batch(self, max_size: typing.Optional[int] = None) ->\
+        typing.Optional[typing.Tuple[typing.Sequence[int], typing.Sequence[int], typing.Sequence[typing.Any]]]:
+        """ Read following entries in bulk, up to the end of the current chunk. """
+        entries = self._read_entries(max_size)
+        if entries is None:
+            return None
+        start, end, value_start, value_end = entries
+        return (as_sequence(self._repetition_levels[start:end]), as_sequence(self._definition_levels[start:end]),
+                as_sequence(self._values[value_start:value_end]))
+
+    def read_buffers(self, max_size: typing.Optional[int] = None) -> typing.Optional[ColumnBuffers]:
+        """ Same as `read_batch`, with slices of the chunk buffers without copies. """
+        entries = self._read_entries(max_size)
+        if entries is None:
+            return None
+        if self._buffers is None:
+            self._buffers = self._chunks[self._chunk_index].buffers()
+        start, end, value_start, value_end = entries
+        reps, defs, values = self._buffers
+        return ColumnBuffers(reps[start:end], defs[start:end], values[value_start:value_end])
+
+    def _read_entries(self, max_size: typing.Optional[int]) -> typing.Optional[typing.Tuple[int, int, int, int]]:
+        """ Move over following entries of the current chunk, returning their ranges of levels and values. """
+        if self.done():
+            return None
+        start = self._pos + 1
+        value_start = self._value_index
+        if self._pos >= 0 and self._definition_levels[self._pos] == self._max_definition_level:
+            value_start += 1
+        while start >= len(self._repetition_levels):
+            self._load_chunk(self._chunk_index + 1)
+            if self.done():
+                return None
+            start = value_start = 0
+
+        end = len(self._repetition_levels)
+        if max_size is not None:
+            end = min(end, start + max_size)
+        count = as_sequence(self._definition_levels[start:end]).count(self._max_definition_level)
+
+        # stay at the last entry read
+        self._pos = end - 1
+        self._value_index = value_start + count
+        if self._definition_levels[end - 1] == self._max_definition_level:
+            self._value_index -= 1
+        return start, end, value_start, value_start + count
+
+    def _check_pos(self):
+        if self._pos == -1:
+            raise ReadError('No initial fetch already')
+
+
+def build_column_chunk(cpp_type: int, repetition_levels: typing.Iterable[int],
+                       definition_levels: typing.Iterable[int], values: typing.Iterable[typing.Any],
+                       bloom_filter_fp_rate: typing.Optional[float] = None) -> ColumnChunk:
+    """ Column chunk in compact arrays with statistics, and a Bloom filter if `bloom_filter_fp_rate`. """
+    reps, defs, values = array.array('B', repetition_levels), array.array('B', definition_levels), \
+        as_array(cpp_type, values)
+    statistics = ColumnStatistics(len(reps), len(reps) - len(values),
+                                  min(values) if values else None,
+                                  max(values) if values else None)
+    bloom_filter = None
+    if bloom_filter_fp_rate is not None:
+        bloom_filter = BloomFilter.for_capacity(len(values), bloom_filter_fp_rate)
+        bloom_filter.update(values)
+    return ColumnChunk(reps, defs, values, statistics, bloom_filter)
+
+
+class ChunkedStorageWriter(object):
+    """ Shred records into row groups of `row_group_size` records.
+
+    Bloom filters are built for leaf fields in `bloom_filter_fields` (paths
+    like `name.url`), sized by the number of values in each chunk.
+    """
+    def __init__(self, writer: 'MessageWriter',
+                 row_group_size: int = DEFAULT_ROW_GROUP_SIZE,
+                 bloom_filter_fields: typing.Optional[typing.List[str]] = None,
+                 bloom_filter_fp_rate: float = 0.01) -> None:
+        super().__init__()
+        if row_group_size <= 0:
+            from dremel.writer import DissectError
+            raise DissectError(f'Invalid row group size: {row_group_size}')
+        self._writer = writer
+        self._row_group_size = row_group_size
+        self._bloom_filter_paths = set(f'{ROOT}.{f}' for f in bloom_filter_fields or [])
+        self._bloom_filter_fp_rate = bloom_filter_fp_rate
+        self._row_groups = []
+        self._num_records = 0
+        self._cols = dict()
+        profile = profiling.get_profile()
+        if profile is not None:
+            self._write = profile.timer('shred').wrap(self._write)
+            self._encode = profile.timer('encode').wrap(self._encode)
+        for leaf in writer.leaf_nodes:
+            self._cols[leaf.path] = ([], [], [])
+            leaf.set_write_callback(self._append)
+
+    @property
+    def field_graph(self) -> FieldGraph:
+        return self._writer.field_graph
+
+    def _write(self, msg: 'Message') -> None:
+        self._writer.write(msg)
+
+    def _append(self, node, r, d, v):
+        reps, defs, values = self._cols[node.path]
+        reps.append(r)
+        defs.append(d)
+        if d == node.definition_level:
+            values.append(v)
+
+    def write(self, msg: 'Message') -> None:
+        self._write(msg)
+        self._num_records += 1
+        if self._num_records >= self._row_group_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if self._num_records == 0:
+            return
+        self._encode()
+
+    def _encode(self) -> None:
+        columns = dict()
+        for path, (reps, defs, values) in self._cols.items():
+            cpp_type = self.field_graph.get_field(path).descriptor.cpp_type
+            fp_rate = self._bloom_filter_fp_rate if path in self._bloom_filter_paths else None
+            columns[path] = build_column_chunk(cpp_type, reps, defs, values, fp_rate)
+            self._cols[path] = ([], [], [])
+        self._row_groups.append(RowGroup(self.field_graph, self._num_records, columns))
+        self._num_records = 0
+
+    def close(self) -> ChunkedFieldStorage:
+        self.flush()
+        return ChunkedFieldStorage(self.field_graph, self._row_groups)
+
+
+def create_chunked_storage(desc: 'Descriptor', msgs: typing.Iterable['Message'], fields=None,
+                           row_group_size: int = DEFAULT_ROW_GROUP_SIZE,
+                           bloom_filter_fields: typing.Optional[typing.List[str]] = None) -> ChunkedFieldStorage:
+    from dremel.writer import new_message_writer
+    writer = ChunkedStorageWriter(new_message_writer(desc, fields), row_group_size, bloom_filter_fields)
+    for msg in msgs:
+        writer.write(msg)
+    return writer.close()
+
+
+def append_records(storage: ChunkedFieldStorage, desc: 'Descriptor', msgs: typing.Iterable['Message'],
+                   row_group_size: int = DEFAULT_ROW_GROUP_SIZE,
+                   bloom_filter_fields: typing.Optional[typing.List[str]] = None) -> int:
+    """ Shred only `msgs` into new row groups of `storage`, returning the new snapshot id.
+
+    Fields are the ones of `storage`, and Bloom filters are built for the same
+    fields as in its last row group unless `bloom_filter_fields` is given.
+    """
+    fields = [path[len(ROOT) + 1:] for path in storage.list_fields()]
+    if bloom_filter_fields is None:
+        row_groups = storage.row_groups()
+        bloom_filter_fields = [path[len(ROOT) + 1:] for path, chunk in row_groups[-1].columns.items()
+                               if chunk.bloom_filter is not None] if row_groups else []
+    from dremel.writer import new_message_writer
+    writer = ChunkedStorageWriter(new_message_writer(desc, fields), row_group_size, bloom_filter_fields)
+    check_same_fields(storage.field_graph, writer.field_graph)
+    for msg in msgs:
+        writer.write(msg)
+    return storage.append(writer.close())
+
+
+def _merge_row_groups(field_graph: FieldGraph, row_groups: typing.List[RowGroup],
+                      bloom_filter_fp_rate: float) -> RowGroup:
+    """ Concatenate level and value streams of chunks, without assembling records. """
+    columns = dict()
+    for path in row_groups[0].columns:
+        chunks = [g.columns[path] for g in row_groups]
+        cpp_type = field_graph.get_field(path).descriptor.cpp_type
+        has_bloom_filter = any(c.bloom_filter is not None for c in chunks)
+        columns[path] = build_column_chunk(
+            cpp_type,
+            itertools.chain.from_iterable(c.repetition_levels for c in chunks),
+            itertools.chain.from_iterable(c.definition_levels for c in chunks),
+            itertools.chain.from_iterable(c.values[0:len(c.values)] for c in chunks),
+            bloom_filter_fp_rate if has_bloom_filter else None)
+    return RowGroup(field_graph, sum(g.num_records() for g in row_groups), columns)
+
+
+def compact_row_groups(field_graph: FieldGraph, row_groups: typing.List[RowGroup],
+                       target_size: int = DEFAULT_ROW_GROUP_SIZE,
+                       bloom_filter_fp_rate: float = 0.01) -> typing.List[RowGroup]:
+    """ Merge runs of adjacent row groups up to `target_size` records, keeping the others as they are. """
+    if target_size <= 0:
+        from dremel.writer import DissectError
+        raise DissectError(f'Invalid row group size: {target_size}')
+    compacted = []
+    run, run_size = [], 0
+    def _flush():
+        if len(run) == 1:
+            compacted.append(run[0])
+        elif run:
+            compacted.append(_merge_row_groups(field_graph, run, bloom_filter_fp_rate))
+    for group in row_groups:
+        if run and run_size + group.num_records() > target_size:
+            _flush()
+            run, run_size = [], 0
+        run.append(group)
+        run_size += group.num_records()
+    _flush()
+    return compacted
+
+
+def compact(storage: ChunkedFieldStorage, target_size: int = DEFAULT_ROW_GROUP_SIZE,
+            bloom_filter_fp_rate: float = 0.01) -> int:
+    """ Compact small row groups of `storage` into a new snapshot, returning its id.
+
+    Readers and scans already started keep the row groups they began with, and
+    row groups appended meanwhile are kept after the compacted ones. Opened
+    column files raise `FileError`, they are compacted by `file.compact_file`.
+    """
+    row_groups = storage.row_groups()
+    compacted = compact_row_groups(storage.field_graph, row_groups, target_size, bloom_filter_fp_rate)
+    if len(compacted) == len(row_groups):
+        return storage.snapshot_id
+    return storage._replace(row_groups, compacted)
@@ -4,3 +4,22 @@
 # messages in `FieldDescriptor.full_name`.
 # eg, `Document.doc_id` -> `{ROOT}.doc_id`
 ROOT = '__root__'
+
+# Same values as `google.protobuf.descriptor.FieldDescriptor`, so modules reading
+# storages never need to import protobuf.
+CPPTYPE_INT32 = 1
+CPPTYPE_INT64 = 2
+CPPTYPE_UINT32 = 3
+CPPTYPE_UINT64 = 4
+CPPTYPE_DOUBLE = 5
+CPPTYPE_FLOAT = 6
+CPPTYPE_BOOL = 7
+CPPTYPE_ENUM = 8
+CPPTYPE_STRING = 9
+CPPTYPE_MESSAGE = 10
+
+LABEL_OPTIONAL = 1
+LABEL_REQUIRED = 2
+LABEL_REPEATED = 3
+
+TYPE_BYTES = 12
@@ -0,0 +1,296 @@
+#!/usr/bin/env python
+
+import array
+import bz2
+import itertools
+import lzma
+import struct
+import sys
+import typing
+import zlib
+
+from dremel.consts import *
+
+
+class EncodingError(Exception):
+    pass
+
+
+# name => (compress, decompress)
+CODECS = {
+    'none': (bytes, bytes),
+    'zlib': (zlib.compress, zlib.decompress),
+    'bz2': (bz2.compress, bz2.decompress),
+    'lzma': (lzma.compress, lzma.decompress),
+}
+
+# Pick a codec by compressing a sample of the data if configured as `auto`.
+AUTO = 'auto'
+AUTO_CODECS = ['zlib', 'bz2', 'lzma']
+AUTO_SAMPLE_SIZE = 1 << 16
+AUTO_MIN_SAVING = 0.1
+
+
+def compress(codec: str, data: bytes) -> bytes:
+    if codec not in CODECS:
+        raise EncodingError(f'Unknown codec: {codec}')
+    return CODECS[codec][0](data)
+
+
+def decompress(codec: str, data: bytes) -> bytes:
+    if codec not in CODECS:
+        raise EncodingError(f'Unknown codec: {codec}')
+    return CODECS[codec][1](data)
+
+
+def choose_codec(data: bytes, candidates: typing.Optional[typing.List[str]] = None) -> str:
+    """ Pick the codec compressing a sample of `data` best, or `none` if none pays off. """
+    sample = data[:AUTO_SAMPLE_SIZE]
+    if not sample:
+        return 'none'
+    best, best_size = 'none', len(sample) * (1.0 - AUTO_MIN_SAVING)
+    for codec in candidates or AUTO_CODECS:
+        size = len(compress(codec, sample))
+        if size < best_size:
+            best, best_size = codec, size
+    return best
+
+
+# cpp_type => typecode of fixed width values
+_TYPECODES = {
+    CPPTYPE_INT32: 'i',
+    CPPTYPE_INT64: 'q',
+    CPPTYPE_UINT32: 'I',
+    CPPTYPE_UINT64: 'Q',
+    CPPTYPE_DOUBLE: 'd',
+    CPPTYPE_FLOAT: 'f',
+    CPPTYPE_ENUM: 'i',
+}
+
+_STR = 0
+_BYTES = 1
+
+# encodings of values
+PLAIN = 'plain'
+DELTA = 'delta'
+DELTA_OF_DELTA = 'delta_of_delta'
+FRAME_OF_REFERENCE = 'frame_of_reference'
+INT_ENCODINGS = [PLAIN, DELTA, DELTA_OF_DELTA, FRAME_OF_REFERENCE]
+
+_HEADER = struct.Struct('<IB')
+_REFERENCE_SIZE = 9  # enough for both int64 and uint64 with signs
+
+
+def _to_bytes(a: array.array) -> bytes:
+    if sys.byteorder != 'little':
+        a = array.array(a.typecode, a)
+        a.byteswap()
+    return a.tobytes()
+
+
+def _from_bytes(typecode: str, data: bytes) -> array.array:
+    a = array.array(typecode)
+    a.frombytes(data)
+    if sys.byteorder != 'little':
+        a.byteswap()
+    return a
+
+
+def encode_levels(levels: typing.Sequence[int]) -> bytes:
+    return bytes(levels)
+
+
+def decode_levels(data: bytes) -> typing.Sequence[int]:
+    return data
+
+
+def fixed_width_typecode(cpp_type: int) -> typing.Optional[str]:
+    """ Typecode of `array` for fixed width values, or None. """
+    return _TYPECODES.get(cpp_type)
+
+
+def is_integer_type(cpp_type: int) -> bool:
+    return cpp_type in _TYPECODES and _TYPECODES[cpp_type] not in ('d', 'f')
+
+
+def as_array(cpp_type: int, values: typing.Iterable[typing.Any]) -> typing.Sequence[typing.Any]:
+    """ Compact in-memory values, typed arrays for numbers. """
+    if cpp_type in _TYPECODES:
+        return array.array(_TYPECODES[cpp_type], values)
+    return list(values)
+
+
+def as_buffer(values: typing.Sequence[typing.Any]) -> typing.Union[memoryview, typing.Sequence[typing.Any]]:
+    """ Zero-copy memoryview of typed arrays or bytes, or `values` itself if not a buffer. """
+    try:
+        return memoryview(values)
+    except TypeError:
+        return values
+
+
+def as_sequence(values: typing.Sequence[typing.Any]) -> typing.Sequence[typing.Any]:
+    """ Copy memoryviews into bytes or typed arrays, which have all methods of sequences. """
+    if not isinstance(values, memoryview):
+        return values
+    if values.format == 'B':
+        return values.tobytes()
+    a = array.array(values.format)
+    a.frombytes(values.cast('B'))
+    return a
+
+
+def _packed_typecode(width: int) -> typing.Optional[str]:
+    """ Typecode of `array` holding values of exactly `width` bits, for byte-aligned widths. """
+    for typecode in ('B', 'H', 'I', 'L', 'Q'):
+        if array.array(typecode).itemsize * 8 == width:
+            return typecode
+    return None
+
+
+_PACKED_TYPECODES = dict((w, _packed_typecode(w)) for w in (8, 16, 32, 64))
+
+
+def _pack_bits(values: typing.List[int], width: int) -> bytes:
+    """ Pack non-negative ints by `width` bits each, the first one in the lowest bits. """
+    if width == 0 or not values:
+        return b''
+    typecode = _PACKED_TYPECODES.get(width)
+    if typecode is not None:
+        return _to_bytes(array.array(typecode, values))
+    # NOTE(me): 8 values fill `width` bytes, so each group is packed as one int by shifts
+    n = len(values)
+    values = list(values) + [0] * (-n % 8)
+    shifts = range(0, 8 * width, width)
+    data = b''.join(sum(v << s for v, s in zip(values[i:i + 8], shifts)).to_bytes(width, 'little')
+                    for i in range(0, len(values), 8))
+    return data[:(n * width + 7) // 8]
+
+
+def _unpack_bits(data: bytes, width: int, n: int) -> typing.List[int]:
+    if width == 0:
+        return [0] * n
+    typecode = _PACKED_TYPECODES.get(width)
+    if typecode is not None:
+        a = array.array(typecode)
+        a.frombytes(data[:n * a.itemsize])
+        if sys.byteorder != 'little':
+            a.byteswap()
+        return a.tolist()
+    data = bytes(data) + bytes(-(-n // 8) * width - len(data))
+    mask = (1 << width) - 1
+    shifts = range(0, 8 * width, width)
+    values = []
+    for i in range(0, len(data), width):
+        group = int.from_bytes(data[i:i + width], 'little')
+        values.extend((group >> s) & mask for s in shifts)
+    del values[n:]
+    return values
+
+
+def _encode_for(values: typing.List[int]) -> bytes:
+    """ Frame of reference: bit-packed offsets from the minimum. """
+    if not values:
+        return _HEADER.pack(0, 0)
+    reference = min(values)
+    width = (max(values) - reference).bit_length()
+    return (_HEADER.pack(len(values), width) +
+            reference.to_bytes(_REFERENCE_SIZE, 'little', signed=True) +
+            _pack_bits([v - reference for v in values], width))
+
+
+def _decode_for(data: bytes, pos: int = 0) -> typing.List[int]:
+    n, width = _HEADER.unpack_from(data, pos)
+    if n == 0:
+        return []
+    pos += _HEADER.size
+    reference = int.from_bytes(data[pos:pos+_REFERENCE_SIZE], 'little', signed=True)
+    pos += _REFERENCE_SIZE
+    return [v + reference for v in _unpack_bits(data[pos:pos + (n * width + 7) // 8], width, n)]
+
+
+def _deltas(values: typing.Sequence[int]) -> typing.List[int]:
+    return [b - a for a, b in zip(values, values[1:])]
+
+
+def _encode_int(encoding: str, values: typing.Sequence[int]) -> bytes:
+    values = list(values)
+    if encoding == FRAME_OF_REFERENCE:
+        return _encode_for(values)
+    # leading values are kept as they are, followed by bit-packed deltas
+    heads, residuals = values[:1], _deltas(values)
+    if encoding == DELTA_OF_DELTA:
+        heads, residuals = values[:1] + residuals[:1], _deltas(residuals)
+    return (struct.pack('<B', len(heads)) +
+            b''.join(h.to_bytes(_REFERENCE_SIZE, 'little', signed=True) for h in heads) +
+            _encode_for(residuals))
+
+
+def _decode_int(encoding: str, data: bytes) -> typing.List[int]:
+    if encoding == FRAME_OF_REFERENCE:
+        return _decode_for(data)
+    n = data[0]
+    heads = [int.from_bytes(data[1+i*_REFERENCE_SIZE:1+(i+1)*_REFERENCE_SIZE], 'little', signed=True)
+             for i in range(n)]
+    residuals = _decode_for(data, 1 + n * _REFERENCE_SIZE)
+    if encoding == DELTA_OF_DELTA and len(heads) == 2:
+        residuals = list(itertools.accumulate(heads[1:] + residuals))
+    return list(itertools.accumulate(heads[:1] + residuals))
+
+
+def choose_encoding(cpp_type: int, values: typing.Sequence[typing.Any]) -> str:
+    """ Pick the integer encoding with the fewest bits per value, or plain for other types. """
+    if not is_integer_type(cpp_type) or len(values) < 2:
+        return PLAIN
+    def width(residuals):
+        return (max(residuals) - min(residuals)).bit_length() if residuals else 0
+    deltas = _deltas(values)
+    sizes = [
+        (array.array(_TYPECODES[cpp_type]).itemsize * 8, PLAIN),
+        (width(values), FRAME_OF_REFERENCE),
+        (width(deltas), DELTA),
+        (width(_deltas(deltas)), DELTA_OF_DELTA),
+    ]
+    return min(sizes, key=lambda e: e[0])[1]
+
+
+def encode_values(cpp_type: int, values: typing.Sequence[typing.Any], encoding: str = PLAIN) -> bytes:
+    """ Encode defined values of a leaf column, in little endian if plain. """
+    if encoding != PLAIN:
+        if encoding not in INT_ENCODINGS or not is_integer_type(cpp_type):
+            raise EncodingError(f'Invalid encoding {encoding} for cpp type: {cpp_type}')
+        return _encode_int(encoding, values)
+    if cpp_type in _TYPECODES:
+        return _to_bytes(array.array(_TYPECODES[cpp_type], values))
+    if cpp_type == CPPTYPE_BOOL:
+        return bytes(bytearray(values))
+    if cpp_type == CPPTYPE_STRING:
+        kind = _BYTES if values and isinstance(values[0], bytes) else _STR
+        blobs = [v.encode('utf-8') for v in values] if kind == _STR else list(values)
+        lengths = array.array('I', [len(b) for b in blobs])
+        return struct.pack('<BI', kind, len(blobs)) + _to_bytes(lengths) + b''.join(blobs)
+    raise EncodingError(f'Unsupported cpp type: {cpp_type}')
+
+
+def decode_values(cpp_type: int, data: bytes, encoding: str = PLAIN) -> typing.Sequence[typing.Any]:
+    """ Decode values in bulk, into typed arrays for numbers. """
+    if encoding != PLAIN:
+        if encoding not in INT_ENCODINGS or not is_integer_type(cpp_type):
+            raise EncodingError(f'Invalid encoding {encoding} for cpp type: {cpp_type}')
+        return array.array(_TYPECODES[cpp_type], _decode_int(encoding, data))
+    if cpp_type in _TYPECODES:
+        return _from_bytes(_TYPECODES[cpp_type], data)
+    if cpp_type == CPPTYPE_BOOL:
+        return [b != 0 for b in data]
+    if cpp_type == CPPTYPE_STRING:
+        kind, n = struct.unpack_from('<BI', data)
+        start = struct.calcsize('<BI')
+        lengths = _from_bytes('I', data[start:start + 4 * n])
+        pos = start + 4 * n
+        values = []
+        view = memoryview(data)
+        for length in lengths:
+            blob = view[pos:pos + length]
+            values.append(str(blob, 'utf-8') if kind == _STR else bytes(blob))
+            pos += length
+        return values
+    raise EncodingError(f'Unsupported cpp type: {cpp_type}')
@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+
+import array
+import typing
+
+from dremel.consts import *
+from dremel.field_graph import FieldGraph, FieldNode
+from dremel.predicate import Predicate
+from dremel.reader import FieldReader, FieldStorage, ReadError
+
+if typing.TYPE_CHECKING:
+    from dremel.schema_pb2 import SchemaFieldDescriptor
+
+
+class EvolutionError(Exception):
+    pass
+
+
+class NullFieldReader(FieldReader):
+    """ Reader of a column missing from a storage, NULL at every entry of the given levels. """
+    __slots__ = ('_node', '_repetition_levels', '_definition_levels', '_pos')
+
+    def __init__(self, node: FieldNode, repetition_levels: typing.Sequence[int],
+                 definition_levels: typing.Sequence[int]) -> None:
+        super().__init__()
+        self._node = node
+        self._repetition_levels = repetition_levels
+        self._definition_levels = definition_levels
+        self._pos = -1  # need an initial fetch()/next()
+
+    @property
+    def descriptor(self) -> 'SchemaFieldDescriptor':
+        return self._node.descriptor
+
+    @property
+    def field_node(self) -> FieldNode:
+        return self._node
+
+    def repetition_level(self) -> int:
+        if not self.done():
+            self._check_pos()
+            return self._repetition_levels[self._pos]
+        return 0
+
+    def next_repetition_level(self) -> int:
+        if self._pos + 1 < len(self._repetition_levels):
+            return self._repetition_levels[self._pos + 1]
+        return 0
+
+    def definition_level(self) -> int:
+        if not self.done():
+            self._check_pos()
+            return self._definition_levels[self._pos]
+        return 0
+
+    def value(self) -> typing.Any:
+        return None
+
+    def done(self) -> bool:
+        return self._pos >= len(self._repetition_levels)
+
+    def next(self) -> None:
+        if not self.done():
+            self._pos += 1
+
+    def read_batch(self, max_size: typing.Optional[int] = None) ->\
+        typing.Optional[typing.Tuple[typing.Sequence[int], typing.Sequence[int], typing.Sequence[typing.Any]]]:
+        start = self._pos + 1
+        if start >= len(self._repetition_levels):
+            self._pos = len(self._repetition_levels)
+            return None
+        end = len(self._repetition_levels) if max_size is None else min(len(self._repetition_levels), start + max_size)
+        # stay at the last entry read
+        self._pos = end - 1
+        return self._repetition_levels[start:end], self._definition_levels[start:end], []
+
+    def _check_pos(self):
+        if self._pos == -1:
+            raise ReadError('No initial fetch already')
+
+
+class _EvolvedFieldReader(FieldReader):
+    """ Reader of a stored column, seen as a field of the newer graph. """
+    def __init__(self, reader: FieldReader, node: FieldNode) -> None:
+        super().__init__()
+        self._node = node
+        # NOTE(me): bound methods of the stored reader, so values are not read through another call
+        self.repetition_level = reader.repetition_level
+        self.next_repetition_level = reader.next_repetition_level
+        self.definition_level = reader.definition_level
+        self.value = reader.value
+        self.done = reader.done
+        self.next = reader.next
+        self.skip_record = reader.skip_record
+        self.read_batch = reader.read_batch
+        self.read_buffers = reader.read_buffers
+
+    @property
+    def descriptor(self) -> 'SchemaFieldDescriptor':
+        return self._node.descriptor
+
+    @property
+    def field_node(self) -> FieldNode:
+        return self._node
+
+
+class _Column(object):
+    """ How a leaf of the newer graph is read from a storage of the older one. """
+    def __init__(self, stored_path: typing.Optional[str] = None, anchor: typing.Optional[FieldNode] = None,
+                 sibling_path: typing.Optional[str] = None) -> None:
+        super().__init__()
+        # stored column, or None if the column is missing
+        self.stored_path = stored_path
+        # nearest ancestor stored for missing columns, and a stored leaf under it for its levels
+        self.anchor = anchor
+        self.sibling_path = sibling_path
+
+
+def _check_same_levels(node: FieldNode, stored: FieldNode) -> None:
+    if (node.max_repetition_level, node.definition_level) != (stored.max_repetition_level, stored.definition_level):
+        raise EvolutionError(f'Levels of {node.path} changed from {stored.path}: '
+                             f'R={stored.max_repetition_level}, D={stored.definition_level} -> '
+                             f'R={node.max_repetition_level}, D={node.definition_level}')
+
+
+def _plan_columns(field_graph: FieldGraph, stored_graph: FieldGraph,
+                  aliases: typing.Dict[str, str]) -> typing.Dict[str, _Column]:
+    aliases = dict((f'{ROOT}.{k}', f'{ROOT}.{v}') for k, v in aliases.items())
+
+    def resolve(path):
+        # renames of messages apply to all fields under them
+        segs = path.split('.')
+        for i in range(len(segs), 0, -1):
+            prefix = '.'.join(segs[:i])
+            if prefix in aliases:
+                return '.'.join([aliases[prefix]] + segs[i:])
+        return path
+
+    columns = dict()
+    for leaf in field_graph.root.leaf_nodes:
+        stored = stored_graph.get_field(resolve(leaf.path))
+        if stored is not None:
+            if not stored.is_leaf():
+                raise EvolutionError(f'{leaf.path} is stored as a message: {stored.path}')
+            _check_same_levels(leaf, stored)
+            if leaf.descriptor.cpp_type != stored.descriptor.cpp_type:
+                raise EvolutionError(f'Type of {leaf.path} changed from {stored.path}: '
+                                     f'{stored.descriptor.cpp_type} -> {leaf.descriptor.cpp_type}')
+            columns[leaf.path] = _Column(stored_path=stored.path)
+            continue
+
+        anchor = leaf.parent
+        while anchor.parent is not None and stored_graph.get_field(resolve(anchor.path)) is None:
+            anchor = anchor.parent
+        stored_anchor = stored_graph.get_field(resolve(anchor.path))
+        sibling_path = None
+        if anchor.parent is not None:
+            _check_same_levels(anchor, stored_anchor)
+        if leaf.definition_level <= anchor.definition_level:
+            # NOTE(me): NULLs would read as defined, with no optional ancestor added above it
+            raise EvolutionError(f'Required field {leaf.path} is missing from the storage')
+        if stored_anchor.definition_level > 0:
+            # NOTE(me): the fewest repetitions under the anchor tell where it is defined
+            sibling = min(stored_anchor.leaf_nodes, key=lambda n: n.max_repetition_level)
+            sibling_path = sibling.path
+        columns[leaf.path] = _Column(anchor=stored_anchor, sibling_path=sibling_path)
+    return columns
+
+
+def _null_levels(storage: FieldStorage, column: _Column) -> typing.Tuple[typing.Sequence[int], typing.Sequence[int]]:
+    """ Levels of a missing column, from levels of its sibling column only if its anchor may be undefined. """
+    if column.sibling_path is None:
+        # one NULL per record
+        num_records = storage.num_records()
+        return array.array('B', bytes(num_records)), array.array('B', bytes(num_records))
+
+    max_repetition_level = column.anchor.max_repetition_level
+    max_definition_level = column.anchor.definition_level
+    chunk = getattr(storage, 'columns', dict()).get(column.sibling_path)
+    if chunk is not None:
+        entries = zip(chunk.repetition_levels, chunk.definition_levels)
+    else:
+        reader = storage.create_field_reader(column.sibling_path)
+        if reader is None:
+            raise ReadError(f'No field named "{column.sibling_path}"')
+        def _():
+            reader.next()
+            while not reader.done():
+                yield reader.repetition_level(), reader.definition_level()
+                reader.next()
+        entries = _()
+    reps, defs = array.array('B'), array.array('B')
+    for r, d in entries:
+        # deeper repetitions belong to the same occurrence of the anchor
+        if r <= max_repetition_level:
+            reps.append(r)
+            defs.append(min(d, max_definition_level))
+    return reps, defs
+
+
+def _plan_digest(columns: typing.Dict[str, _Column]) -> str:
+    """ Digest of the stored column, or the source of NULLs, read for every leaf. """
+    import hashlib
+    plan = sorted((path, c.stored_path, c.anchor.path if c.anchor is not None else None, c.sibling_path)
+                  for path, c in columns.items())
+    return hashlib.sha256(repr(plan).encode('utf-8')).hexdigest()
+
+
+class EvolvedFieldStorage(FieldStorage):
+    """ Storage of an older schema read as a newer `field_graph`.
+
+    Columns missing from the storage are read as NULLs, at levels known from
+    the schema alone if their nearest stored ancestor is always defined, or
+    from levels of a sibling column otherwise. Values are never read for
+    them, and added required fields must be under an added optional message.
+    `aliases` map paths of the newer graph (fields or messages) to
+    stored paths they are renamed from.
+    """
+    def __init__(self, storage: FieldStorage, field_graph: FieldGraph,
+                 aliases: typing.Optional[typing.Dict[str, str]] = None,
+                 columns: typing.Optional[typing.Dict[str, _Column]] = None) -> None:
+        super().__init__()
+        self._storage = storage
+        self._field_graph = field_graph
+        if columns is None:
+            columns = _plan_columns(field_graph, storage.field_graph, aliases or dict())
+        self._columns = columns
+
+    @property
+    def storage(self) -> FieldStorage:
+        return self._storage
+
+    @property
+    def field_graph(self) -> FieldGraph:
+        return self._field_graph
+
+    def missing_fields(self) -> typing.List[str]:
+        return [path for path, column in self._columns.items() if column.stored_path is None]
+
+    def create_field_reader(self, field_path: str) -> FieldReader:
+        column = self._columns.get(field_path)
+        if column is None:
+            return None
+        node = self._field_graph.get_field(field_path)
+        if column.stored_path is None:
+            return NullFieldReader(node, *_null_levels(self._storage, column))
+        reader = self._storage.create_field_reader(column.stored_path)
+        return _EvolvedFieldReader(reader, node) if reader is not None else None
+
+    def list_fields(self) -> typing.List[str]:
+        return list(self._columns.keys())
+
+    def num_records(self) -> int:
+        return self._storage.num_records()
+
+    def row_groups(self) -> typing.List[FieldStorage]:
+        row_groups = self._storage.row_groups()
+        if row_groups == [self._storage]:
+            return [self]
+        return [EvolvedFieldStorage(g, self._field_graph, columns=self._columns) for g in row_groups]
+
+    def can_skip(self, predicates: typing.List[Predicate]) -> bool:
+        # NOTE(me): only predicates on columns stored as they are, row groups are never pruned by the others
+        stored = []
+        for predicate in predicates:
+            column = self._columns.get(f'{ROOT}.{predicate.field}')
+            if column is not None and column.stored_path == f'{ROOT}.{predicate.field}':
+                stored.append(predicate)
+        return self._storage.can_skip(stored)
+
+    def snapshot_key(self) -> typing.Optional[typing.Tuple[typing.Hashable, int]]:
+        key = self._storage.snapshot_key()
+        if key is None:
+            return None
+        # NOTE(me): aliases change the columns read for one graph
+        return (key[0], self._field_graph.fingerprint, _plan_digest(self._columns)), key[1]
+
+
+def evolve(storage: FieldStorage, field_graph: FieldGraph,
+           aliases: typing.Optional[typing.Dict[str, str]] = None) -> EvolvedFieldStorage:
+    """ Read `storage` as `field_graph`, like the one of a newer schema loaded by `field_graph.load_schema`. """
+    return EvolvedFieldStorage(storage, field_graph, aliases)
@@ -1,33 +1,67 @@
 #!/usr/bin/env python
 
 import collections
+import os
 import typing
-from google.protobuf.descriptor import *
 
 from dremel.consts import *
 from dremel.node import Node, CompositeNode
-from dremel.schema_pb2 import Schema, SchemaFieldDescriptor, SchemaFieldGraph
+
+if typing.TYPE_CHECKING:
+    from dremel.schema_pb2 import Schema, SchemaFieldDescriptor, SchemaFieldGraph
 
 
 class FieldGraphError(Exception):
     pass
 
 
+class PlainFieldDescriptor(object):
+    """ Fields of `SchemaFieldDescriptor` without protobuf, for graphs loaded from storages. """
+    __slots__ = ('path', 'cpp_type', 'label', 'max_repetition_level', 'definition_level')
+
+    def __init__(self, path: str = '', cpp_type: int = 0, label: int = 0,
+                 max_repetition_level: int = 0, definition_level: int = 0) -> None:
+        super().__init__()
+        self.path = path
+        self.cpp_type = cpp_type
+        self.label = label
+        self.max_repetition_level = max_repetition_level
+        self.definition_level = definition_level
+
+    def __eq__(self, other) -> bool:
+        return all(getattr(self, k) == getattr(other, k, None) for k in self.__slots__)
+
+    def __repr__(self) -> str:
+        return f'<PlainFieldDescriptor:{self.path} cpp_type={self.cpp_type} label={self.label} ' \
+               f'R={self.max_repetition_level} D={self.definition_level}>'
+
+
 class FieldNode(CompositeNode):
-    """ FieldNode contributes to FieldGraph. """
-    def __init__(self, descriptor : SchemaFieldDescriptor):
+    """ FieldNode contributes to FieldGraph.
+
+    Path, name, label and levels of the descriptor are copied into plain attributes,
+    so that readers and assembly never go through protobuf getters.
+    """
+    __slots__ = ('_descriptor', '_field_index', '_is_leaf',
+                 'path', 'name', 'label', 'max_repetition_level', 'definition_level')
+
+    def __init__(self, descriptor : 'SchemaFieldDescriptor'):
         super().__init__()
         self._descriptor = descriptor
         self._field_index = None
+        # NOTE(me): descriptors are never changed after nodes are created
+        self.path = descriptor.path
+        self.name = descriptor.path.split('.')[-1]
+        self.label = descriptor.label
+        self.max_repetition_level = descriptor.max_repetition_level
+        self.definition_level = descriptor.definition_level
+        # BUG(me): root error?
+        self._is_leaf = descriptor.cpp_type != CPPTYPE_MESSAGE
 
     @property
-    def descriptor(self) -> SchemaFieldDescriptor:
+    def descriptor(self) -> 'SchemaFieldDescriptor':
         return self._descriptor
 
-    @property
-    def name(self) -> str:
-        return self._descriptor.path.split('.')[-1]
-
     @property
     def field_index(self) -> int:
         return self._field_index
@@ -37,14 +71,10 @@ class FieldNode(CompositeNode):
         self._field_index = index
 
     def is_leaf(self):
-        # BUG(me): root error?
-        return self._descriptor.cpp_type not in (
-            FieldDescriptor.TYPE_GROUP, FieldDescriptor.TYPE_MESSAGE)
+        return self._is_leaf
 
     def __repr__(self):
-        r = self.descriptor.max_repetition_level
-        d = self.descriptor.definition_level
-        return f'<FieldNode:{self.descriptor.path} leaf:{self.is_leaf()} R={r}, D={d}>'
+        return f'<FieldNode:{self.path} leaf:{self.is_leaf()} R={self.max_repetition_level}, D={self.definition_level}>'
 
     def lowest_common_ancestor_node_with(self, other):
         a = self._get_path_to_root()[::-1]
@@ -58,7 +88,7 @@ class FieldNode(CompositeNode):
         return common
 
     def common_repetition_level_with(self, other):
-        return self.lowest_common_ancestor_node_with(other).descriptor.max_repetition_level
+        return self.lowest_common_ancestor_node_with(other).max_repetition_level
 
     def _get_path_to_root(self):
         return self.get_path_to(None)
@@ -78,7 +108,8 @@ class FieldGraph(object):
     def __init__(self, root):
         self._root = root
         self._fields = dict()
-        def _(f): self._fields[f.descriptor.path] = f
+        self._fingerprint = None
+        def _(f): self._fields[f.path] = f
         self._root.node_accept(_)
         for i, node in enumerate(self._root.leaf_nodes):
             node.set_field_index(i)
@@ -96,39 +127,71 @@ class FieldGraph(object):
     def dump(self) -> str:
         return self.root.dump()
 
-    def to_field_graph(self) -> SchemaFieldGraph:
+    def layout(self) -> typing.List[typing.Tuple[str, int, int, int, int]]:
+        """ (path, cpp_type, label, max repetition level, definition level) of fields in pre-order. """
+        layout = []
+        def _(node):
+            desc = node.descriptor
+            # NOTE(me): roots of writers have no cpp_type, inner nodes are always messages
+            cpp_type = CPPTYPE_MESSAGE if node.child_nodes else desc.cpp_type
+            layout.append((node.path, cpp_type, node.label, node.max_repetition_level, node.definition_level))
+        self._root.node_accept(_)
+        return layout
+
+    @property
+    def fingerprint(self) -> str:
+        """ Hash of the layout, equal for graphs whose columns are shredded the same way. """
+        if self._fingerprint is None:
+            import hashlib
+            import json
+            data = json.dumps(self.layout(), separators=(',', ':')).encode('utf-8')
+            self._fingerprint = hashlib.sha256(data).hexdigest()
+        return self._fingerprint
+
+    def to_field_graph(self) -> 'SchemaFieldGraph':
+        from dremel.schema_pb2 import SchemaFieldGraph
         graph = SchemaFieldGraph()
         def _(node):
-            if not node.is_leaf():
-                edge = SchemaFieldGraph.Edge()
-                edge.from_field = node.descriptor.path
-                edge.to_fields = [c.descriptor.path for c in node.child_nodes]
-                graph.edges.add(edge)
+            if node.child_nodes:
+                edge = graph.edge.add()
+                edge.from_field = node.path
+                edge.to_fields.extend(c.path for c in node.child_nodes)
         self._root.node_accept(_)
         return graph
 
+    def to_schema(self) -> 'Schema':
+        """ Descriptors and edges of all fields, which `create_field_graph` turns back into this graph. """
+        from dremel.schema_pb2 import Schema
+        schema = Schema()
+        for path, cpp_type, label, max_repetition_level, definition_level in self.layout():
+            schema.field_descriptor.add(path=path, cpp_type=cpp_type, label=label,
+                                        max_repetition_level=max_repetition_level,
+                                        definition_level=definition_level)
+        schema.field_graph.CopyFrom(self.to_field_graph())
+        return schema
+
     def check_if_independently_repeated_fields(self, fields: typing.List[str]):
         level_to_nodes = dict()
 
         for field in fields:
             field_node = self.get_field(field)
 
-            current_level = field_node.descriptor.max_repetition_level
+            current_level = field_node.max_repetition_level
             current = field_node
             while (current.parent is not None and
-                   current.parent.descriptor.max_repetition_level == current_level):
+                   current.parent.max_repetition_level == current_level):
                 current = current.parent
 
             if current_level in level_to_nodes and level_to_nodes[current_level][0] != current:
                 raise FieldGraphError(f'Found multiple independently-repeated fields: \
-{field} (from {current.descriptor.path}) and \
+{field} (from {current.path}) and \
 {level_to_nodes[current_level][1]} \
-(from {level_to_nodes[current_level][0].descriptor.path}).')
+(from {level_to_nodes[current_level][0].path}).')
             else:
                 level_to_nodes[current_level] = (current, field)
 
 
-def create_field_graph(graph: Schema) -> FieldGraph:
+def create_field_graph(graph: 'Schema') -> FieldGraph:
     field_map = dict((f.path, f) for f in graph.field_descriptor)
     links = dict((edge.from_field, edge.to_fields[:]) for edge in graph.field_graph.edge)
 
@@ -157,3 +220,57 @@ def create_field_graph(graph: Schema) -> FieldGraph:
 
     root = create_node(ROOT)
     return FieldGraph(root)
+
+
+def save_schema(path: str, field_graph: FieldGraph) -> None:
+    """ Write the schema of `field_graph` into `path`, replacing it at once. """
+    data = field_graph.to_schema().SerializeToString(deterministic=True)
+    with open(f'{path}.tmp', 'wb') as fd:
+        fd.write(data)
+    os.replace(f'{path}.tmp', path)
+
+
+def load_schema(path: str) -> FieldGraph:
+    """ Field graph of a schema written by `save_schema`, without descriptors of messages. """
+    from dremel.schema_pb2 import Schema
+    with open(path, 'rb') as fd:
+        schema = Schema.FromString(fd.read())
+    return create_field_graph(schema)
+
+
+def field_graph_to_json(field_graph: FieldGraph) -> typing.List[dict]:
+    """ Fields of `field_graph` as plain dicts, for footers and headers of storages. """
+    fields = []
+    def _(node):
+        desc = node.descriptor
+        fields.append({
+            'path': desc.path,
+            'cpp_type': desc.cpp_type,
+            'label': desc.label,
+            'max_repetition_level': desc.max_repetition_level,
+            'definition_level': desc.definition_level,
+            'parent': node.parent.path if node.parent else None,
+        })
+    field_graph.root.node_accept(_)
+    return fields
+
+
+def field_graph_from_json(fields: typing.List[dict]) -> FieldGraph:
+    """ Field graph of fields saved by `field_graph_to_json`, without descriptors of messages. """
+    nodes = dict()
+    root = None
+    for field in fields:
+        node = FieldNode(PlainFieldDescriptor(
+            path=field['path'],
+            cpp_type=field['cpp_type'],
+            label=field['label'],
+            max_repetition_level=field['max_repetition_level'],
+            definition_level=field['definition_level']))
+        nodes[field['path']] = node
+        if field['parent'] is None:
+            root = node
+        else:
+            nodes[field['parent']].add_child(node)
+    if root is None:
+        raise FieldGraphError('No root field')
+    return FieldGraph(root)
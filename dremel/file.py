@@ -0,0 +1,732 @@
+#!/usr/bin/env python
+
+import bisect
+import contextlib
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+import typing
+import uuid
+
+try:
+    import fcntl
+except ImportError:
+    # NOTE(me): no advisory locks on Windows, where appends must not run concurrently
+    fcntl = None
+
+from dremel import profiling
+from dremel.cache import get_column_cache
+from dremel.consts import *
+from dremel.chunked import (DEFAULT_ROW_GROUP_SIZE, ChunkedFieldStorage, ColumnBuffers, ColumnChunk, RowGroup,
+                            compact_row_groups, decode_statistics, encode_statistics)
+from dremel.encoding import (AUTO, PLAIN, as_buffer, choose_codec, choose_encoding, compress, decompress,
+                             encode_levels, decode_levels, encode_values, decode_values, fixed_width_typecode)
+from dremel.field_graph import FieldGraph, FieldGraphError, FieldNode, field_graph_from_json, field_graph_to_json
+from dremel.sketch import BloomFilter
+
+if typing.TYPE_CHECKING:
+    import concurrent.futures
+
+# Layout: MAGIC | pages... | footer (json) | footer length (uint64) | MAGIC
+# Appends add pages and a footer of the new row groups, with the end of the previous footer.
+MAGIC = b'DRML'
+VERSION = 1
+DEFAULT_PAGE_SIZE = 4096
+_TRAILER = struct.Struct('<Q4s')
+
+_readahead_executor = None
+
+
+def _default_executor() -> 'concurrent.futures.Executor':
+    global _readahead_executor
+    if _readahead_executor is None:
+        import concurrent.futures
+        _readahead_executor = concurrent.futures.ThreadPoolExecutor(thread_name_prefix='dremel-readahead')
+    return _readahead_executor
+
+
+class FileError(Exception):
+    pass
+
+
+class _Output(object):
+    def __init__(self, fd, offset: int) -> None:
+        self._fd = fd
+        self._offset = offset
+
+    def write(self, data: bytes) -> typing.List[int]:
+        """ Write a page, returning its [offset, length]. """
+        self._fd.write(data)
+        page = [self._offset, len(data)]
+        self._offset += len(data)
+        return page
+
+
+def _write_column(out: _Output, node: FieldNode, chunk: ColumnChunk,
+                  codec: str, page_size: int) -> dict:
+    cpp_type = node.descriptor.cpp_type
+    values = chunk.values
+    values = values[0:len(values)]
+    encoding = choose_encoding(cpp_type, values)
+    pages = [(encode_values(cpp_type, values[i:i+page_size], encoding), len(values[i:i+page_size]))
+             for i in range(0, len(values), page_size)]
+    if codec == AUTO:
+        codec = choose_codec(pages[0][0] if pages else b'')
+
+    meta = {
+        'num_values': chunk.num_values,
+        'codec': codec,
+        'encoding': encoding,
+        'repetition_levels': out.write(compress(codec, encode_levels(chunk.repetition_levels))),
+        'definition_levels': out.write(compress(codec, encode_levels(chunk.definition_levels))),
+        'pages': [out.write(compress(codec, data)) + [count] for data, count in pages],
+        'statistics': encode_statistics(cpp_type, chunk.statistics),
+    }
+    bloom_filter = chunk.bloom_filter
+    if bloom_filter is not None:
+        meta['bloom_filter'] = {
+            'num_bits': bloom_filter.num_bits,
+            'num_hashes': bloom_filter.num_hashes,
+            'page': out.write(bloom_filter.to_bytes()),
+        }
+    return meta
+
+
+def _write_row_group(out: _Output, field_graph: FieldGraph, row_group: RowGroup,
+                     codecs: typing.Dict[str, str], default_codec: str, page_size: int) -> dict:
+    columns = dict()
+    for path, chunk in row_group.columns.items():
+        codec = codecs.get(path, default_codec)
+        columns[path] = _write_column(out, field_graph.get_field(path), chunk, codec, page_size)
+    return {'num_records': row_group.num_records(), 'columns': columns}
+
+
+def write_storage(path: str, storage: ChunkedFieldStorage,
+                  codecs: typing.Optional[typing.Dict[str, str]] = None,
+                  default_codec: str = AUTO,
+                  page_size: int = DEFAULT_PAGE_SIZE) -> None:
+    """ Save a storage made of row groups into a column file.
+
+    `codecs` maps leaf fields (like `name.url`) to codec names, and the others
+    use `default_codec`, which picks a codec per column chunk if `auto`.
+    """
+    _write_file(path, storage, codecs, default_codec, page_size, dict())
+
+
+def _write_file(path: str, storage: ChunkedFieldStorage, codecs: typing.Optional[typing.Dict[str, str]],
+                default_codec: str, page_size: int, extra: dict) -> None:
+    codecs = dict((f'{ROOT}.{k}', v) for k, v in (codecs or {}).items())
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as fd:
+        fd.write(MAGIC)
+        out = _Output(fd, len(MAGIC))
+        row_groups = [_write_row_group(out, storage.field_graph, g, codecs, default_codec, page_size)
+                      for g in storage.row_groups()]
+        _write_footer(fd, dict({
+            'version': VERSION,
+            'snapshot_id': storage.snapshot_id,
+            'file_id': uuid.uuid4().hex,
+            'fields': field_graph_to_json(storage.field_graph),
+            'fingerprint': storage.field_graph.fingerprint,
+            'row_groups': row_groups,
+        }, **extra))
+    os.replace(tmp_path, path)
+
+
+def _write_footer(fd, footer: dict) -> None:
+    data = json.dumps(footer).encode('utf-8')
+    fd.write(data)
+    fd.write(_TRAILER.pack(len(data), MAGIC))
+
+
+def _pread(fd: int, offset: int, length: int, path: str) -> bytes:
+    data = os.pread(fd, length, offset)
+    if len(data) != length:
+        raise FileError(f'Short read at {offset} of {path}')
+    return data
+
+
+# bytes read at once when looking for the last complete footer
+_SCAN_SIZE = 1 << 20
+
+
+def _trailer_ends(fd: int, size: int, path: str) -> typing.Generator[int, None, None]:
+    """ Offsets which may be ends of trailers, from the end of the file backwards. """
+    end = size
+    while True:
+        start = max(0, end - _SCAN_SIZE)
+        block = _pread(fd, start, end - start, path)
+        i = len(block)
+        while True:
+            i = block.rfind(MAGIC, 0, i + len(MAGIC) - 1)
+            if i < 0:
+                break
+            yield start + i + len(MAGIC)
+        if start == 0:
+            return
+        # a magic across blocks is found in the next one
+        end = start + len(MAGIC) - 1
+
+
+def _parse_footer(fd: int, end: int, path: str) -> typing.Optional[dict]:
+    """ Footer whose trailer ends at `end`, or None if there is no complete one. """
+    if end < len(MAGIC) + _TRAILER.size:
+        return None
+    length, magic = _TRAILER.unpack(_pread(fd, end - _TRAILER.size, _TRAILER.size, path))
+    start = end - _TRAILER.size - length
+    if magic != MAGIC or start < len(MAGIC):
+        return None
+    try:
+        footer = json.loads(_pread(fd, start, length, path).decode('utf-8'))
+    except ValueError:
+        return None
+    return footer if isinstance(footer, dict) and 'row_groups' in footer else None
+
+
+def _read_footer(fd: int, path: str) -> typing.Tuple[dict, int]:
+    """ Footer of the latest snapshot, with the size of the file it covers.
+
+    Bytes after the last complete footer, of an append being written or
+    killed, are not part of any snapshot and ignored.
+    """
+    size = os.fstat(fd).st_size
+    if size < len(MAGIC) + _TRAILER.size or _pread(fd, 0, len(MAGIC), path) != MAGIC:
+        raise FileError(f'Not a column file: {path}')
+    end, footer = size, _parse_footer(fd, size, path)
+    if footer is None:
+        # NOTE(me): torn appends only, the trailer at the end is valid otherwise
+        for end in _trailer_ends(fd, size, path):
+            footer = _parse_footer(fd, end, path)
+            if footer is not None:
+                break
+        else:
+            raise FileError(f'Corrupted column file: {path}')
+    if footer.get('version') != VERSION:
+        raise FileError(f'Unsupported version: {footer.get("version")}')
+    return footer, end
+
+
+def _footer_row_groups(fd: int, footer: dict, path: str) -> typing.List[dict]:
+    """ Row groups of the snapshot of a footer, which only lists the ones appended after `previous`. """
+    chain = [footer]
+    while 'previous' in chain[-1]:
+        previous = _parse_footer(fd, chain[-1]['previous'], path)
+        if previous is None:
+            raise FileError(f'Corrupted column file: {path}')
+        chain.append(previous)
+    return [meta for f in reversed(chain) for meta in f['row_groups']]
+
+
+@contextlib.contextmanager
+def locked(path: str) -> typing.Generator[typing.BinaryIO, None, None]:
+    """ File opened for writes, locked against other writers until closed, following files replaced meanwhile. """
+    while True:
+        fd = open(path, 'r+b')
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd.fileno(), fcntl.LOCK_EX)
+            # NOTE(me): compactions (or manifest writes) replace the file, the lock of a replaced one guards nothing
+            stat, latest = os.fstat(fd.fileno()), os.stat(path)
+        except BaseException:
+            fd.close()
+            raise
+        if (stat.st_dev, stat.st_ino) == (latest.st_dev, latest.st_ino):
+            break
+        fd.close()
+    with fd:
+        yield fd
+
+
+def _footer_fingerprint(footer: dict) -> str:
+    # NOTE(me): files written before fingerprints have fields only
+    if 'fingerprint' not in footer:
+        return field_graph_from_json(footer['fields']).fingerprint
+    return footer['fingerprint']
+
+
+def _check_footer_fields(footer: dict, field_graph: FieldGraph) -> None:
+    if _footer_fingerprint(footer) != field_graph.fingerprint:
+        raise FieldGraphError('Fields of row groups mismatch')
+
+
+def read_fingerprint(path: str) -> str:
+    """ Fingerprint of the fields of a column file, from its footer only. """
+    with open(path, 'rb') as fd:
+        footer, _ = _read_footer(fd.fileno(), path)
+    return _footer_fingerprint(footer)
+
+
+def read_snapshot_key(path: str) -> typing.Tuple[typing.Optional[str], int]:
+    """ File id and snapshot id of the latest snapshot of a column file, from its footer only. """
+    with open(path, 'rb') as fd:
+        footer, _ = _read_footer(fd.fileno(), path)
+    return footer.get('file_id'), footer.get('snapshot_id', 0)
+
+
+def append_storage(path: str, storage: ChunkedFieldStorage,
+                   codecs: typing.Optional[typing.Dict[str, str]] = None,
+                   default_codec: str = AUTO,
+                   page_size: int = DEFAULT_PAGE_SIZE) -> int:
+    """ Append row groups of `storage` to a column file, returning the new snapshot id.
+
+    Pages and a new footer are written after the last complete footer, so
+    readers opened before keep reading their snapshot, and readers opened
+    meanwhile read the previous one. The new footer lists the new row groups
+    only, linked to the previous one, so appends cost as much as the new
+    data. The file is truncated back if writing fails. Appends of other
+    threads and processes wait for each other.
+    """
+    codecs = dict((f'{ROOT}.{k}', v) for k, v in (codecs or {}).items())
+    with locked(path) as fd:
+        footer, size = _read_footer(fd.fileno(), path)
+        _check_footer_fields(footer, storage.field_graph)
+        fd.seek(size)
+        out = _Output(fd, size)
+        try:
+            row_groups = [_write_row_group(out, storage.field_graph, g, codecs, default_codec, page_size)
+                          for g in storage.row_groups()]
+            # NOTE(me): footers of earlier snapshots stay in the file, the new one lists new row groups only
+            footer = dict((k, v) for k, v in footer.items() if k not in ('row_groups', 'compacted_from'))
+            footer.update(snapshot_id=footer.get('snapshot_id', 0) + 1, previous=size, row_groups=row_groups)
+            _write_footer(fd, footer)
+            # bytes of killed appends after it
+            fd.truncate()
+            os.fsync(fd.fileno())
+        except BaseException:
+            fd.truncate(size)
+            raise
+    return footer['snapshot_id']
+
+
+class _PagedValues(object):
+    """ Defined values of a column chunk, decoding pages when first touched. """
+    def __init__(self, chunk: 'FileColumnChunk', pages: typing.List[typing.List[int]]) -> None:
+        super().__init__()
+        self._chunk = chunk
+        self._pages = pages
+        self._starts = []
+        n = 0
+        for _, _, count in pages:
+            self._starts.append(n)
+            n += count
+        self._size = n
+        self._start = self._end = 0
+        self._values = ()
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __getitem__(self, index: typing.Union[int, slice]) -> typing.Any:
+        if isinstance(index, slice):
+            return self._slice(*index.indices(self._size))
+        if not self._start <= index < self._end:
+            if not 0 <= index < self._size:
+                raise IndexError(index)
+            page = bisect.bisect_right(self._starts, index) - 1
+            self._values = self._chunk.read_page(page)
+            self._chunk.prefetch_pages(page + 1)
+            self._start = self._starts[page]
+            self._end = self._start + self._pages[page][2]
+        return self._values[index - self._start]
+
+    def _slice(self, start: int, stop: int, step: int) -> typing.Sequence[typing.Any]:
+        """ Decode touched pages in bulk. """
+        if step != 1:
+            raise IndexError('Only continuous slices are supported')
+        parts = []
+        while start < stop:
+            self[start]
+            end = min(stop, self._end)
+            parts.append(self._values[start - self._start:end - self._start])
+            start = end
+        if not parts:
+            return self._chunk.read_empty()
+        result = parts[0]
+        for part in parts[1:]:
+            result += part
+        return result
+
+
+class _OpenFile(object):
+    """ Descriptor of one column file, kept open while a storage may read its snapshots. """
+    def __init__(self, path: str) -> None:
+        super().__init__()
+        self.path = path
+        self.fd = os.open(path, os.O_RDONLY)
+        stat = os.fstat(self.fd)
+        self.inode = stat.st_dev, stat.st_ino
+        self._mmap = None
+
+    def read(self, offset: int, length: int) -> bytes:
+        return _pread(self.fd, offset, length, self.path)
+
+    def view(self, offset: int, length: int) -> memoryview:
+        if self._mmap is None or len(self._mmap) < offset + length:
+            # NOTE(me): snapshots are never truncated, views of an older map stay valid
+            self._mmap = mmap.mmap(self.fd, 0, access=mmap.ACCESS_READ)
+        return memoryview(self._mmap)[offset:offset + length]
+
+    def close(self) -> None:
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # still exported, unmapped once the views are released
+                pass
+            self._mmap = None
+        os.close(self.fd)
+
+
+class FileColumnChunk(ColumnChunk):
+    """ Column chunk whose pages are only read and decoded on access. """
+    def __init__(self, storage: 'FileFieldStorage', file: _OpenFile, node: FieldNode, meta: dict,
+                 cache_key: typing.Optional[typing.Tuple] = None) -> None:
+        cpp_type = node.descriptor.cpp_type
+        super().__init__(None, None, None, decode_statistics(cpp_type, meta['statistics']))
+        self._storage = storage
+        self._file = file
+        self._cache_key = cache_key
+        self._futures = dict()  # part => decoding in the background
+        self._cpp_type = cpp_type
+        self._path = node.path
+        self._meta = meta
+        self._codec = meta['codec']
+        self._encoding = meta.get('encoding', PLAIN)
+        self._bloom_filter_loaded = 'bloom_filter' not in meta
+
+    @property
+    def codec(self) -> str:
+        return self._codec
+
+    @property
+    def encoding(self) -> str:
+        return self._encoding
+
+    @property
+    def num_values(self) -> int:
+        return self._meta['num_values']
+
+    @property
+    def num_pages(self) -> int:
+        """ Pages of values, and the ones of levels. """
+        return len(self._meta['pages']) + 2
+
+    @property
+    def num_read_ahead(self) -> int:
+        """ Levels and pages read in the background, waiting to be consumed. """
+        return len(self._futures)
+
+    def _read(self, page: typing.List[int]) -> bytes:
+        data = decompress(self._codec, self._file.read(page[0], page[1]))
+        profile = profiling.get_profile()
+        if profile is not None:
+            counters = profile.column(self._path)
+            counters.pages_decoded += 1
+            counters.bytes_decoded += len(data)
+        return data
+
+    def _cached(self, part: typing.Union[str, int], load: typing.Callable[[], typing.Any]) -> typing.Any:
+        cache = get_column_cache()
+        if cache is None or self._cache_key is None:
+            return load()
+        return cache.get(self._cache_key + (part,), load)
+
+    def _get(self, part: typing.Union[str, int], load: typing.Callable[[], typing.Any]) -> typing.Any:
+        future = self._futures.pop(part, None)
+        if future is not None:
+            return future.result()
+        return self._cached(part, load)
+
+    def _submit(self, part: typing.Union[str, int], load: typing.Callable[[], typing.Any]) -> None:
+        # NOTE(me): at most the levels and the pages read ahead wait to be consumed
+        if part in self._futures or len(self._futures) >= self._storage.readahead + 2:
+            return
+        future = self._storage.submit(self._cached, part, load)
+        self._futures[part] = future
+        if self._cache_key is not None and get_column_cache() is not None:
+            # decoded once done, within the budget of the column cache
+            future.add_done_callback(lambda f: self._forget(part, f))
+
+    def _forget(self, part: typing.Union[str, int], future: 'concurrent.futures.Future') -> None:
+        if self._futures.get(part) is future:
+            self._futures.pop(part, None)
+
+    def _cancel(self, parts: typing.Iterable[typing.Union[str, int]]) -> None:
+        for part in parts:
+            future = self._futures.pop(part, None)
+            if future is not None:
+                future.cancel()
+
+    def _load_repetition_levels(self) -> typing.Sequence[int]:
+        return decode_levels(self._read(self._meta['repetition_levels']))
+
+    def _load_definition_levels(self) -> typing.Sequence[int]:
+        return decode_levels(self._read(self._meta['definition_levels']))
+
+    def _load_page(self, index: int) -> typing.Sequence[typing.Any]:
+        values = decode_values(self._cpp_type, self._read(self._meta['pages'][index]), self._encoding)
+        # shared by readers through the cache
+        return tuple(values) if isinstance(values, list) else values
+
+    def prefetch(self) -> None:
+        """ Read and decode levels and leading pages in the background if the storage reads ahead. """
+        if self._storage.readahead > 0:
+            self._submit('repetition_levels', self._load_repetition_levels)
+            self._submit('definition_levels', self._load_definition_levels)
+            self.prefetch_pages(0)
+
+    def prefetch_pages(self, start: int) -> None:
+        """ Decode pages from `start` in the background, as many as the storage reads ahead. """
+        for index in range(start, min(start + self._storage.readahead, len(self._meta['pages']))):
+            self._submit(index, lambda index=index: self._load_page(index))
+
+    @property
+    def repetition_levels(self) -> typing.Sequence[int]:
+        return self._get('repetition_levels', self._load_repetition_levels)
+
+    @property
+    def definition_levels(self) -> typing.Sequence[int]:
+        return self._get('definition_levels', self._load_definition_levels)
+
+    @property
+    def values(self) -> typing.Sequence[typing.Any]:
+        return _PagedValues(self, self._meta['pages'])
+
+    def read_page(self, index: int) -> typing.Sequence[typing.Any]:
+        # pages before it are not read anymore
+        self._cancel([part for part in list(self._futures) if isinstance(part, int) and part < index])
+        return self._get(index, lambda: self._load_page(index))
+
+    def release(self) -> None:
+        self._cancel(list(self._futures))
+
+    def read_empty(self) -> typing.Sequence[typing.Any]:
+        return decode_values(self._cpp_type, encode_values(self._cpp_type, []))
+
+    def buffers(self) -> ColumnBuffers:
+        """ Views of the mapped file if uncompressed, with plain values as well, or decoded buffers. """
+        if self._codec != 'none':
+            values = self.values
+            return ColumnBuffers(memoryview(self.repetition_levels), memoryview(self.definition_levels),
+                                 as_buffer(values[0:len(values)]))
+
+        reps = self._file.view(*self._meta['repetition_levels'])
+        defs = self._file.view(*self._meta['definition_levels'])
+        typecode = fixed_width_typecode(self._cpp_type)
+        pages = self._meta['pages']
+        if self._encoding == PLAIN and typecode is not None and sys.byteorder == 'little' and pages:
+            # NOTE(me): pages of a chunk are written one after another
+            start, end = pages[0][0], pages[-1][0] + pages[-1][1]
+            return ColumnBuffers(reps, defs, self._file.view(start, end - start).cast(typecode))
+        values = self.values
+        return ColumnBuffers(reps, defs, as_buffer(values[0:len(values)]))
+
+    @property
+    def bloom_filter(self) -> typing.Optional[BloomFilter]:
+        if not self._bloom_filter_loaded:
+            meta = self._meta['bloom_filter']
+            page = meta['page']
+            self._bloom_filter = BloomFilter.from_bytes(
+                meta['num_bits'], meta['num_hashes'], self._file.read(page[0], page[1]))
+            self._bloom_filter_loaded = True
+        return self._bloom_filter
+
+
+class FileFieldStorage(ChunkedFieldStorage):
+    """ Column file opened for reads, which should be closed after use.
+
+    It keeps reading the snapshot found when opened until `reload()`, which
+    also follows files replaced by compactions. With `readahead` > 0, chunks
+    hinted by `prefetch()` (like the ones of the next row group of a scan)
+    and that many pages after the current one are decoded in `executor` (a
+    shared thread pool by default) while the current page is consumed.
+    """
+    def __init__(self, path: str, readahead: int = 0,
+                 executor: typing.Optional['concurrent.futures.Executor'] = None) -> None:
+        self._path = path
+        self._readahead = readahead
+        self._executor = executor if executor is not None or readahead <= 0 else _default_executor()
+        self._pending = set()
+        self._pending_lock = threading.Lock()
+        self._file = _OpenFile(path)
+        # replaced files are kept open for row groups read before reloads
+        self._files = [self._file]
+        try:
+            footer, self._end = _read_footer(self._file.fd, path)
+        except Exception:
+            self._file.close()
+            raise
+        field_graph = field_graph_from_json(footer['fields'])
+        self._file_id = footer.get('file_id')
+        super().__init__(field_graph, self._load_row_groups(field_graph, footer, self._file),
+                         footer.get('snapshot_id', 0))
+        if self._file_id is not None:
+            self._storage_id = self._file_id
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    @property
+    def readahead(self) -> int:
+        return self._readahead
+
+    @property
+    def executor(self) -> typing.Optional['concurrent.futures.Executor']:
+        return self._executor
+
+    @property
+    def file_id(self) -> typing.Optional[str]:
+        """ Unique id of the file, kept by appends and changed by compactions. """
+        return self._file_id
+
+    def _load_row_groups(self, field_graph: FieldGraph, footer: dict, file: _OpenFile) -> typing.List[RowGroup]:
+        row_groups = []
+        file_id = footer.get('file_id')
+        for index, meta in enumerate(_footer_row_groups(file.fd, footer, self._path)):
+            # NOTE(me): row groups never change once written, and rewritten files get new ids
+            columns = dict((path, FileColumnChunk(self, file, field_graph.get_field(path), column,
+                                                  (file_id, index, path) if file_id else None))
+                           for path, column in meta['columns'].items())
+            row_groups.append(RowGroup(field_graph, meta['num_records'], columns))
+        return row_groups
+
+    def snapshot(self, snapshot_id: int, file_id: typing.Optional[str] = None) -> ChunkedFieldStorage:
+        """ Row groups of an earlier snapshot of the file, found from the footer of the current one.
+
+        A snapshot replaced by a compaction is read from the compacted file,
+        which holds the same records. Raises `FileError` if it is not found.
+        """
+        with self._publish_lock:
+            file, end = self._file, self._end
+            current_id, current_snapshot_id = self._file_id, self._snapshot_id
+        key = [current_id if file_id is None else file_id, snapshot_id]
+        if key == [current_id, current_snapshot_id]:
+            return self
+        while True:
+            footer = _parse_footer(file.fd, end, self._path)
+            if footer is None:
+                raise FileError(f'Corrupted column file: {self._path}')
+            if [footer.get('file_id'), footer.get('snapshot_id', 0)] == key or footer.get('compacted_from') == key:
+                break
+            end = footer.get('previous')
+            if end is None:
+                raise FileError(f'No snapshot {snapshot_id} of file {key[0]} in {self._path}')
+        return ChunkedFieldStorage(self._field_graph, self._load_row_groups(self._field_graph, footer, file),
+                                   footer.get('snapshot_id', 0))
+
+    def reload(self) -> int:
+        """ Switch to the latest snapshot of the file, returning its id. """
+        latest = os.stat(self._path)
+        file = self._file
+        if (latest.st_dev, latest.st_ino) != file.inode:
+            file = _OpenFile(self._path)
+        try:
+            footer, end = _read_footer(file.fd, self._path)
+            _check_footer_fields(footer, self._field_graph)
+        except Exception:
+            if file is not self._file:
+                file.close()
+            raise
+        with self._publish_lock:
+            if file is not self._file:
+                self._file = file
+                self._files.append(file)
+                self._file_id = footer.get('file_id')
+                if self._file_id is not None:
+                    self._storage_id = self._file_id
+            self._row_groups = self._load_row_groups(self._field_graph, footer, file)
+            self._snapshot_id = footer.get('snapshot_id', 0)
+            self._end = end
+            return self._snapshot_id
+
+    def _replace(self, old: typing.List[RowGroup], new: typing.List[RowGroup]) -> int:
+        # NOTE(me): compacted row groups would only be kept in memory
+        raise FileError(f'Column files are compacted by compact_file: {self._path}')
+
+    def append(self, storage: ChunkedFieldStorage) -> int:
+        """ Append row groups of `storage` to the file itself, and switch to it. """
+        append_storage(self._path, storage)
+        return self.reload()
+
+    def read(self, offset: int, length: int) -> bytes:
+        return self._file.read(offset, length)
+
+    def view(self, offset: int, length: int) -> memoryview:
+        """ Bytes of the file without copies, by mapping it into memory. """
+        return self._file.view(offset, length)
+
+    def submit(self, func: typing.Callable, *args) -> 'concurrent.futures.Future':
+        """ Run `func(*args)` reading the file in the background, finished before closing. """
+        future = self._executor.submit(profiling.bind_profile(func), *args)
+        with self._pending_lock:
+            self._pending.add(future)
+        future.add_done_callback(self._discard)
+        return future
+
+    def _discard(self, future: 'concurrent.futures.Future') -> None:
+        with self._pending_lock:
+            self._pending.discard(future)
+
+    def close(self) -> None:
+        if self._files:
+            with self._pending_lock:
+                pending = list(self._pending)
+            for future in pending:
+                future.cancel()
+            if pending:
+                # NOTE(me): the fd number could be reused by another file once closed
+                import concurrent.futures
+                concurrent.futures.wait(pending)
+            for file in self._files:
+                file.close()
+            self._files = []
+
+    def __enter__(self) -> 'FileFieldStorage':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+def open_storage(path: str, readahead: int = 0,
+                 executor: typing.Optional['concurrent.futures.Executor'] = None) -> FileFieldStorage:
+    return FileFieldStorage(path, readahead, executor)
+
+
+def compact_file(path: str, target_size: int = DEFAULT_ROW_GROUP_SIZE,
+                 codecs: typing.Optional[typing.Dict[str, str]] = None,
+                 default_codec: str = AUTO,
+                 page_size: int = DEFAULT_PAGE_SIZE,
+                 bloom_filter_fp_rate: float = 0.01) -> int:
+    """ Rewrite a column file with small row groups merged, returning the new snapshot id.
+
+    The new file replaces the old one by renaming, so readers which opened it
+    before keep reading the old one until they reload. Appends wait for the
+    replacement, which fails if the file changed since it was read.
+    """
+    with open_storage(path) as storage:
+        row_groups = storage.row_groups()
+        compacted = compact_row_groups(storage.field_graph, row_groups, target_size, bloom_filter_fp_rate)
+        if len(compacted) == len(row_groups):
+            return storage.snapshot_id
+        file_id, snapshot_id = storage.file_id, storage.snapshot_id + 1
+        tmp_path = f'{path}.compact'
+        # NOTE(me): the compacted snapshot holds the records of the one replaced, tables refer to either
+        _write_file(tmp_path, ChunkedFieldStorage(storage.field_graph, compacted, snapshot_id),
+                    codecs, default_codec, page_size, {'compacted_from': [file_id, snapshot_id - 1]})
+    try:
+        with locked(path) as fd:
+            latest, _ = _read_footer(fd.fileno(), path)
+            if (latest.get('file_id'), latest.get('snapshot_id', 0)) != (file_id, snapshot_id - 1):
+                raise FileError(f'Column file changed during compaction: {path}')
+            # NOTE(me): under the lock, so appends waiting for it reopen the new file
+            os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return snapshot_id
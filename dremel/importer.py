@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+
+import array
+import itertools
+import operator
+import typing
+
+from dremel.consts import *
+from dremel.arrow import ArrowColumn, _LEAF_TYPES, _path_from_root
+from dremel.chunked import DEFAULT_ROW_GROUP_SIZE, ChunkedFieldStorage, RowGroup, build_column_chunk
+from dremel.field_graph import FieldNode, create_field_graph
+
+if typing.TYPE_CHECKING:
+    from dremel.schema_pb2 import Schema
+
+Levels = typing.Tuple[typing.Sequence[int], typing.Sequence[int], typing.Sequence[typing.Any]]
+
+
+class ImporterError(Exception):
+    pass
+
+
+def _repeated_definition_levels(node: FieldNode) -> bytes:
+    """ Table of the definition level of the repeated ancestor (or the node) at each repetition level. """
+    table = bytearray(256)
+    while node is not None:
+        if node.label == LABEL_REPEATED:
+            table[node.max_repetition_level] = node.definition_level
+        node = node.parent
+    return bytes(table)
+
+
+def _check_levels(node: FieldNode, reps: array.array, defs: array.array, num_values: int) -> int:
+    """ Validate levels of a leaf column in bulk, returning the number of records. """
+    desc = node.descriptor
+    if len(reps) != len(defs):
+        raise ImporterError(f'{desc.path}: {len(reps)} repetition levels but {len(defs)} definition levels')
+    if defs.count(desc.definition_level) != num_values:
+        raise ImporterError(f'{desc.path}: {defs.count(desc.definition_level)} defined entries '
+                            f'but {num_values} values')
+    if not reps:
+        return 0
+    if reps[0] != 0:
+        raise ImporterError(f'{desc.path}: the first repetition level is {reps[0]}, not 0')
+    if max(reps) > desc.max_repetition_level:
+        raise ImporterError(f'{desc.path}: repetition level {max(reps)} > {desc.max_repetition_level}')
+    if max(defs) > desc.definition_level:
+        raise ImporterError(f'{desc.path}: definition level {max(defs)} > {desc.definition_level}')
+    # NOTE(me): repeating at level r means the repeated field at r is defined
+    min_defs = reps.tobytes().translate(_repeated_definition_levels(node))
+    invalid = next(itertools.compress(itertools.count(), map(operator.lt, defs, min_defs)), None)
+    if invalid is not None:
+        raise ImporterError(f'{desc.path}: definition level {defs[invalid]} at entry {invalid} is below '
+                            f'{min_defs[invalid]}, the one of the field repeated at level {reps[invalid]}')
+    # and it was already defined by the previous entry, which it repeats
+    invalid = next(itertools.compress(itertools.count(1), map(operator.lt, defs[:-1], min_defs[1:])), None)
+    if invalid is not None:
+        raise ImporterError(f'{desc.path}: entry {invalid} repeats at level {reps[invalid]} after definition level '
+                            f'{defs[invalid - 1]}, below {min_defs[invalid]} of the field repeated')
+    return reps.count(0)
+
+
+def _record_bounds(reps: array.array, row_group_size: int) -> typing.List[int]:
+    """ Entry offsets of row group starts, and the end. """
+    starts = list(itertools.compress(itertools.count(), map(operator.not_, reps)))
+    return starts[::row_group_size] + [len(reps)]
+
+
+def import_levels(schema: 'Schema', columns: typing.Dict[str, Levels],
+                  row_group_size: int = DEFAULT_ROW_GROUP_SIZE,
+                  bloom_filter_fields: typing.Optional[typing.List[str]] = None,
+                  bloom_filter_fp_rate: float = 0.01) -> ChunkedFieldStorage:
+    """ Storage of `schema` from (repetition levels, definition levels, defined values) of every leaf field.
+
+    Keys of `columns` are leaf fields like `name.url`. Levels are checked and
+    split into row groups by whole-column operations, without looking at
+    records one by one.
+    """
+    if row_group_size <= 0:
+        raise ImporterError(f'Invalid row group size: {row_group_size}')
+    field_graph = create_field_graph(schema)
+    leaves = dict((node.path, node) for node in field_graph.root.leaf_nodes)
+    paths = set(f'{ROOT}.{f}' for f in columns)
+    if paths != set(leaves):
+        missing = sorted(p[len(ROOT) + 1:] for p in set(leaves) - paths)
+        unknown = sorted(p[len(ROOT) + 1:] for p in paths - set(leaves))
+        raise ImporterError(f'Columns do not match the schema, missing: {missing}, unknown: {unknown}')
+
+    levels = dict()
+    num_records = None
+    for field, (reps, defs, values) in columns.items():
+        path = f'{ROOT}.{field}'
+        try:
+            reps, defs = array.array('B', reps), array.array('B', defs)
+        except (OverflowError, TypeError) as e:
+            raise ImporterError(f'{field}: invalid levels, {e}')
+        n = _check_levels(leaves[path], reps, defs, len(values))
+        if num_records is not None and n != num_records:
+            raise ImporterError(f'{field}: {n} records, other columns have {num_records}')
+        num_records = n
+        levels[path] = (reps, defs, values)
+
+    bloom_filter_paths = set(f'{ROOT}.{f}' for f in bloom_filter_fields or [])
+    row_groups = [RowGroup(field_graph, min(row_group_size, num_records - i), dict())
+                  for i in range(0, num_records or 0, row_group_size)]
+    for path, (reps, defs, values) in levels.items():
+        desc = leaves[path].descriptor
+        fp_rate = bloom_filter_fp_rate if path in bloom_filter_paths else None
+        bounds = _record_bounds(reps, row_group_size)
+        value_offset = 0
+        for g, start, end in zip(row_groups, bounds, bounds[1:]):
+            chunk_defs = defs[start:end]
+            num_values = chunk_defs.count(desc.definition_level)
+            try:
+                g.columns[path] = build_column_chunk(desc.cpp_type, reps[start:end], chunk_defs,
+                                                     values[value_offset:value_offset + num_values], fp_rate)
+            except (OverflowError, TypeError, ValueError) as e:
+                raise ImporterError(f'{path[len(ROOT) + 1:]}: invalid values, {e}')
+            value_offset += num_values
+    return ChunkedFieldStorage(field_graph, row_groups)
+
+
+class _Path(object):
+    """ Columns of nodes from the root to a leaf, checked against the schema. """
+    def __init__(self, leaf: FieldNode, root: ArrowColumn) -> None:
+        super().__init__()
+        self.nodes = _path_from_root(leaf)
+        self.columns = []
+        self.values = None
+        parent = root
+        for node in self.nodes:
+            desc = node.descriptor
+            column = next((c for c in parent.children if c.name == node.name), None)
+            if column is None:
+                raise ImporterError(f'No column for {desc.path}')
+            length = parent.length
+            if desc.label == LABEL_REPEATED:
+                if column.type != 'list' or len(column.children) != 1:
+                    raise ImporterError(f'{desc.path}: expected a list, got {column.type}')
+                self._check_offsets(desc.path, column)
+                parent = column.children[0]
+            else:
+                parent = column
+            self._check_type(node, parent)
+            if column.length != length:
+                raise ImporterError(f'{desc.path}: length {column.length}, expected {length}')
+            self.columns.append(column)
+        self.values = parent.to_pylist()
+
+    @staticmethod
+    def _check_offsets(path: str, column: ArrowColumn) -> None:
+        offsets = column.offsets
+        if offsets is None or len(offsets) != column.length + 1 or offsets[0] != 0 or \
+                offsets[-1] != column.children[0].length or not all(map(operator.le, offsets, offsets[1:])):
+            raise ImporterError(f'{path}: invalid list offsets')
+
+    @staticmethod
+    def _check_type(node: FieldNode, column: ArrowColumn) -> None:
+        if node.is_leaf():
+            expected = _LEAF_TYPES[node.descriptor.cpp_type]
+            if column.type != expected and not (expected == 'string' and column.type == 'binary'):
+                raise ImporterError(f'{node.path}: expected {expected}, got {column.type}')
+        elif column.type != 'struct':
+            raise ImporterError(f'{node.path}: expected a struct, got {column.type}')
+
+
+def _nested_levels(path: _Path, num_records: int) -> Levels:
+    """ Levels of a leaf column by one walk over offsets and validity of columns on its path. """
+    reps, defs, values = array.array('B'), array.array('B'), []
+    leaf_values = path.values
+    last = len(path.nodes) - 1
+    nodes = [(n.label, n.max_repetition_level, n.definition_level, n.path)
+             for n in path.nodes]
+
+    def walk(i, index, r, d):
+        label, rl, dl, name = nodes[i]
+        column = path.columns[i]
+        if label == LABEL_REPEATED:
+            start, end = (column.offsets[index], column.offsets[index + 1]) if column.is_valid(index) else (0, 0)
+            if start == end:
+                reps.append(r)
+                defs.append(d)
+                return
+            for e in range(start, end):
+                if i < last:
+                    walk(i + 1, e, r, dl)
+                elif leaf_values[e] is None:
+                    raise ImporterError(f'{name}: NULL element of a repeated field')
+                else:
+                    reps.append(r)
+                    defs.append(dl)
+                    values.append(leaf_values[e])
+                r = rl
+            return
+        valid = column.is_valid(index) if i < last else leaf_values[index] is not None
+        if not valid:
+            if label == LABEL_REQUIRED:
+                raise ImporterError(f'{name}: NULL of a required field')
+            reps.append(r)
+            defs.append(d)
+        elif i < last:
+            walk(i + 1, index, r, dl)
+        else:
+            reps.append(r)
+            defs.append(dl)
+            values.append(leaf_values[index])
+
+    for record in range(num_records):
+        walk(0, record, 0, 0)
+    return reps, defs, values
+
+
+def import_columns(schema: 'Schema', column: ArrowColumn,
+                   row_group_size: int = DEFAULT_ROW_GROUP_SIZE,
+                   bloom_filter_fields: typing.Optional[typing.List[str]] = None,
+                   bloom_filter_fp_rate: float = 0.01) -> ChunkedFieldStorage:
+    """ Storage of `schema` from nested columns like the ones of `arrow.export_columns`.
+
+    `column` is a struct of records. Levels of each leaf are computed by one
+    walk over list offsets and validity bitmaps of the columns on its path.
+    """
+    if column.type != 'struct':
+        raise ImporterError(f'Expected a struct of records, got {column.type}')
+    field_graph = create_field_graph(schema)
+    columns = dict()
+    for leaf in field_graph.root.leaf_nodes:
+        columns[leaf.path[len(ROOT) + 1:]] = _nested_levels(_Path(leaf, column), column.length)
+    return import_levels(schema, columns, row_group_size, bloom_filter_fields, bloom_filter_fp_rate)
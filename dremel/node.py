@@ -5,6 +5,11 @@ import typing
 
 class Node(object):
     """ Definition of Node by which we can construct a tree. """
+    # NOTE(me): `_children` belongs to CompositeNode, but is declared here so that
+    # subclasses of both Node and CompositeNode (like MessageWriter) still have
+    # one instance layout, it's left unset for leaves.
+    __slots__ = ('_parent', '_children')
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self._parent = None
@@ -29,6 +34,8 @@ class Node(object):
 
 class CompositeNode(Node):
     """ Definition of CompositeNode who contains multiple child nodes. """
+    __slots__ = ()
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self._children = []
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+
+import typing
+
+
+def _can_skip_value(value: typing.Any, statistics, bloom_filter) -> bool:
+    if statistics.min_value is None:
+        # all NULLs
+        return True
+    try:
+        if value < statistics.min_value or value > statistics.max_value:
+            return True
+    except TypeError:
+        return False
+    # NOTE(me): values are hashed by type, 20.0 or True would miss 20 or 1 of the column
+    return bloom_filter is not None and type(value) is type(statistics.min_value) and \
+        not bloom_filter.might_contain(value)
+
+
+def _typed(value: typing.Any) -> typing.Hashable:
+    # NOTE(me): 1, 1.0 and True are equal as keys, but not as values of every type
+    return type(value).__name__, value
+
+
+class Predicate(object):
+    """ Record-level filter on one field, a record passes if any of its values matches. """
+    def __init__(self, field: str) -> None:
+        super().__init__()
+        self._field = field
+
+    @property
+    def field(self) -> str:
+        return self._field
+
+    def __call__(self, value: typing.Any) -> bool:
+        raise NotImplementedError()
+
+    def can_skip(self, statistics, bloom_filter=None) -> bool:
+        """ True if no value summarized by column chunk metadata can match. """
+        return False
+
+    def key(self) -> typing.Hashable:
+        """ Equal for predicates matching the same values, like for cached query results. """
+        return (type(self).__name__, self._field, self)
+
+
+class EqualPredicate(Predicate):
+    def __init__(self, field: str, value: typing.Any) -> None:
+        super().__init__(field)
+        self._value = value
+
+    @property
+    def value(self) -> typing.Any:
+        return self._value
+
+    def __call__(self, value: typing.Any) -> bool:
+        return value is not None and value == self._value
+
+    def can_skip(self, statistics, bloom_filter=None) -> bool:
+        return _can_skip_value(self._value, statistics, bloom_filter)
+
+    def key(self) -> typing.Hashable:
+        return ('=', self.field, _typed(self._value))
+
+    def __repr__(self) -> str:
+        return f'<Equal:{self.field} == {self._value!r}>'
+
+
+class InPredicate(Predicate):
+    def __init__(self, field: str, values: typing.Iterable[typing.Any]) -> None:
+        super().__init__(field)
+        self._values = frozenset(values)
+
+    @property
+    def values(self) -> typing.FrozenSet[typing.Any]:
+        return self._values
+
+    def __call__(self, value: typing.Any) -> bool:
+        return value is not None and value in self._values
+
+    def can_skip(self, statistics, bloom_filter=None) -> bool:
+        return all(_can_skip_value(v, statistics, bloom_filter) for v in self._values)
+
+    def key(self) -> typing.Hashable:
+        return ('in', self.field, frozenset(_typed(v) for v in self._values))
+
+    def __repr__(self) -> str:
+        return f'<In:{self.field} in {sorted(self._values, key=repr)!r}>'
+
+
+class RangePredicate(Predicate):
+    """ Both bounds are inclusive, and `None` means unbounded. """
+    def __init__(self, field: str, lower: typing.Any = None, upper: typing.Any = None) -> None:
+        super().__init__(field)
+        self._lower = lower
+        self._upper = upper
+
+    @property
+    def lower(self) -> typing.Any:
+        return self._lower
+
+    @property
+    def upper(self) -> typing.Any:
+        return self._upper
+
+    def __call__(self, value: typing.Any) -> bool:
+        if value is None:
+            return False
+        if self._lower is not None and value < self._lower:
+            return False
+        if self._upper is not None and value > self._upper:
+            return False
+        return True
+
+    def can_skip(self, statistics, bloom_filter=None) -> bool:
+        if statistics.min_value is None:
+            # all NULLs
+            return True
+        try:
+            return ((self._lower is not None and statistics.max_value < self._lower) or
+                    (self._upper is not None and statistics.min_value > self._upper))
+        except TypeError:
+            return False
+
+    def key(self) -> typing.Hashable:
+        return ('range', self.field, _typed(self._lower), _typed(self._upper))
+
+    def __repr__(self) -> str:
+        return f'<Range:{self.field} in [{self._lower!r}, {self._upper!r}]>'
+
+
+class FunctionPredicate(Predicate):
+    """ Wrap an arbitrary callable, which also receives `None` for missing values. """
+    def __init__(self, field: str, func: typing.Callable[[typing.Any], bool]) -> None:
+        super().__init__(field)
+        self._func = func
+
+    def __call__(self, value: typing.Any) -> bool:
+        return bool(self._func(value))
+
+    def key(self) -> typing.Hashable:
+        return ('function', self.field, self._func)
+
+    def __repr__(self) -> str:
+        return f'<Function:{self.field} {self._func!r}>'
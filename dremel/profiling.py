@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+
+import collections.abc
+import contextlib
+import contextvars
+import time
+import types
+import typing
+
+from dremel.consts import *
+
+
+class ColumnCounters(object):
+    """ Work done on one column. """
+    def __init__(self) -> None:
+        super().__init__()
+        self.entries_read = 0
+        self.values_read = 0
+        self.pages_decoded = 0
+        self.bytes_decoded = 0
+        self.pages_skipped = 0
+
+    def to_dict(self) -> dict:
+        return dict(self.__dict__)
+
+
+class OperatorTimer(object):
+    """ Calls of an operator and the wall time spent in them, including nested operators. """
+    def __init__(self) -> None:
+        super().__init__()
+        self.calls = 0
+        self.seconds = 0.0
+
+    def add(self, seconds: float) -> None:
+        self.calls += 1
+        self.seconds += seconds
+
+    def wrap(self, func: typing.Callable) -> typing.Callable:
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.add(time.perf_counter() - start)
+        return timed
+
+    def iterate(self, it: typing.Iterable) -> typing.Iterator:
+        """ Items of `it`, timing each step. """
+        it = iter(it)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(it)
+            except StopIteration:
+                return
+            finally:
+                self.add(time.perf_counter() - start)
+            yield item
+
+    def to_dict(self) -> dict:
+        return {'calls': self.calls, 'seconds': self.seconds}
+
+
+class Profile(object):
+    """ Counters of columns and timers of operators collected while profiling.
+
+    Operators are `shred` and `encode` of writers, `fetch` of reader sets,
+    `value` accesses, `filter` of predicates, `assemble` of builders and
+    `protobuf` mutations within it. Times of operators include the ones of
+    operators nested in them, like `fetch` within `filter`.
+    """
+    def __init__(self) -> None:
+        super().__init__()
+        self.columns = collections.OrderedDict()  # path => ColumnCounters
+        self.operators = collections.OrderedDict()  # name => OperatorTimer
+        self.row_groups_scanned = 0
+        self.row_groups_skipped = 0
+        self.seconds = 0.0
+
+    def column(self, path: str) -> ColumnCounters:
+        counters = self.columns.get(path)
+        if counters is None:
+            counters = self.columns.setdefault(path, ColumnCounters())
+        return counters
+
+    def timer(self, operator: str) -> OperatorTimer:
+        timer = self.operators.get(operator)
+        if timer is None:
+            timer = self.operators.setdefault(operator, OperatorTimer())
+        return timer
+
+    def to_dict(self) -> dict:
+        return {
+            'seconds': self.seconds,
+            'row_groups_scanned': self.row_groups_scanned,
+            'row_groups_skipped': self.row_groups_skipped,
+            'operators': dict((name, t.to_dict()) for name, t in self.operators.items()),
+            'columns': dict((path, c.to_dict()) for path, c in self.columns.items()),
+        }
+
+    def report(self) -> str:
+        """ Text like `EXPLAIN ANALYZE` of databases. """
+        lines = [f'Total: {self.seconds * 1000:.3f} ms, row groups: {self.row_groups_scanned} scanned, '
+                 f'{self.row_groups_skipped} skipped',
+                 f'{"operator":<12} {"calls":>10} {"ms":>12} {"% total":>8}']
+        for name, t in self.operators.items():
+            share = t.seconds / self.seconds * 100 if self.seconds else 0
+            lines.append(f'{name:<12} {t.calls:>10} {t.seconds * 1000:>12.3f} {share:>8.1f}')
+        width = max([len('column')] + [len(_field(p)) for p in self.columns])
+        lines.append(f'{"column":<{width}} {"entries":>10} {"values":>10} {"pages":>7} {"bytes":>12} {"skipped":>8}')
+        for path, c in self.columns.items():
+            lines.append(f'{_field(path):<{width}} {c.entries_read:>10} {c.values_read:>10} {c.pages_decoded:>7} '
+                         f'{c.bytes_decoded:>12} {c.pages_skipped:>8}')
+        return '\n'.join(lines)
+
+    def __str__(self) -> str:
+        return self.report()
+
+
+def _field(path: str) -> str:
+    return path[len(ROOT) + 1:] if path.startswith(f'{ROOT}.') else path
+
+
+# NOTE(me): per thread and asyncio task, counters of one query updated from its worker threads may be off a little
+_profile = contextvars.ContextVar('dremel_profile', default=None)
+
+
+def get_profile() -> typing.Optional[Profile]:
+    """ The profile collecting now, or None if not profiling. """
+    return _profile.get()
+
+
+@contextlib.contextmanager
+def profiling() -> typing.Generator[Profile, None, None]:
+    """ Collect a profile of the operations within, which are not instrumented otherwise.
+
+    Profiles are kept per thread (and asyncio task), so queries of other
+    threads are never collected. Work handed to other threads is collected
+    if wrapped by `bind_profile`.
+    """
+    profile = Profile()
+    token = _profile.set(profile)
+    start = time.perf_counter()
+    try:
+        yield profile
+    finally:
+        profile.seconds += time.perf_counter() - start
+        _profile.reset(token)
+
+
+def bind_profile(func: typing.Callable) -> typing.Callable:
+    """ `func` collecting into the profile of the caller, like when run in worker threads. """
+    profile = _profile.get()
+    if profile is None:
+        return func
+
+    def profiled(*args, **kwargs):
+        token = _profile.set(profile)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _profile.reset(token)
+    return profiled
+
+
+def explain_analyze(func: typing.Callable, *args, **kwargs) -> typing.Tuple[typing.Any, Profile]:
+    """ Run a query like `func(storage, ...)` under a profile, returning its result and the profile.
+
+    Results which are iterators (like scans) are consumed into lists, with
+    rows copied.
+    """
+    with profiling() as profile:
+        result = func(*args, **kwargs)
+        if isinstance(result, (types.GeneratorType, collections.abc.Iterator)):
+            result = list(_copy_rows(result))
+    return result, profile
+
+
+def _copy_rows(it: typing.Iterator) -> typing.Iterator:
+    for item in it:
+        if isinstance(item, tuple) and item and isinstance(item[0], list):
+            # scans reuse lists of values
+            item = (item[0][:],) + item[1:]
+        yield item
@@ -1,10 +1,21 @@
 #!/usr/bin/env python
 
+import array
+import collections
+import heapq
+import itertools
+import time
 import typing
 
+from dremel import profiling
 from dremel.consts import *
-from dremel.field_graph import FieldGraph, FieldNode
-from dremel.schema_pb2 import SchemaFieldDescriptor
+from dremel.encoding import as_array, as_buffer
+from dremel.field_graph import FieldGraph, FieldGraphError, FieldNode
+from dremel.predicate import Predicate
+from dremel.sampling import Sample
+
+if typing.TYPE_CHECKING:
+    from dremel.schema_pb2 import SchemaFieldDescriptor
 
 
 class ReadError(Exception):
@@ -12,11 +23,13 @@ class ReadError(Exception):
 
 
 class FieldValueMixin(object):
+    __slots__ = ()
+
     def __init__(self) -> None:
         super().__init__()
 
     @property
-    def descriptor(self) -> SchemaFieldDescriptor:
+    def descriptor(self) -> 'SchemaFieldDescriptor':
         raise NotImplementedError()
 
     @property
@@ -36,10 +49,17 @@ class FieldValueMixin(object):
         raise NotImplementedError()
 
     def __repr__(self) -> str:
-        return f'<FieldValue:{self.descriptor.path}, R={self.repetition_level()}, NR={self.next_repetition_level()} D={self.definition_level()} V={self.value()}>'
+        return f'<FieldValue:{self.field_node.path}, R={self.repetition_level()}, NR={self.next_repetition_level()} D={self.definition_level()} V={self.value()}>'
+
+
+class ColumnBuffers(collections.namedtuple('ColumnBuffers', ['repetition_levels', 'definition_levels', 'values'])):
+    """ Levels as uint8 memoryviews, and values as a memoryview if fixed width numbers or a sequence otherwise. """
+    __slots__ = ()
 
 
 class FieldReader(FieldValueMixin):
+    __slots__ = ()
+
     def __init__(self) -> None:
         super().__init__()
 
@@ -49,6 +69,41 @@ class FieldReader(FieldValueMixin):
     def next(self) -> None:
         raise NotImplementedError()
 
+    def skip_record(self) -> None:
+        """ Move over the next record without touching its values. """
+        self.next()
+        while not self.done() and self.next_repetition_level() > 0:
+            self.next()
+
+    def read_batch(self, max_size: typing.Optional[int] = None) ->\
+        typing.Optional[typing.Tuple[typing.Sequence[int], typing.Sequence[int], typing.Sequence[typing.Any]]]:
+        """ Read following entries in bulk as repetition levels, definition levels
+        and defined values, or None if all are read.
+
+        Fewer than `max_size` entries may be returned, and the reader stays at
+        the last entry read.
+        """
+        reps, defs, values = [], [], []
+        max_definition_level = self.field_node.definition_level
+        while max_size is None or len(reps) < max_size:
+            self.next()
+            if self.done():
+                break
+            reps.append(self.repetition_level())
+            defs.append(self.definition_level())
+            if defs[-1] == max_definition_level:
+                values.append(self.value())
+        return (reps, defs, values) if reps else None
+
+    def read_buffers(self, max_size: typing.Optional[int] = None) -> typing.Optional[ColumnBuffers]:
+        """ Same as `read_batch` as buffers, copied unless the storage keeps them in buffers already. """
+        batch = self.read_batch(max_size)
+        if batch is None:
+            return None
+        reps, defs, values = batch
+        return ColumnBuffers(memoryview(array.array('B', reps)), memoryview(array.array('B', defs)),
+                             as_buffer(as_array(self.descriptor.cpp_type, values)))
+
 
 class FieldReaderSet(object):
     """ Wrap `Fetch` method in Appendix.D """
@@ -77,6 +132,85 @@ class FieldReaderSet(object):
                 all_done = False
         return next_level, all_done
 
+    def skip_record(self) -> None:
+        for f in self._field_readers:
+            f.skip_record()
+
+
+class _ProfiledFieldReader(FieldReader):
+    """ Reader counting entries and values read into a profile, and timing value accesses.
+
+    Moves are timed as fetches too with `time_fetch`, for readers used without reader sets.
+    """
+    def __init__(self, reader: FieldReader, profile: profiling.Profile, time_fetch: bool = False) -> None:
+        super().__init__()
+        self._reader = reader
+        self._counters = profile.column(reader.field_node.path)
+        self._max_definition_level = reader.field_node.definition_level
+        self._value_timer = profile.timer('value')
+        if time_fetch:
+            self.next = profile.timer('fetch').wrap(self.next)
+
+    @property
+    def descriptor(self) -> 'SchemaFieldDescriptor':
+        return self._reader.descriptor
+
+    @property
+    def field_node(self) -> FieldNode:
+        return self._reader.field_node
+
+    def repetition_level(self) -> int:
+        return self._reader.repetition_level()
+
+    def next_repetition_level(self) -> int:
+        return self._reader.next_repetition_level()
+
+    def definition_level(self) -> int:
+        return self._reader.definition_level()
+
+    def value(self) -> typing.Any:
+        start = time.perf_counter()
+        value = self._reader.value()
+        self._value_timer.add(time.perf_counter() - start)
+        return value
+
+    def done(self) -> bool:
+        return self._reader.done()
+
+    def next(self) -> None:
+        self._reader.next()
+        if not self._reader.done():
+            self._counters.entries_read += 1
+            if self._reader.definition_level() == self._max_definition_level:
+                self._counters.values_read += 1
+
+    def skip_record(self) -> None:
+        # NOTE(me): storages may skip records without reading them
+        self._reader.skip_record()
+
+    def read_batch(self, max_size: typing.Optional[int] = None) ->\
+        typing.Optional[typing.Tuple[typing.Sequence[int], typing.Sequence[int], typing.Sequence[typing.Any]]]:
+        batch = self._reader.read_batch(max_size)
+        if batch is not None:
+            self._counters.entries_read += len(batch[0])
+            self._counters.values_read += len(batch[2])
+        return batch
+
+    def read_buffers(self, max_size: typing.Optional[int] = None) -> typing.Optional[ColumnBuffers]:
+        buffers = self._reader.read_buffers(max_size)
+        if buffers is not None:
+            self._counters.entries_read += len(buffers.repetition_levels)
+            self._counters.values_read += len(buffers.values)
+        return buffers
+
+
+class _ProfiledFieldReaderSet(FieldReaderSet):
+    """ Reader set timing fetches into a profile. """
+    def __init__(self, profile: profiling.Profile) -> None:
+        super().__init__()
+        self.fetch = profile.timer('fetch').wrap(self.fetch)
+        self.skip_record = profile.timer('fetch').wrap(self.skip_record)
+
 
 class FieldStorage(object):
     def __init__(self) -> None:
@@ -92,25 +226,236 @@ class FieldStorage(object):
     def field_graph(self):
         raise NotImplementedError()
 
+    def num_records(self) -> int:
+        raise NotImplementedError()
 
-def scan(storage: FieldStorage, project_fields: typing.List[str]) ->\
-    typing.Generator[typing.Tuple[typing.List[typing.Any], int], None, None]:
-    """ Simple prejections """
-    field_reader_set = FieldReaderSet()
-    for f in project_fields:
-        reader = storage.create_field_reader(f'{ROOT}.{f}')
-        if reader is None:
+    def row_groups(self) -> typing.List['FieldStorage']:
+        """ Parts of this storage which can be scanned one by one in record order. """
+        return [self]
+
+    def can_skip(self, predicates: typing.List[Predicate]) -> bool:
+        """ True if no records in this storage could pass all `predicates`. """
+        return False
+
+    def snapshot_key(self) -> typing.Optional[typing.Tuple[typing.Hashable, int]]:
+        """ (storage id, snapshot id) identifying the records stored, or None if unknown. """
+        return None
+
+
+def _create_field_reader(storage: FieldStorage, field: str) -> FieldReader:
+    reader = storage.create_field_reader(f'{ROOT}.{field}')
+    if reader is None:
+        raise ReadError(f'No field named "{field}"')
+    profile = profiling.get_profile()
+    if profile is not None:
+        reader = _ProfiledFieldReader(reader, profile)
+    return reader
+
+
+def _match_record(reader: FieldReader, predicate: Predicate) -> typing.Optional[bool]:
+    """ Evaluate `predicate` over the next record, or None if no records left. """
+    reader.next()
+    if reader.done():
+        return None
+    matched = predicate(reader.value())
+    while reader.next_repetition_level() > 0:
+        reader.next()
+        if not matched:
+            matched = predicate(reader.value())
+    return matched
+
+
+def select_records(storage: FieldStorage, predicates: typing.List[Predicate],
+                   sample: typing.Optional[Sample] = None) ->\
+    typing.Generator[bool, None, None]:
+    """ Yield a selection vector of records by reading filter columns only.
+
+    Unsampled records are skipped without evaluating any predicates. Without
+    predicates the selection vector is endless.
+    """
+    if sample is not None and sample.by_row_group:
+        sampled = itertools.chain(itertools.chain.from_iterable(
+            itertools.repeat(sample.keeps_row_group(i), g.num_records()) for i, g in enumerate(storage.row_groups())),
+            itertools.repeat(False))
+        return _select_records(storage, predicates, sampled)
+    return _select_records(storage, predicates, sample.selection() if sample else None)
+
+
+def _select_records(storage: FieldStorage, predicates: typing.List[Predicate],
+                    sampled: typing.Optional[typing.Iterator[bool]]) ->\
+    typing.Generator[bool, None, None]:
+    readers = [(p, _create_field_reader(storage, p.field)) for p in predicates]
+    if sampled is None:
+        sampled = itertools.repeat(True)
+    while True:
+        selected = next(sampled)
+        for predicate, reader in readers:
+            if selected:
+                matched = _match_record(reader, predicate)
+                if matched is None:
+                    return
+                selected = matched
+            else:
+                # the record is rejected already
+                reader.skip_record()
+                if reader.done():
+                    return
+        yield selected
+
+
+def read_records(storage: FieldStorage, field: str, sample: typing.Optional[Sample] = None) ->\
+    typing.Generator[typing.Tuple[int, typing.List[typing.Any]], None, None]:
+    """ Yield index and defined values of each (sampled) record for one column.
+
+    NULLs are told by definition levels so their values are never read, and
+    row groups skipped by `sample` are not read at all.
+    """
+    if sample is not None and sample.by_row_group:
+        for row_group, offset in prune_row_groups(storage, None, sample=sample):
+            for index, values in read_records(row_group, field):
+                yield offset + index, values
+        return
+    reader = _create_field_reader(storage, field)
+    max_definition_level = reader.field_node.definition_level
+    sampled = sample.selection() if sample else itertools.repeat(True)
+    for index, selected in enumerate(sampled):
+        if not selected:
+            reader.skip_record()
+            if reader.done():
+                return
+            continue
+
+        reader.next()
+        if reader.done():
+            return
+        values = []
+        while True:
+            if reader.definition_level() == max_definition_level:
+                values.append(reader.value())
+            if reader.next_repetition_level() == 0:
+                break
+            reader.next()
+        yield index, values
+
+
+def read_batches(storage: FieldStorage, field: str, max_size: typing.Optional[int] = None) ->\
+    typing.Generator[typing.Tuple[typing.Sequence[int], typing.Sequence[int], typing.Sequence[typing.Any]], None, None]:
+    """ Yield the whole column in batches, see `FieldReader.read_batch`. """
+    reader = _create_field_reader(storage, field)
+    while True:
+        batch = reader.read_batch(max_size)
+        if batch is None:
+            return
+        yield batch
+
+
+def check_fields(storage: FieldStorage, fields: typing.List[str]) -> typing.List[typing.List[int]]:
+    """ Indexes of `fields` grouped so that no group has independently repeated fields. """
+    for f in fields:
+        if storage.field_graph.get_field(f'{ROOT}.{f}') is None:
             raise ReadError(f'No field named "{f}"')
-        field_reader_set.add(reader)
+    groups = []
+    for i, f in enumerate(fields):
+        for group in groups:
+            try:
+                storage.field_graph.check_if_independently_repeated_fields(
+                    [f'{ROOT}.{fields[j]}' for j in group] + [f'{ROOT}.{f}'])
+            except FieldGraphError:
+                continue
+            group.append(i)
+            break
+        else:
+            groups.append([i])
+    return groups
 
-    # check if any independently repeated fields?
-    storage.field_graph.check_if_independently_repeated_fields(
-        [f.descriptor.path for f in field_reader_set.field_readers])
 
-    values = [None for _ in range(len(project_fields))]
+def _create_field_reader_set(storage: FieldStorage, project_fields: typing.List[str]) -> FieldReaderSet:
+    profile = profiling.get_profile()
+    field_reader_set = FieldReaderSet() if profile is None else _ProfiledFieldReaderSet(profile)
+    for f in project_fields:
+        field_reader_set.add(_create_field_reader(storage, f))
+    return field_reader_set
+
+
+def prune_row_groups(storage: FieldStorage, predicates: typing.Optional[typing.List[Predicate]],
+                     prefetch_fields: typing.Optional[typing.List[str]] = None,
+                     sample: typing.Optional[Sample] = None) ->\
+    typing.Generator[typing.Tuple[FieldStorage, int], None, None]:
+    """ Yield row groups not pruned by `predicates` (or `sample`), with their first record indexes.
+
+    Chunks of `prefetch_fields` in the next row group kept are hinted to be
+    read before a row group is yielded, so they are read (by column files
+    reading ahead) while the row group is scanned.
+    """
+    paths = [f'{ROOT}.{f}' for f in prefetch_fields or []]
+    offset = 0
+    kept = None
+    for index, row_group in enumerate(storage.row_groups()):
+        if (sample is None or sample.keeps_row_group(index)) and not (predicates and row_group.can_skip(predicates)):
+            if kept is not None:
+                columns = getattr(row_group, 'columns', dict())
+                for path in paths:
+                    if path in columns:
+                        columns[path].prefetch()
+                yield kept
+            kept = row_group, offset
+        else:
+            profile = profiling.get_profile()
+            if profile is not None:
+                profile.row_groups_skipped += 1
+                for path, chunk in getattr(row_group, 'columns', dict()).items():
+                    profile.column(path).pages_skipped += chunk.num_pages
+        offset += row_group.num_records()
+    if kept is not None:
+        yield kept
+
+
+def create_selection(storage: FieldStorage, predicates: typing.Optional[typing.List[Predicate]],
+                     sample: typing.Optional[Sample], offset: int) ->\
+    typing.Optional[typing.Iterator[bool]]:
+    """ Records of a row group starting at record `offset` to emit, or None for all of them. """
+    profile = profiling.get_profile()
+    if profile is not None:
+        profile.row_groups_scanned += 1
+    if sample is not None and sample.by_row_group:
+        # row groups are kept whole, or skipped by `prune_row_groups`
+        sample = None
+    if not predicates and not sample:
+        return None
+    selection = _select_records(storage, predicates or [], sample.selection(offset) if sample else None)
+    if profile is not None:
+        selection = profile.timer('filter').iterate(selection)
+    return selection
+
+
+def _scan(field_reader_set: FieldReaderSet,
+          selection: typing.Optional[typing.Iterable[bool]],
+          limit: typing.Optional[int]) ->\
+    typing.Generator[typing.Tuple[typing.List[typing.Any], int], None, None]:
+    values = [None for _ in range(len(field_reader_set.field_readers))]
     fetch_level = 0
+    num_records = 0
+    if selection is not None:
+        selection = iter(selection)
 
     while True:
+        if fetch_level == 0:
+            if limit is not None and num_records >= limit:
+                # stop pulling from readers as soon as the limit is satisfied
+                break
+            num_records += 1
+
+            if selection is not None:
+                # late materialization: skip records until a survivor is found
+                for selected in selection:
+                    if selected:
+                        break
+                    field_reader_set.skip_record()
+                    if field_reader_set.done():
+                        return
+                else:
+                    break
+
         next_level, done = field_reader_set.fetch(fetch_level)
         if done:
             # nothing to iterate
@@ -123,3 +468,167 @@ def scan(storage: FieldStorage, project_fields: typing.List[str]) ->\
         # Emit projection
         yield values, fetch_level
         fetch_level = next_level
+
+
+def _fetch_record(field_reader_set: FieldReaderSet) -> typing.Optional[typing.List[typing.Tuple[typing.List[typing.Any], int]]]:
+    """ (values, fetch level) of all repetitions in the next record, or None if no records left. """
+    values = [None for _ in range(len(field_reader_set.field_readers))]
+    rows = []
+    fetch_level = 0
+    while True:
+        next_level, done = field_reader_set.fetch(fetch_level)
+        if done:
+            return None
+        for i, reader in enumerate(field_reader_set.field_readers):
+            if reader.repetition_level() >= fetch_level:
+                values[i] = reader.value()
+        rows.append((values[:], fetch_level))
+        if next_level == 0:
+            return rows
+        fetch_level = next_level
+
+
+def _scan_groups(field_reader_sets: typing.List[FieldReaderSet],
+                 groups: typing.List[typing.List[int]],
+                 selection: typing.Optional[typing.Iterable[bool]],
+                 limit: typing.Optional[int]) ->\
+    typing.Generator[typing.Tuple[typing.List[typing.Any], int], None, None]:
+    """ Same as `_scan`, emitting the cross product of groups of fields within each record.
+
+    Readers of all groups move record by record together, so every column is
+    read once. In rows of a cross product the last group moves fastest, and
+    the fetch level is the one of the group which moved, groups after it
+    restarting from their first repetitions.
+    """
+    values = [None for group in groups for _ in group]
+    num_records = 0
+    if selection is not None:
+        selection = iter(selection)
+
+    while limit is None or num_records < limit:
+        if selection is not None:
+            for selected in selection:
+                if selected:
+                    break
+                for field_reader_set in field_reader_sets:
+                    field_reader_set.skip_record()
+                if all(s.done() for s in field_reader_sets):
+                    return
+            else:
+                return
+
+        records = [_fetch_record(field_reader_set) for field_reader_set in field_reader_sets]
+        if any(rows is None for rows in records):
+            return
+        num_records += 1
+
+        last = None
+        for combination in itertools.product(*[range(len(rows)) for rows in records]):
+            changed = 0 if last is None else next(k for k, (i, j) in enumerate(zip(combination, last)) if i != j)
+            for k in range(changed, len(groups)):
+                row_values, _ = records[k][combination[k]]
+                for i, value in zip(groups[k], row_values):
+                    values[i] = value
+            fetch_level = 0 if last is None else records[changed][combination[changed]][1]
+            last = combination
+            yield values, fetch_level
+
+
+def scan_row_group(storage: FieldStorage, project_fields: typing.List[str],
+                   groups: typing.List[typing.List[int]],
+                   selection: typing.Optional[typing.Iterable[bool]],
+                   limit: typing.Optional[int]) ->\
+    typing.Generator[typing.Tuple[typing.List[typing.Any], int], None, None]:
+    """ Scan one row group, with `groups` from `check_fields` and `selection` from `create_selection`. """
+    if len(groups) == 1:
+        return _scan(_create_field_reader_set(storage, project_fields), selection, limit)
+    field_reader_sets = [_create_field_reader_set(storage, [project_fields[i] for i in group]) for group in groups]
+    return _scan_groups(field_reader_sets, groups, selection, limit)
+
+
+def scan(storage: FieldStorage, project_fields: typing.List[str],
+         predicates: typing.Optional[typing.List[Predicate]] = None,
+         limit: typing.Optional[int] = None,
+         sample: typing.Optional[Sample] = None) ->\
+    typing.Generator[typing.Tuple[typing.List[typing.Any], int], None, None]:
+    """ Simple prejections, only emitting records which pass all `predicates`.
+
+    Row groups whose chunk metadata rules out `predicates` are not read at all.
+    Filter columns are evaluated ahead of projected columns, so values of
+    projected columns are only read for the surviving records. At most `limit`
+    records are emitted if given, from the records kept by `sample` if given.
+
+    Independently repeated fields, like `name.url` and `links.backward`, are
+    projected as the cross product of their repetitions within each record.
+    """
+    groups = check_fields(storage, project_fields)
+    fields = project_fields + [p.field for p in predicates or [] if p.field not in project_fields]
+    num_records = 0
+    for row_group, offset in prune_row_groups(storage, predicates, fields, sample):
+        if limit is not None and num_records >= limit:
+            return
+        selection = create_selection(row_group, predicates, sample, offset)
+        rest = limit - num_records if limit is not None else None
+        for values, fetch_level in scan_row_group(row_group, project_fields, groups, selection, rest):
+            if fetch_level == 0:
+                num_records += 1
+            yield values, fetch_level
+
+
+def top_k(storage: FieldStorage, project_fields: typing.List[str], order_by: str, k: int,
+          descending: bool = False,
+          predicates: typing.Optional[typing.List[Predicate]] = None,
+          sample: typing.Optional[Sample] = None) ->\
+    typing.Generator[typing.Tuple[typing.List[typing.Any], int], None, None]:
+    """ Emit projections of the first `k` records ordered by a non-repeated field.
+
+    Only the `order_by` column (and filter columns) is read over all records,
+    keeping a bounded heap of candidates. Projected columns are read for the
+    winners only. Records missing the `order_by` value are ordered last.
+    """
+    check_fields(storage, [order_by])
+    if storage.field_graph.get_field(f'{ROOT}.{order_by}').max_repetition_level > 0:
+        raise ReadError(f'Cannot order by a repeated field "{order_by}"')
+    groups = check_fields(storage, project_fields)
+    if k <= 0:
+        return
+    row_groups = list(prune_row_groups(storage, predicates, sample=sample))
+
+    def keys():
+        for i, (row_group, offset) in enumerate(row_groups):
+            key_reader = _create_field_reader(row_group, order_by)
+            selection = create_selection(row_group, predicates, sample, offset)
+            index = 0
+            while True:
+                if selection is not None and not next(selection, False):
+                    key_reader.skip_record()
+                    if key_reader.done():
+                        break
+                else:
+                    key_reader.next()
+                    if key_reader.done():
+                        break
+                    yield (i, index), key_reader.value()
+                index += 1
+
+    if descending:
+        winners = heapq.nlargest(k, keys(), key=lambda e: (e[1] is not None, e[1]))
+    else:
+        winners = heapq.nsmallest(k, keys(), key=lambda e: (e[1] is None, e[1]))
+
+    ranks = dict((ident, rank) for rank, (ident, _) in enumerate(winners))
+    records = [None] * len(winners)
+    for i, (row_group, _) in enumerate(row_groups):
+        indices = sorted(index for j, index in ranks if j == i)
+        if not indices:
+            continue
+        chosen = set(indices)
+        selection = (index in chosen for index in range(indices[-1] + 1))
+        indices = iter(indices)
+        for values, fetch_level in scan_row_group(row_group, project_fields, groups, selection, len(chosen)):
+            if fetch_level == 0:
+                rows = records[ranks[(i, next(indices))]] = []
+            rows.append((values[:], fetch_level))
+
+    for rows in records:
+        yield from rows
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+
+import typing
+
+_MASK64 = (1 << 64) - 1
+
+
+class SampleError(Exception):
+    pass
+
+
+def _mix64(x: int) -> int:
+    """ SplitMix64 finalizer, a cheap and well distributed integer hash. """
+    x = (x + 0x9E3779B97F4A7C15) & _MASK64
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & _MASK64
+    return x ^ (x >> 31)
+
+
+class Sample(object):
+    """ Deterministic Bernoulli sample of records, reproducible by `seed`.
+
+    With `block_size` > 1 whole runs of consecutive records are kept or
+    skipped together, which makes skipping cheaper at the cost of accuracy.
+    With `by_row_group`, whole row groups are kept or skipped instead, so
+    skipped ones are never read, and estimates are only as accurate as the
+    number of row groups sampled allows.
+    """
+    def __init__(self, rate: float, seed: int = 0, block_size: int = 1, by_row_group: bool = False) -> None:
+        super().__init__()
+        if not 0.0 < rate <= 1.0:
+            raise SampleError(f'Invalid sampling rate: {rate}')
+        if block_size < 1 or (by_row_group and block_size != 1):
+            raise SampleError(f'Invalid block size: {block_size}')
+        self._rate = rate
+        self._seed = seed
+        self._block_size = block_size
+        self._by_row_group = by_row_group
+
+    @property
+    def rate(self) -> float:
+        return self._rate
+
+    @property
+    def seed(self) -> int:
+        return self._seed
+
+    @property
+    def block_size(self) -> int:
+        return self._block_size
+
+    @property
+    def by_row_group(self) -> bool:
+        return self._by_row_group
+
+    def keeps_row_group(self, index: int) -> bool:
+        """ Whether the `index`-th row group of a storage is kept, always True unless sampling by row groups. """
+        if not self._by_row_group:
+            return True
+        return _mix64(_mix64(self._seed) ^ index) < int(self._rate * (1 << 64))
+
+    def selection(self, start: int = 0) -> typing.Generator[bool, None, None]:
+        """ Endless selection vector over records from the `start`-th one.
+
+        Whether a record is kept depends on its index only, so row groups can
+        be sampled independently and consistently. Records of row groups kept
+        by `keeps_row_group` are all kept when sampling by row groups.
+        """
+        if self._by_row_group:
+            while True:
+                yield True
+        threshold = int(self._rate * (1 << 64))
+        salt = _mix64(self._seed)
+        block, pos = divmod(start, self._block_size)
+        while True:
+            selected = _mix64(salt ^ block) < threshold
+            for _ in range(self._block_size - pos):
+                yield selected
+            block += 1
+            pos = 0
+
+    def scale(self, value: float) -> float:
+        return value / self._rate
+
+    def __repr__(self) -> str:
+        unit = 'row_group' if self._by_row_group else self._block_size
+        return f'<Sample:rate={self._rate} seed={self._seed} block={unit}>'
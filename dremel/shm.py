@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+
+import array
+import json
+import os
+import struct
+import typing
+from multiprocessing import resource_tracker, shared_memory
+
+from dremel.chunked import ChunkedFieldStorage, ColumnChunk, RowGroup, decode_statistics, encode_statistics
+from dremel.encoding import as_array, decode_values, encode_values, fixed_width_typecode
+from dremel.field_graph import FieldNode, field_graph_from_json, field_graph_to_json
+from dremel.sketch import BloomFilter
+
+# Layout: header length (uint64) | header (json) | buffers aligned to 8 bytes...
+_HEADER_SIZE = struct.Struct('<Q')
+_ALIGNMENT = 8
+
+# names of segments created by this process
+_created = set()
+
+
+class SharedMemoryError(Exception):
+    pass
+
+
+def _align(offset: int) -> int:
+    return (offset + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+
+
+class _Layout(object):
+    """ Buffers to copy into the segment, with [offset, length] of each from the data start. """
+    def __init__(self) -> None:
+        super().__init__()
+        self.buffers = []
+        self.size = 0
+
+    def add(self, data: typing.Union[bytes, memoryview]) -> typing.List[int]:
+        data = memoryview(data).cast('B')
+        offset = _align(self.size)
+        self.buffers.append((offset, data))
+        self.size = offset + len(data)
+        return [offset, len(data)]
+
+
+def _layout_column(layout: _Layout, node: FieldNode, chunk: ColumnChunk) -> dict:
+    cpp_type = node.descriptor.cpp_type
+    values = chunk.values
+    values = values[0:len(values)]
+    meta = {
+        'repetition_levels': layout.add(array.array('B', chunk.repetition_levels)),
+        'definition_levels': layout.add(array.array('B', chunk.definition_levels)),
+        'statistics': encode_statistics(cpp_type, chunk.statistics),
+    }
+    if fixed_width_typecode(cpp_type) is not None:
+        # native layout of the host, mapped as it is
+        meta['values'] = layout.add(as_array(cpp_type, values))
+    else:
+        meta['values'] = layout.add(encode_values(cpp_type, values))
+    bloom_filter = chunk.bloom_filter
+    if bloom_filter is not None:
+        meta['bloom_filter'] = {
+            'num_bits': bloom_filter.num_bits,
+            'num_hashes': bloom_filter.num_hashes,
+            'page': layout.add(bloom_filter.to_bytes()),
+        }
+    return meta
+
+
+class SharedColumnChunk(ColumnChunk):
+    """ Column chunk viewing a shared memory segment. Levels and fixed width values are not copied. """
+    def __init__(self, storage: 'SharedFieldStorage', node: FieldNode, meta: dict) -> None:
+        cpp_type = node.descriptor.cpp_type
+        bloom_filter = None
+        if 'bloom_filter' in meta:
+            bloom_filter = BloomFilter.from_bytes(meta['bloom_filter']['num_bits'], meta['bloom_filter']['num_hashes'],
+                                                  storage.view(*meta['bloom_filter']['page']).tobytes())
+        values = None
+        typecode = fixed_width_typecode(cpp_type)
+        if typecode is not None:
+            values = storage.view(*meta['values']).cast(typecode)
+        super().__init__(storage.view(*meta['repetition_levels']), storage.view(*meta['definition_levels']),
+                         values, decode_statistics(cpp_type, meta['statistics']), bloom_filter)
+        self._cpp_type = cpp_type
+        self._encoded_values = storage.view(*meta['values']) if values is None else None
+
+    @property
+    def values(self) -> typing.Sequence[typing.Any]:
+        if self._values is None:
+            # strings and bools are decoded once per process
+            self._values = decode_values(self._cpp_type, self._encoded_values)
+            self._encoded_values = None
+        return self._values
+
+
+class SharedFieldStorage(ChunkedFieldStorage):
+    """ Read-only storage in a shared memory segment, attached by name from any process on the host.
+
+    Pickled as its name only, so it can be passed to workers of process pools.
+    """
+    def __init__(self, shm: shared_memory.SharedMemory, owner: bool = False) -> None:
+        self._shm = shm
+        self._owner = owner
+        length, = _HEADER_SIZE.unpack_from(shm.buf)
+        header = json.loads(bytes(shm.buf[_HEADER_SIZE.size:_HEADER_SIZE.size + length]).decode('utf-8'))
+        self._data_start = _align(_HEADER_SIZE.size + length)
+        field_graph = field_graph_from_json(header['fields'])
+        row_groups = []
+        for meta in header['row_groups']:
+            columns = dict((path, SharedColumnChunk(self, field_graph.get_field(path), column))
+                           for path, column in meta['columns'].items())
+            row_groups.append(RowGroup(field_graph, meta['num_records'], columns))
+        super().__init__(field_graph, row_groups, header['snapshot_id'])
+        self._storage_id = header['storage_id']
+
+    @property
+    def name(self) -> str:
+        return self._shm.name
+
+    def view(self, offset: int, length: int) -> memoryview:
+        start = self._data_start + offset
+        return self._shm.buf[start:start + length]
+
+    def close(self) -> None:
+        """ Detach from the segment, which is kept until unlinked by its creator. """
+        if self._shm is None:
+            return
+        self._row_groups = []
+        try:
+            self._shm.close()
+        except BufferError:
+            # views are still used, unmapped once released
+            pass
+        if self._owner:
+            self._shm.unlink()
+            _created.discard(self._shm.name)
+        self._shm = None
+
+    def __del__(self) -> None:
+        # NOTE(me): drop views before the segment, which cannot be unmapped while they exist
+        self._row_groups = []
+
+    def __enter__(self) -> 'SharedFieldStorage':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def __reduce__(self):
+        return attach_storage, (self.name,)
+
+
+def create_shared_storage(storage: ChunkedFieldStorage, name: typing.Optional[str] = None) -> SharedFieldStorage:
+    """ Copy `storage` into a new shared memory segment, removed when the returned storage is closed. """
+    layout = _Layout()
+    row_groups = []
+    for g in storage.row_groups():
+        columns = dict((path, _layout_column(layout, storage.field_graph.get_field(path), chunk))
+                       for path, chunk in g.columns.items())
+        row_groups.append({'num_records': g.num_records(), 'columns': columns})
+    storage_id, snapshot_id = storage.snapshot_key()
+    header = json.dumps({
+        'fields': field_graph_to_json(storage.field_graph),
+        'row_groups': row_groups,
+        'snapshot_id': snapshot_id,
+        'storage_id': storage_id,
+    }).encode('utf-8')
+
+    data_start = _align(_HEADER_SIZE.size + len(header))
+    shm = shared_memory.SharedMemory(name=name, create=True, size=max(1, data_start + layout.size))
+    try:
+        _HEADER_SIZE.pack_into(shm.buf, 0, len(header))
+        shm.buf[_HEADER_SIZE.size:_HEADER_SIZE.size + len(header)] = header
+        for offset, data in layout.buffers:
+            shm.buf[data_start + offset:data_start + offset + len(data)] = data
+        _created.add(shm.name)
+        return SharedFieldStorage(shm, owner=True)
+    except BaseException:
+        shm.close()
+        shm.unlink()
+        raise
+
+
+def attach_storage(name: str) -> SharedFieldStorage:
+    """ Attach to a segment created by `create_shared_storage`, in any process. """
+    try:
+        shm = shared_memory.SharedMemory(name=name)
+    except FileNotFoundError:
+        raise SharedMemoryError(f'No shared storage named {name}')
+    if name not in _created and os.name == 'posix':
+        # NOTE(me): only the creator owns the segment, or it would be removed when an attached process exits.
+        # POSIX segments are tracked by the name with the leading slash, which `name` drops.
+        resource_tracker.unregister(f'/{shm.name}', 'shared_memory')
+    return SharedFieldStorage(shm)
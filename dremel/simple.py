@@ -8,7 +8,8 @@ from google.protobuf.descriptor import Descriptor
 
 from dremel.field_graph import FieldNode
 from dremel.writer import new_message_writer
-from dremel.reader import FieldStorage, FieldReader, SchemaFieldDescriptor, ReadError
+from dremel.reader import FieldStorage, FieldReader, ReadError
+from dremel.schema_pb2 import SchemaFieldDescriptor
 
 
 # simple way to bridge readers and writers
@@ -42,12 +43,18 @@ class SimpleFieldStorage(FieldStorage):
     def list_fields(self) -> typing.List[str]:
         return list(self._col_data.keys())
 
+    def num_records(self) -> int:
+        col = next(iter(self._col_data.values()), [])
+        return sum(1 for r, _, _ in col if r == 0)
+
     @property
     def field_graph(self):
         return self._field_graph
 
 
 class SimpleFieldReader(FieldReader):
+    __slots__ = ('_col', '_node', '_pos')
+
     def __init__(self, col, node):
         super().__init__()
         self._col = col
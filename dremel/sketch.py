@@ -0,0 +1,343 @@
+#!/usr/bin/env python
+
+import array
+import hashlib
+import math
+import random
+import typing
+
+from dremel.reader import FieldStorage, read_records
+from dremel.sampling import Sample
+
+
+class SketchError(Exception):
+    pass
+
+
+def _hash128(value: typing.Any) -> typing.Tuple[int, int]:
+    """ Stable hash of column values, independent of `PYTHONHASHSEED`. """
+    if isinstance(value, bytes):
+        data = b'b' + value
+    elif isinstance(value, str):
+        data = b's' + value.encode('utf-8')
+    else:
+        data = b'v' + repr(value).encode('utf-8')
+    digest = hashlib.blake2b(data, digest_size=16).digest()
+    return int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little')
+
+
+class Sketch(object):
+    """ Fixed-size summary of column values which can be merged with others. """
+    def add(self, value: typing.Any) -> None:
+        raise NotImplementedError()
+
+    def update(self, values: typing.Iterable[typing.Any]) -> 'Sketch':
+        for value in values:
+            self.add(value)
+        return self
+
+    def merge(self, other: 'Sketch') -> 'Sketch':
+        raise NotImplementedError()
+
+
+class HyperLogLog(Sketch):
+    """ Distinct counts with a relative error about `1.04 / sqrt(2**precision)`. """
+    def __init__(self, precision: int = 14) -> None:
+        super().__init__()
+        if not 4 <= precision <= 18:
+            raise SketchError(f'Invalid precision: {precision}')
+        self._precision = precision
+        self._registers = bytearray(1 << precision)
+
+    @property
+    def precision(self) -> int:
+        return self._precision
+
+    def add(self, value: typing.Any) -> None:
+        h, _ = _hash128(value)
+        index = h >> (64 - self._precision)
+        bits = 64 - self._precision
+        rest = h & ((1 << bits) - 1)
+        rank = bits - rest.bit_length() + 1
+        if rank > self._registers[index]:
+            self._registers[index] = rank
+
+    def merge(self, other: 'HyperLogLog') -> 'HyperLogLog':
+        if not isinstance(other, HyperLogLog) or other._precision != self._precision:
+            raise SketchError(f'Cannot merge {other} into {self}')
+        self._registers = bytearray(map(max, self._registers, other._registers))
+        return self
+
+    def estimate(self) -> float:
+        m = len(self._registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / sum(2.0 ** -r for r in self._registers)
+        zeros = self._registers.count(0)
+        if raw <= 2.5 * m and zeros > 0:
+            # linear counting for small cardinalities
+            return m * math.log(m / zeros)
+        return raw
+
+    def relative_error(self) -> float:
+        return 1.04 / math.sqrt(len(self._registers))
+
+    def __repr__(self) -> str:
+        return f'<HyperLogLog:p={self._precision} ~{self.estimate():.0f}>'
+
+
+class QuantileSketch(Sketch):
+    """ KLL sketch, keeping O(k) values with rank error about `1.7 / k`. """
+    def __init__(self, k: int = 200, seed: int = 0) -> None:
+        super().__init__()
+        if k < 8:
+            raise SketchError(f'Invalid k: {k}')
+        self._k = k
+        self._random = random.Random(seed)
+        self._compactors = [[]]
+        self._count = 0
+        self._size = 0
+        self._max_size = self._capacity(0)
+
+    @property
+    def count(self) -> int:
+        return self._count
+
+    def _capacity(self, height: int) -> int:
+        depth = len(self._compactors) - height - 1
+        return int(math.ceil(self._k * (2.0 / 3.0) ** depth)) + 1
+
+    def _grow(self) -> None:
+        self._compactors.append([])
+        self._max_size = sum(self._capacity(h) for h in range(len(self._compactors)))
+
+    def _compress(self) -> None:
+        while self._size >= self._max_size:
+            for height, items in enumerate(self._compactors):
+                if len(items) < self._capacity(height):
+                    continue
+                if height + 1 >= len(self._compactors):
+                    self._grow()
+                # promote every other value of sorted pairs, keeping the odd one
+                items.sort()
+                keep = items.pop() if len(items) % 2 else None
+                offset = self._random.randint(0, 1)
+                self._compactors[height + 1].extend(items[offset::2])
+                self._compactors[height] = [] if keep is None else [keep]
+                self._size = sum(len(c) for c in self._compactors)
+                break
+
+    def add(self, value: typing.Any) -> None:
+        self._compactors[0].append(value)
+        self._count += 1
+        self._size += 1
+        if self._size >= self._max_size:
+            self._compress()
+
+    def merge(self, other: 'QuantileSketch') -> 'QuantileSketch':
+        if not isinstance(other, QuantileSketch) or other._k != self._k:
+            raise SketchError(f'Cannot merge {other} into {self}')
+        while len(self._compactors) < len(other._compactors):
+            self._grow()
+        for height, items in enumerate(other._compactors):
+            self._compactors[height].extend(items)
+        self._count += other._count
+        self._size = sum(len(c) for c in self._compactors)
+        self._compress()
+        return self
+
+    def _weighted_values(self) -> typing.List[typing.Tuple[typing.Any, int]]:
+        return sorted((v, 1 << height)
+                      for height, items in enumerate(self._compactors) for v in items)
+
+    def quantiles(self, qs: typing.Iterable[float]) -> typing.List[typing.Any]:
+        weighted = self._weighted_values()
+        if not weighted:
+            return [None for _ in qs]
+        total = sum(w for _, w in weighted)
+        results = []
+        for q in qs:
+            if not 0.0 <= q <= 1.0:
+                raise SketchError(f'Invalid quantile: {q}')
+            target = q * total
+            cumulative = 0
+            result = weighted[-1][0]
+            for value, weight in weighted:
+                cumulative += weight
+                if cumulative >= target:
+                    result = value
+                    break
+            results.append(result)
+        return results
+
+    def quantile(self, q: float) -> typing.Any:
+        return self.quantiles([q])[0]
+
+    def rank(self, value: typing.Any) -> float:
+        """ Estimated fraction of values less than or equal to `value`. """
+        weighted = self._weighted_values()
+        total = sum(w for _, w in weighted)
+        if total == 0:
+            return 0.0
+        return sum(w for v, w in weighted if v <= value) / total
+
+    def __repr__(self) -> str:
+        return f'<QuantileSketch:k={self._k} n={self._count} kept={self._size}>'
+
+
+class CountMinSketch(Sketch):
+    """ Frequencies which never under-estimate, tracking the `capacity` heaviest values. """
+    def __init__(self, width: int = 2048, depth: int = 5, capacity: int = 32) -> None:
+        super().__init__()
+        if width <= 0 or depth <= 0:
+            raise SketchError(f'Invalid dimensions: {width}x{depth}')
+        self._width = width
+        self._depth = depth
+        self._capacity = capacity
+        self._table = [array.array('q', bytes(8 * width)) for _ in range(depth)]
+        self._count = 0
+        self._heavy = dict()
+
+    @property
+    def count(self) -> int:
+        return self._count
+
+    def _indexes(self, value: typing.Any) -> typing.List[int]:
+        h1, h2 = _hash128(value)
+        return [(h1 + i * h2) % self._width for i in range(self._depth)]
+
+    def add(self, value: typing.Any, count: int = 1) -> None:
+        estimate = None
+        for row, index in zip(self._table, self._indexes(value)):
+            row[index] += count
+            if estimate is None or row[index] < estimate:
+                estimate = row[index]
+        self._count += count
+        self._track(value, estimate)
+
+    def _track(self, value: typing.Any, estimate: int) -> None:
+        if value in self._heavy or len(self._heavy) < self._capacity:
+            self._heavy[value] = estimate
+            return
+        lightest = min(self._heavy, key=self._heavy.get)
+        if self._heavy[lightest] < estimate:
+            del self._heavy[lightest]
+            self._heavy[value] = estimate
+
+    def estimate(self, value: typing.Any) -> int:
+        return min(row[index] for row, index in zip(self._table, self._indexes(value)))
+
+    def merge(self, other: 'CountMinSketch') -> 'CountMinSketch':
+        if (not isinstance(other, CountMinSketch) or
+                (other._width, other._depth) != (self._width, self._depth)):
+            raise SketchError(f'Cannot merge {other} into {self}')
+        for row, other_row in zip(self._table, other._table):
+            for i, c in enumerate(other_row):
+                if c:
+                    row[i] += c
+        self._count += other._count
+        candidates = set(self._heavy) | set(other._heavy)
+        self._heavy = dict()
+        for value in candidates:
+            self._track(value, self.estimate(value))
+        return self
+
+    def heavy_hitters(self, n: typing.Optional[int] = None) -> typing.List[typing.Tuple[typing.Any, int]]:
+        hitters = sorted(((v, self.estimate(v)) for v in self._heavy),
+                         key=lambda e: e[1], reverse=True)
+        return hitters[:n] if n is not None else hitters
+
+    def __repr__(self) -> str:
+        return f'<CountMinSketch:{self._width}x{self._depth} n={self._count}>'
+
+
+class BloomFilter(Sketch):
+    """ Set membership without false negatives, built for equality lookups. """
+    def __init__(self, num_bits: int = 8192, num_hashes: int = 5) -> None:
+        super().__init__()
+        if num_bits <= 0 or num_hashes <= 0:
+            raise SketchError(f'Invalid dimensions: {num_bits} bits, {num_hashes} hashes')
+        self._num_bits = num_bits
+        self._num_hashes = num_hashes
+        self._bits = bytearray((num_bits + 7) // 8)
+
+    @classmethod
+    def for_capacity(cls, capacity: int, fp_rate: float = 0.01) -> 'BloomFilter':
+        """ Size a filter for `capacity` values at a false positive rate of `fp_rate`. """
+        capacity = max(1, capacity)
+        num_bits = int(math.ceil(-capacity * math.log(fp_rate) / (math.log(2) ** 2)))
+        num_hashes = max(1, int(round(num_bits / capacity * math.log(2))))
+        return cls(num_bits, num_hashes)
+
+    @property
+    def num_bits(self) -> int:
+        return self._num_bits
+
+    @property
+    def num_hashes(self) -> int:
+        return self._num_hashes
+
+    def _indexes(self, value: typing.Any) -> typing.Generator[int, None, None]:
+        h1, h2 = _hash128(value)
+        for i in range(self._num_hashes):
+            yield (h1 + i * h2) % self._num_bits
+
+    def add(self, value: typing.Any) -> None:
+        for index in self._indexes(value):
+            self._bits[index >> 3] |= 1 << (index & 7)
+
+    def might_contain(self, value: typing.Any) -> bool:
+        return all(self._bits[index >> 3] & (1 << (index & 7)) for index in self._indexes(value))
+
+    def to_bytes(self) -> bytes:
+        return bytes(self._bits)
+
+    @classmethod
+    def from_bytes(cls, num_bits: int, num_hashes: int, data: bytes) -> 'BloomFilter':
+        bloom_filter = cls(num_bits, num_hashes)
+        if len(data) != len(bloom_filter._bits):
+            raise SketchError(f'Invalid size of bloom filter: {len(data)}')
+        bloom_filter._bits = bytearray(data)
+        return bloom_filter
+
+    def merge(self, other: 'BloomFilter') -> 'BloomFilter':
+        if (not isinstance(other, BloomFilter) or
+                (other._num_bits, other._num_hashes) != (self._num_bits, self._num_hashes)):
+            raise SketchError(f'Cannot merge {other} into {self}')
+        self._bits = bytearray(a | b for a, b in zip(self._bits, other._bits))
+        return self
+
+    def __repr__(self) -> str:
+        return f'<BloomFilter:bits={self._num_bits} hashes={self._num_hashes}>'
+
+
+def column_values(storage: FieldStorage, field: str, sample: typing.Optional[Sample] = None) ->\
+    typing.Generator[typing.Any, None, None]:
+    """ Yield all defined values of a leaf column, skipping NULLs without reading them. """
+    for _, values in read_records(storage, field, sample):
+        yield from values
+
+
+def sketch_column(storage: FieldStorage, field: str, sketch: Sketch,
+                  sample: typing.Optional[Sample] = None) -> Sketch:
+    """ Feed a column into `sketch`, so sketches of several storages can be merged.
+
+    With `sample` only values of the sampled records are summarized: quantiles
+    stay unbiased and frequencies scale by `sample.scale`, while distinct counts
+    are those of the sample only.
+    """
+    return sketch.update(column_values(storage, field, sample))
+
+
+def approx_count_distinct(storage: FieldStorage, field: str, precision: int = 14,
+                          sample: typing.Optional[Sample] = None) -> HyperLogLog:
+    return sketch_column(storage, field, HyperLogLog(precision), sample)
+
+
+def approx_quantiles(storage: FieldStorage, field: str, k: int = 200,
+                     sample: typing.Optional[Sample] = None) -> QuantileSketch:
+    return sketch_column(storage, field, QuantileSketch(k), sample)
+
+
+def approx_heavy_hitters(storage: FieldStorage, field: str, capacity: int = 32,
+                         sample: typing.Optional[Sample] = None) -> CountMinSketch:
+    return sketch_column(storage, field, CountMinSketch(capacity=capacity), sample)
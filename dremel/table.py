@@ -0,0 +1,334 @@
+#!/usr/bin/env python
+
+import collections
+import concurrent.futures
+import json
+import os
+import queue
+import tempfile
+import threading
+import typing
+import uuid
+
+from dremel.consts import *
+from dremel.chunked import DEFAULT_ROW_GROUP_SIZE, ChunkedFieldStorage, ColumnStatistics, create_chunked_storage
+from dremel.encoding import AUTO
+from dremel.field_graph import FieldGraph, load_schema, save_schema
+from dremel.file import (FileError, FileFieldStorage, append_storage, locked, open_storage, read_fingerprint,
+                         read_snapshot_key, write_storage)
+from dremel.predicate import Predicate
+from dremel.profiling import bind_profile
+from dremel.reader import scan as scan_storage
+
+if typing.TYPE_CHECKING:
+    from google.protobuf.descriptor import Descriptor
+    from google.protobuf.message import Message
+
+MANIFEST = '_manifest.json'
+SCHEMA = '_schema.pb'
+VERSION = 1
+# rows of a partition scanned ahead of the consumer
+DEFAULT_MAX_QUEUED = 1024
+
+_END = object()
+
+
+class TableError(Exception):
+    pass
+
+
+def _normalize_partition_by(partition_by: typing.List[typing.Union[str, typing.Tuple[str, int]]]) ->\
+    typing.List[typing.Tuple[str, typing.Optional[int]]]:
+    keys = []
+    for key in partition_by:
+        field, width = (key, None) if isinstance(key, str) else key
+        if width is not None and width <= 0:
+            raise TableError(f'Invalid partition width of {field}: {width}')
+        keys.append((field, width))
+    if not keys:
+        raise TableError('No partition keys')
+    return keys
+
+
+def _check_partition_fields(desc: 'Descriptor', partition_by: typing.List[typing.Tuple[str, typing.Optional[int]]]) -> None:
+    for field, width in partition_by:
+        field_desc = desc.fields_by_name.get(field)
+        if field_desc is None or field_desc.label != LABEL_REQUIRED or \
+                field_desc.cpp_type == CPPTYPE_MESSAGE or field_desc.type == TYPE_BYTES:
+            raise TableError(f'Not a top-level required leaf field: {field}')
+        if width is not None and field_desc.cpp_type not in (
+                CPPTYPE_INT32, CPPTYPE_INT64,
+                CPPTYPE_UINT32, CPPTYPE_UINT64):
+            raise TableError(f'Only integer fields can be partitioned by ranges: {field}')
+
+
+class Table(object):
+    """ Directory of column files, one per partition of records by top-level required leaf fields.
+
+    A partition key is either a field, holding records of one value, or a
+    `(field, width)` pair of an integer field, holding records of values in
+    `[start, start + width)`. The manifest lists partitions with their key
+    values, so scans prune partitions from predicates before opening files.
+    """
+    def __init__(self, path: str) -> None:
+        super().__init__()
+        self._path = path
+        self._manifest = self._read_manifest()
+        self._field_graph = None
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    @property
+    def snapshot_id(self) -> int:
+        return self._manifest['snapshot_id']
+
+    def snapshot_key(self) -> typing.Tuple[str, int]:
+        return self._manifest['table_id'], self._manifest['snapshot_id']
+
+    @property
+    def partition_by(self) -> typing.List[typing.Tuple[str, typing.Optional[int]]]:
+        return [tuple(key) for key in self._manifest['partition_by']]
+
+    @property
+    def fingerprint(self) -> typing.Optional[str]:
+        """ Fingerprint of the fields of all partitions, or None before any records are added. """
+        return self._manifest.get('fingerprint')
+
+    @property
+    def field_graph(self) -> typing.Optional[FieldGraph]:
+        """ Fields of all partitions, loaded from the schema file without opening any partition. """
+        if self._field_graph is None and self.fingerprint is not None:
+            self._field_graph = load_schema(os.path.join(self._path, SCHEMA))
+        return self._field_graph
+
+    def partitions(self) -> typing.List[dict]:
+        return list(self._manifest['partitions'])
+
+    def num_records(self) -> int:
+        return sum(p['num_records'] for p in self._manifest['partitions'])
+
+    def _read_manifest(self) -> dict:
+        try:
+            with open(os.path.join(self._path, MANIFEST), 'r') as fd:
+                manifest = json.load(fd)
+        except FileNotFoundError:
+            raise TableError(f'Not a table: {self._path}')
+        if manifest.get('version') != VERSION:
+            raise TableError(f'Unsupported version: {manifest.get("version")}')
+        return manifest
+
+    def _write_manifest(self, manifest: dict) -> None:
+        path = os.path.join(self._path, MANIFEST)
+        fd, tmp_path = tempfile.mkstemp(prefix=f'{MANIFEST}.', suffix='.tmp', dir=self._path)
+        try:
+            with os.fdopen(fd, 'w') as out:
+                json.dump(manifest, out)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self._manifest = manifest
+
+    def reload(self) -> int:
+        """ Switch to the latest snapshot of the table, returning its id. """
+        self._manifest = self._read_manifest()
+        self._field_graph = None
+        return self.snapshot_id
+
+    def partition_key(self, msg: 'Message') -> typing.Tuple:
+        key = []
+        for field, width in self.partition_by:
+            value = getattr(msg, field)
+            key.append(value - value % width if width is not None else value)
+        return tuple(key)
+
+    def _partition_statistics(self, partition: dict) -> typing.Dict[str, ColumnStatistics]:
+        statistics = dict()
+        for (field, width), value in zip(self.partition_by, partition['key']):
+            upper = value + width - 1 if width is not None else value
+            statistics[field] = ColumnStatistics(partition['num_records'], 0, value, upper)
+        return statistics
+
+    def prune(self, predicates: typing.Optional[typing.List[Predicate]] = None) -> typing.List[dict]:
+        """ Partitions which may have records matching all `predicates`. """
+        partitions = []
+        for partition in self._manifest['partitions']:
+            statistics = self._partition_statistics(partition)
+            if not any(p.field in statistics and p.can_skip(statistics[p.field]) for p in predicates or []):
+                partitions.append(partition)
+        return partitions
+
+    def open_partition(self, partition: dict) -> FileFieldStorage:
+        """ Column file of a partition, which should be closed after use. """
+        return open_storage(os.path.join(self._path, partition['file']))
+
+    def _partition_snapshot(self, storage: FileFieldStorage, partition: dict) -> ChunkedFieldStorage:
+        """ Row groups of the partition as of this snapshot of the table. """
+        if 'snapshot_id' in partition:
+            try:
+                return storage.snapshot(partition['snapshot_id'], partition['file_id'])
+            except FileError as e:
+                raise TableError(f'Snapshot of partition is gone: {partition["file"]}') from e
+        # NOTE(me): manifests written before snapshot ids, whose files may only grow by appends
+        row_groups = storage.row_groups()
+        if len(row_groups) < partition['num_row_groups']:
+            raise TableError(f'Missing row groups in partition: {partition["file"]}')
+        return ChunkedFieldStorage(storage.field_graph, row_groups[:partition['num_row_groups']])
+
+    def append(self, desc: 'Descriptor', msgs: typing.Iterable['Message']) -> int:
+        """ Add records into their partitions, returning the new snapshot id.
+
+        The manifest is replaced after column files are written, so scans by
+        other tables opened before keep their snapshot. Appends of other
+        tables (and processes) wait for each other, and add to the latest
+        snapshot rather than the one of this table.
+        """
+        groups = collections.defaultdict(list)
+        for msg in msgs:
+            groups[self.partition_key(msg)].append(msg)
+
+        with locked(os.path.join(self._path, MANIFEST)):
+            self._manifest = self._read_manifest()
+            self._field_graph = None
+            self._write_manifest(self._append_groups(desc, groups))
+        return self.snapshot_id
+
+    def _append_groups(self, desc: 'Descriptor', groups: typing.Dict[typing.Tuple, typing.List['Message']]) -> dict:
+        """ Manifest of the next snapshot, after writing `groups` of records into their partitions. """
+        manifest = json.loads(json.dumps(self._manifest))
+        options = manifest['options']
+        partitions = dict((tuple(p['key']), p) for p in manifest['partitions'])
+        schema_saved = manifest.get('fingerprint') is not None
+        if not schema_saved and manifest['partitions']:
+            # NOTE(me): tables written before fingerprints keep the fields of their partitions
+            manifest['fingerprint'] = read_fingerprint(os.path.join(self._path, manifest['partitions'][0]['file']))
+        for key in sorted(groups):
+            storage = create_chunked_storage(desc, groups[key], options['fields'], options['row_group_size'],
+                                             options['bloom_filter_fields'])
+            # NOTE(me): records of one append share fields, so mismatches fail before any write
+            if manifest.get('fingerprint') is None:
+                manifest['fingerprint'] = storage.field_graph.fingerprint
+            elif manifest['fingerprint'] != storage.field_graph.fingerprint:
+                raise TableError(f'Fields of records mismatch the table: {self._path}')
+            if not schema_saved:
+                save_schema(os.path.join(self._path, SCHEMA), storage.field_graph)
+                schema_saved = True
+            partition = partitions.get(key)
+            if partition is None:
+                partition = {'file': f'part-{manifest["next_file"]:05d}.dremel', 'key': list(key),
+                             'num_records': 0, 'num_row_groups': 0}
+                manifest['next_file'] += 1
+                write_storage(os.path.join(self._path, partition['file']), storage,
+                              options['codecs'], options['default_codec'])
+                partitions[key] = partition
+            else:
+                append_storage(os.path.join(self._path, partition['file']), storage,
+                               options['codecs'], options['default_codec'])
+            partition['num_records'] += storage.num_records()
+            partition['num_row_groups'] += len(storage.row_groups())
+            # NOTE(me): compactions rewrite row groups, snapshots are found by ids rather than counts
+            partition['file_id'], partition['snapshot_id'] = read_snapshot_key(
+                os.path.join(self._path, partition['file']))
+
+        manifest['partitions'] = [partitions[key] for key in sorted(partitions)]
+        manifest['snapshot_id'] += 1
+        return manifest
+
+    def _scan_partition(self, partition: dict, project_fields: typing.List[str],
+                        predicates: typing.Optional[typing.List[Predicate]],
+                        limit: typing.Optional[int], rows: queue.Queue, stop: threading.Event) -> None:
+        try:
+            with self.open_partition(partition) as storage:
+                storage = self._partition_snapshot(storage, partition)
+                for values, fetch_level in scan_storage(storage, project_fields, predicates, limit):
+                    if not _put(rows, (values[:], fetch_level), stop):
+                        return
+        finally:
+            _put(rows, _END, stop)
+
+    def scan(self, project_fields: typing.List[str],
+             predicates: typing.Optional[typing.List[Predicate]] = None,
+             limit: typing.Optional[int] = None,
+             max_workers: typing.Optional[int] = None,
+             max_queued: int = DEFAULT_MAX_QUEUED) ->\
+        typing.Generator[typing.Tuple[typing.List[typing.Any], int], None, None]:
+        """ Union of scans over partitions not pruned by `predicates`, run in parallel.
+
+        Rows are emitted in the order of partition keys. Each partition is
+        scanned at most `max_queued` rows ahead, and workers stop once the
+        consumer does.
+        """
+        partitions = self.prune(predicates)
+        num_records = 0
+        stop = threading.Event()
+        queues = [queue.Queue(max_queued) for _ in partitions]
+        # NOTE(me): workers take partitions in order, the one consumed is always running before later ones
+        with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+            futures = [executor.submit(bind_profile(self._scan_partition), p, project_fields, predicates, limit, q, stop)
+                       for p, q in zip(partitions, queues)]
+            try:
+                for future, rows in zip(futures, queues):
+                    for values, fetch_level in iter(rows.get, _END):
+                        if fetch_level == 0:
+                            if limit is not None and num_records >= limit:
+                                return
+                            num_records += 1
+                        yield values, fetch_level
+                    # errors of the partition
+                    future.result()
+            finally:
+                stop.set()
+                for future in futures:
+                    future.cancel()
+
+
+def _put(rows: queue.Queue, item: typing.Any, stop: threading.Event) -> bool:
+    """ Queue `item` once there is room, or return False if the scan stopped. """
+    while not stop.is_set():
+        try:
+            rows.put(item, timeout=0.05)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def create_table(path: str, desc: 'Descriptor', msgs: typing.Iterable['Message'],
+                 partition_by: typing.List[typing.Union[str, typing.Tuple[str, int]]],
+                 fields=None,
+                 row_group_size: int = DEFAULT_ROW_GROUP_SIZE,
+                 bloom_filter_fields: typing.Optional[typing.List[str]] = None,
+                 codecs: typing.Optional[typing.Dict[str, str]] = None,
+                 default_codec: str = AUTO) -> Table:
+    """ Create a table directory at `path` with records partitioned by `partition_by`. """
+    partition_by = _normalize_partition_by(partition_by)
+    _check_partition_fields(desc, partition_by)
+    os.makedirs(path, exist_ok=True)
+    if os.path.exists(os.path.join(path, MANIFEST)):
+        raise TableError(f'Table exists: {path}')
+    with open(os.path.join(path, MANIFEST), 'w') as fd:
+        json.dump({
+            'version': VERSION,
+            'table_id': uuid.uuid4().hex,
+            'snapshot_id': 0,
+            'partition_by': [list(key) for key in partition_by],
+            'options': {
+                'fields': fields,
+                'row_group_size': row_group_size,
+                'bloom_filter_fields': bloom_filter_fields,
+                'codecs': codecs,
+                'default_codec': default_codec,
+            },
+            'next_file': 0,
+            'partitions': [],
+        }, fd)
+    table = Table(path)
+    table.append(desc, msgs)
+    return table
+
+
+def open_table(path: str) -> Table:
+    return Table(path)
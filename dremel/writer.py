@@ -15,6 +15,9 @@ class DissectError(Exception):
 
 
 class FieldMixin(object):
+    # NOTE(me): attributes are stored in slots of FieldWriter
+    __slots__ = ()
+
     def __init__(self, path, desc,
                  max_repetition_level=0,
                  definition_level=0):
@@ -42,11 +45,17 @@ class FieldMixin(object):
 
 
 class FieldWriter(FieldMixin, Node):
+    __slots__ = ('_path', '_desc', '_max_repetition_level', '_definition_level',
+                 '_label', '_name', '_write_callback')
+
     def __init__(self, path, desc,
                  max_repetition_level=0,
                  definition_level=0,
                  write_callback=None):
         super().__init__(path, desc, max_repetition_level, definition_level)
+        # copied out of the descriptor for `accept`, called for every message
+        self._label = desc.label if desc else None
+        self._name = desc.name if desc else None
         self._write_callback = write_callback
 
     def set_write_callback(self, callback):
@@ -63,17 +72,17 @@ class FieldWriter(FieldMixin, Node):
 
         # NOTE(me): Here `msg` is the outer scope for values, by which in cpp
         # it would be more convenient to handle field type dispatching.
-        label = self._desc.label
-        field_name = self._desc.name
-        if label == FieldDescriptor.LABEL_REQUIRED:
+        label = self._label
+        field_name = self._name
+        if label == LABEL_REQUIRED:
             assert msg.HasField(field_name), f"Missing required field: {field_name}"
             self._accept(r, d, getattr(msg, field_name), visitor)
-        elif label == FieldDescriptor.LABEL_OPTIONAL:
+        elif label == LABEL_OPTIONAL:
             has_val = msg.HasField(field_name)
             local_d = d+1 if has_val else d
             val = getattr(msg, field_name) if has_val else None
             self._accept(r, local_d, val, visitor)
-        elif label == FieldDescriptor.LABEL_REPEATED:
+        elif label == LABEL_REPEATED:
             vals = getattr(msg, field_name)
             if len(vals) == 0:
                 self._accept(r, d, None, visitor)
@@ -90,6 +99,8 @@ class FieldWriter(FieldMixin, Node):
 
 
 class MessageWriter(FieldWriter, CompositeNode):
+    __slots__ = ('_field_graph',)
+
     def __init__(self, path, desc,
                  max_repetition_level=0,
                  definition_level=0):
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+
+import asyncio
+import os
+import tempfile
+import unittest
+
+from .document_pb2 import Document
+from dremel.aio import assemble_async, scan_async
+from dremel.assembly import MessageAssemblyBuilder
+from dremel.chunked import create_chunked_storage
+from dremel.file import open_storage, write_storage
+from dremel.predicate import RangePredicate
+from dremel.reader import ReadError, scan
+from dremel.sampling import Sample
+from dremel.simple import create_simple_storage
+from .utils import create_random_doc
+
+
+def rows(it):
+    return [(values[:], level) for values, level in it]
+
+
+async def async_rows(it):
+    return [(values[:], level) async for values, level in it]
+
+
+class AsyncTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'docs.dremel')
+        self.docs = [create_random_doc() for _ in range(300)]
+        write_storage(self.path, create_chunked_storage(Document.DESCRIPTOR, self.docs, row_group_size=40))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def run_async(self, coro):
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(coro)
+        finally:
+            loop.close()
+
+    def test_scan(self):
+        fields = ['doc_id', 'name.url', 'name.language.code']
+        predicates = [RangePredicate('doc_id', 200000, 800000)]
+        sample = Sample(0.5, seed=3)
+        with open_storage(self.path) as storage:
+            for kwargs in [{}, {'predicates': predicates, 'limit': 70}, {'sample': sample}]:
+                self.assertEqual(rows(scan(storage, fields, **kwargs)),
+                                 self.run_async(async_rows(scan_async(storage, fields, **kwargs))))
+            self.assertEqual(rows(scan(storage, fields)),
+                             self.run_async(async_rows(scan_async(storage, fields, readahead=0))))
+
+            simple = create_simple_storage(Document.DESCRIPTOR, self.docs)
+            self.assertEqual(rows(scan(simple, fields)), self.run_async(async_rows(scan_async(simple, fields))))
+            with self.assertRaises(ReadError):
+                self.run_async(async_rows(scan_async(storage, ['doc_id'], [RangePredicate('nothing', 1)])))
+
+    def test_assemble(self):
+        with open_storage(self.path) as storage:
+            builder = MessageAssemblyBuilder(storage.field_graph, Document)
+            self.run_async(assemble_async(storage, builder))
+            self.assertEqual([str(d) for d in self.docs], [str(m) for m in builder.get_msgs()])
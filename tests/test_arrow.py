@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+
+import unittest
+
+from .document_pb2 import Document
+from dremel.arrow import ExportError, _bitmap, export_columns, to_pyarrow
+from dremel.chunked import create_chunked_storage
+from dremel.reader import ReadError
+from dremel.simple import create_simple_storage
+from .utils import create_random_doc
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+
+def to_pydict(msg):
+    """ Nested dict of all fields of `msg`, None for unset optional fields. """
+    d = dict()
+    for field in msg.DESCRIPTOR.fields:
+        value = getattr(msg, field.name)
+        if field.label == field.LABEL_REPEATED:
+            value = [to_pydict(v) if field.message_type else v for v in value]
+        elif field.message_type:
+            value = to_pydict(value) if msg.HasField(field.name) else None
+        elif field.label == field.LABEL_OPTIONAL and not msg.HasField(field.name):
+            value = None
+        d[field.name] = value
+    return d
+
+
+class ExportTest(unittest.TestCase):
+    def setUp(self):
+        self.docs = [create_random_doc() for _ in range(100)]
+
+    def test_export(self):
+        expected = [to_pydict(d) for d in self.docs]
+        for storage in [create_simple_storage(Document.DESCRIPTOR, self.docs),
+                        create_chunked_storage(Document.DESCRIPTOR, self.docs, row_group_size=30)]:
+            column = export_columns(storage)
+            self.assertEqual(len(self.docs), column.length)
+            self.assertEqual(['doc_id', 'links', 'name'], [c.name for c in column.children])
+            self.assertEqual(expected, column.to_pylist())
+
+            links, name = column.children[1:]
+            self.assertEqual('struct', links.type)
+            self.assertEqual(sum(not d.HasField('links') for d in self.docs), links.null_count)
+            self.assertEqual('list', name.type)
+            self.assertEqual(len(self.docs) + 1, len(name.offsets))
+            self.assertEqual(sum(len(d.name) for d in self.docs), name.offsets[-1])
+
+    def test_projection(self):
+        storage = create_chunked_storage(Document.DESCRIPTOR, self.docs, row_group_size=30)
+        column = export_columns(storage, ['name.language.code', 'links.forward'])
+        self.assertEqual([{
+            'links': {'forward': list(d.links.forward)} if d.HasField('links') else None,
+            'name': [{'language': [{'code': l.code} for l in n.language]} for n in d.name],
+        } for d in self.docs], column.to_pylist())
+        with self.assertRaises(ReadError):
+            export_columns(storage, ['name'])
+
+    def test_bitmap(self):
+        self.assertEqual(b'', _bitmap([]))
+        self.assertEqual(bytes([0b00000101, 0b1]), _bitmap([True, False, True] + [False] * 5 + [True]))
+
+    @unittest.skipIf(pyarrow is None, 'pyarrow is not installed')
+    def test_pyarrow(self):
+        storage = create_chunked_storage(Document.DESCRIPTOR, self.docs)
+        batch = to_pyarrow(storage)
+        self.assertEqual(len(self.docs), batch.num_rows)
+        self.assertEqual([to_pydict(d) for d in self.docs], batch.to_pylist())
+
+    @unittest.skipIf(pyarrow is not None, 'pyarrow is installed')
+    def test_no_pyarrow(self):
+        with self.assertRaises(ExportError):
+            to_pyarrow(create_chunked_storage(Document.DESCRIPTOR, self.docs))
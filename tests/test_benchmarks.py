@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+
+import json
+import os
+import tempfile
+import unittest
+
+from benchmarks.datasets import DATASETS
+from benchmarks.run import BenchmarkError, compare_reports, create_report, main, run_benchmarks
+from benchmarks.startup import run_startup
+from dremel.chunked import create_chunked_storage
+
+
+class BenchmarkTest(unittest.TestCase):
+    def test_datasets(self):
+        for name, create_dataset in DATASETS.items():
+            dataset = create_dataset()
+            records = dataset.records(20, seed=1)
+            self.assertEqual([str(r) for r in records], [str(r) for r in dataset.records(20, seed=1)])
+            storage = create_chunked_storage(dataset.desc, records)
+            self.assertEqual(20, storage.num_records())
+            for f in dataset.scan_fields:
+                self.assertIn(f'__root__.{f}', storage.list_fields())
+
+    def test_run(self):
+        results = run_benchmarks(['deep', 'document'], [10], repeat=1)
+        self.assertEqual([('deep', 'shred'), ('deep', 'scan'), ('deep', 'assemble'), ('deep', 'encode'),
+                          ('document', 'shred'), ('document', 'scan'), ('document', 'assemble'),
+                          ('document', 'encode')],
+                         [(r['dataset'], r['stage']) for r in results])
+        for r in results:
+            self.assertGreater(r['records_per_second'], 0)
+            self.assertGreater(r['peak_bytes'], 0)
+        with self.assertRaises(BenchmarkError):
+            run_benchmarks(['nothing'], [10])
+
+    def test_compare(self):
+        base = create_report(run_benchmarks(['deep'], [10], ['scan'], repeat=1, memory=False))
+        current = json.loads(json.dumps(base))
+        current['results'][0]['seconds'] *= 2
+        rows = compare_reports(base, current)
+        self.assertEqual(1, len(rows))
+        self.assertAlmostEqual(2, rows[0]['ratio'])
+        self.assertTrue(rows[0]['regression'])
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            paths = [os.path.join(tmp_dir, f'{i}.json') for i in range(2)]
+            for path, report in zip(paths, [base, current]):
+                with open(path, 'w') as fd:
+                    json.dump(report, fd)
+            self.assertEqual(0, main(['--compare', paths[0], paths[0]]))
+            self.assertEqual(1, main(['--compare', *paths]))
+
+    def test_startup(self):
+        results = dict((r['stage'], r) for r in run_startup(repeat=1))
+        self.assertEqual(['assemble', 'scan', 'shred', 'table'], sorted(results))
+        # reading storages never needs protobuf
+        self.assertFalse(results['scan']['protobuf'])
+        self.assertFalse(results['table']['protobuf'])
+        self.assertFalse(results['assemble']['protobuf'])
+        self.assertTrue(results['shred']['protobuf'])
+        self.assertGreater(results['scan']['seconds'], 0)
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+
+import array
+import os
+import tempfile
+import unittest
+
+from .document_pb2 import Document
+from dremel import file as column_file
+from dremel.aggregate import sum_values
+from dremel.cache import ColumnCache, LRUCache, ResultCache, set_column_cache, sizeof
+from dremel.chunked import append_records, create_chunked_storage
+from dremel.file import append_storage, open_storage, write_storage
+from dremel.predicate import EqualPredicate, FunctionPredicate, InPredicate, RangePredicate
+from dremel.reader import scan
+from dremel.simple import create_simple_storage
+from dremel.sketch import approx_quantiles
+from .utils import create_random_doc
+
+
+def rows(it):
+    return [(values[:], level) for values, level in it]
+
+
+class LRUCacheTest(unittest.TestCase):
+    def test_eviction(self):
+        cache = LRUCache(max_bytes=100)
+        self.assertEqual(b'a' * 40, cache.get('a', lambda: b'a' * 40))
+        self.assertEqual(b'a' * 40, cache.get('a', lambda: b'x'))
+        cache.put('b', b'b' * 40)
+        cache.get('a', lambda: None)
+        cache.put('c', b'c' * 40)
+        self.assertNotIn('b', cache)
+        self.assertIn('a', cache)
+        self.assertEqual(80, cache.size)
+        cache.put('d', b'd' * 101)
+        self.assertNotIn('d', cache)
+        self.assertEqual({'hits': 2, 'misses': 1, 'evictions': 1, 'entries': 2, 'bytes': 80}, cache.stats())
+
+        cache = LRUCache(max_bytes=100, max_entries=1)
+        cache.put('a', b'')
+        cache.put('b', b'')
+        self.assertEqual(1, len(cache))
+
+    def test_sizeof(self):
+        self.assertEqual(80, sizeof(array.array('q', range(10))))
+        self.assertEqual(16 + 4, sizeof(('ab', 'cd')))
+
+
+class ColumnCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'docs.dremel')
+        self.docs = [create_random_doc() for _ in range(200)]
+        write_storage(self.path, create_chunked_storage(Document.DESCRIPTOR, self.docs, row_group_size=50))
+        self.cache = ColumnCache()
+        self.previous = set_column_cache(self.cache)
+
+    def tearDown(self):
+        set_column_cache(self.previous)
+        self.tmp_dir.cleanup()
+
+    def test_warm_scan(self):
+        fields = ['doc_id', 'name.url', 'name.language.code']
+        with open_storage(self.path) as storage:
+            expected = rows(scan(storage, fields))
+        misses = self.cache.misses
+        self.assertGreater(misses, 0)
+
+        reads = []
+        def counting_decompress(*args):
+            reads.append(args)
+            return decompress(*args)
+        decompress = column_file.decompress
+        column_file.decompress = counting_decompress
+        try:
+            with open_storage(self.path) as storage:
+                self.assertEqual(expected, rows(scan(storage, fields)))
+        finally:
+            column_file.decompress = decompress
+        self.assertEqual([], reads)
+        self.assertEqual(misses, self.cache.misses)
+        self.assertGreater(self.cache.hits, 0)
+
+    def test_file_ids(self):
+        with open_storage(self.path) as storage:
+            file_id = storage.file_id
+            rows(scan(storage, ['doc_id']))
+        more = [create_random_doc() for _ in range(10)]
+        append_storage(self.path, create_chunked_storage(Document.DESCRIPTOR, more))
+        with open_storage(self.path) as storage:
+            self.assertEqual(file_id, storage.file_id)
+            self.assertEqual(sorted(d.doc_id for d in self.docs + more),
+                             sorted(v[0] for v, _ in scan(storage, ['doc_id'])))
+
+        write_storage(self.path, create_chunked_storage(Document.DESCRIPTOR, more))
+        with open_storage(self.path) as storage:
+            self.assertNotEqual(file_id, storage.file_id)
+            self.assertEqual([d.doc_id for d in more], [v[0] for v, _ in scan(storage, ['doc_id'])])
+
+
+class ResultCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.docs = [create_random_doc() for _ in range(100)]
+        self.storage = create_chunked_storage(Document.DESCRIPTOR, self.docs, row_group_size=30)
+        self.cache = ResultCache(max_entries=4)
+
+    def test_query(self):
+        predicates = [RangePredicate('doc_id', 100000), EqualPredicate('name.url', 'x')]
+        result = self.cache.query(scan, self.storage, ['doc_id'], predicates)
+        self.assertEqual(tuple((tuple(v), level) for v, level in rows(scan(self.storage, ['doc_id'], predicates))),
+                         result)
+        # the same query however arguments are passed
+        self.assertIs(result, self.cache.query(scan, self.storage, project_fields=['doc_id'],
+                                               predicates=predicates[::-1], limit=None))
+        self.assertEqual(1, self.cache.hits)
+
+        total = self.cache.query(sum_values, self.storage, 'doc_id')
+        self.assertEqual(sum(d.doc_id for d in self.docs), total.value)
+        self.assertIs(total, self.cache.query(sum_values, self.storage, 'doc_id'))
+
+        # new snapshots invalidate older results
+        more = [create_random_doc() for _ in range(10)]
+        append_records(self.storage, Document.DESCRIPTOR, more)
+        self.assertEqual(sum(d.doc_id for d in self.docs + more),
+                         self.cache.query(sum_values, self.storage, 'doc_id').value)
+        self.assertEqual(1, len(self.cache))
+
+        # other storages are cached apart, and never without snapshot keys
+        simple = create_simple_storage(Document.DESCRIPTOR, self.docs)
+        self.assertIsNone(simple.snapshot_key())
+        self.assertEqual(total, self.cache.query(sum_values, simple, 'doc_id'))
+        self.assertEqual(1, len(self.cache))
+
+    def test_mutable_results(self):
+        sketch = self.cache.query(approx_quantiles, self.storage, 'doc_id')
+        count = sketch.count
+        sketch.update(range(10))
+        cached = self.cache.query(approx_quantiles, self.storage, 'doc_id')
+        self.assertIsNot(sketch, cached)
+        self.assertEqual(count, cached.count)
+
+    def test_predicate_keys(self):
+        self.assertEqual(EqualPredicate('a', 1).key(), EqualPredicate('a', 1).key())
+        self.assertEqual(InPredicate('a', [1, 2]).key(), InPredicate('a', [2, 1]).key())
+        self.assertNotEqual(RangePredicate('a', 1).key(), RangePredicate('a', None, 1).key())
+        self.assertNotEqual(FunctionPredicate('a', lambda v: v).key(), FunctionPredicate('a', lambda v: v).key())
+        # values of other types are other queries
+        self.assertNotEqual(EqualPredicate('a', 1).key(), EqualPredicate('a', True).key())
+        self.assertNotEqual(InPredicate('a', [1]).key(), InPredicate('a', [1.0]).key())
+        self.assertNotEqual(RangePredicate('a', 0).key(), RangePredicate('a', False).key())
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+
+import random
+import unittest
+
+from .document_pb2 import Document
+from dremel.assembly import MessageAssemblyBuilder, assemble
+from dremel.chunked import append_records, compact, create_chunked_storage
+from dremel.field_graph import FieldGraphError
+from dremel.predicate import EqualPredicate, InPredicate, RangePredicate
+from dremel.reader import scan, top_k
+from dremel.sampling import Sample
+from dremel.simple import create_simple_storage
+from .test_simple import to_rdv
+from .utils import create_random_doc
+
+
+def rows(it):
+    return [(values[:], level) for values, level in it]
+
+
+class ChunkedStorageTest(unittest.TestCase):
+    def setUp(self):
+        self.docs = [create_random_doc() for _ in range(300)]
+        self.simple = create_simple_storage(Document.DESCRIPTOR, self.docs)
+        self.storage = create_chunked_storage(Document.DESCRIPTOR, self.docs, row_group_size=16,
+                                              bloom_filter_fields=['name.url'])
+
+    def test_readers(self):
+        self.assertEqual(19, len(self.storage.row_groups()))
+        self.assertEqual(len(self.docs), self.storage.num_records())
+        self.assertIsNone(self.storage.create_field_reader('__root__.name'))
+        for field in self.simple.list_fields():
+            self.assertEqual(to_rdv(self.simple.create_field_reader(field)),
+                             to_rdv(self.storage.create_field_reader(field)))
+
+    def test_read_batch(self):
+        for field in self.simple.list_fields():
+            expected = self.simple.create_field_reader(field).read_batch()
+            reader = self.storage.create_field_reader(field)
+            reader.next()
+            reps, defs = [reader.repetition_level()], [reader.definition_level()]
+            values = [reader.value()] if reader.value() is not None else []
+            while True:
+                batch = reader.read_batch(5)
+                if batch is None:
+                    break
+                self.assertLessEqual(len(batch[0]), 5)
+                reps.extend(batch[0])
+                defs.extend(batch[1])
+                values.extend(batch[2])
+            self.assertTrue(reader.done())
+            self.assertEqual(expected, (reps, defs, values))
+
+        batch = self.storage.create_field_reader('__root__.links.forward').read_batch()
+        self.assertEqual('q', batch[2].typecode)
+
+        for field in ['__root__.links.forward', '__root__.name.url']:
+            expected = self.simple.create_field_reader(field).read_batch()
+            reader = self.storage.create_field_reader(field)
+            buffers = [reader.read_buffers(7)]
+            while buffers[-1] is not None:
+                buffers.append(reader.read_buffers(7))
+            self.assertEqual(expected, tuple([v for b in buffers[:-1] for v in b[i]] for i in range(3)))
+            self.assertIsInstance(buffers[0].repetition_levels, memoryview)
+        forward = self.storage.create_field_reader('__root__.links.forward').read_buffers()
+        self.assertEqual('q', forward.values.format)
+        expected = self.simple.create_field_reader('__root__.links.forward').read_buffers().values.tolist()
+        self.assertEqual(expected[:len(forward.values)], forward.values.tolist())
+
+    def test_assembly(self):
+        builder = MessageAssemblyBuilder(self.storage.field_graph, Document)
+        assemble(self.storage, builder)
+        self.assertEqual([str(d) for d in self.docs], [str(m) for m in builder.get_msgs()])
+
+    def test_scan(self):
+        fields = ['doc_id', 'name.url', 'name.language.code']
+        self.assertEqual(rows(scan(self.simple, fields)), rows(scan(self.storage, fields)))
+
+        sample = Sample(0.3, seed=11)
+        predicates = [RangePredicate('doc_id', 100000, 700000)]
+        self.assertEqual(rows(scan(self.simple, fields, predicates, limit=50, sample=sample)),
+                         rows(scan(self.storage, fields, predicates, limit=50, sample=sample)))
+        self.assertEqual(rows(top_k(self.simple, fields, 'doc_id', 20, predicates=predicates)),
+                         rows(top_k(self.storage, fields, 'doc_id', 20, predicates=predicates)))
+
+    def test_bloom_filter(self):
+        urls = [n.url for d in self.docs for n in d.name if n.HasField('url')]
+        needle = random.choice(urls)
+        expected = [d.doc_id for d in self.docs if any(n.url == needle for n in d.name)]
+
+        predicates = [EqualPredicate('name.url', needle)]
+        skipped = [g.can_skip(predicates) for g in self.storage.row_groups()]
+        self.assertGreater(skipped.count(True), len(skipped) // 2)
+        self.assertEqual(expected, [v[0] for v, level in scan(self.storage, ['doc_id'], predicates)])
+
+        predicates = [InPredicate('name.url', ['nothing', needle])]
+        self.assertEqual(expected, [v[0] for v, level in scan(self.storage, ['doc_id'], predicates)])
+        self.assertTrue(self.storage.can_skip([EqualPredicate('name.url', '\x7f')]))
+
+        # values equal to stored ones but of other types are never filtered out
+        storage = create_chunked_storage(Document.DESCRIPTOR, self.docs, row_group_size=16,
+                                         bloom_filter_fields=['doc_id'])
+        doc_id = self.docs[100].doc_id
+        expected = rows(scan(self.simple, ['doc_id'], [EqualPredicate('doc_id', doc_id)]))
+        self.assertEqual(expected, rows(scan(storage, ['doc_id'], [EqualPredicate('doc_id', float(doc_id))])))
+        self.assertEqual(expected, rows(scan(storage, ['doc_id'], [InPredicate('doc_id', [float(doc_id)])])))
+
+    def test_statistics(self):
+        predicates = [RangePredicate('doc_id', lower=10 ** 7)]
+        self.assertTrue(all(g.can_skip(predicates) for g in self.storage.row_groups()))
+        self.assertEqual([], list(scan(self.storage, ['doc_id'], predicates)))
+        for g in self.storage.row_groups():
+            stats = g.columns['__root__.doc_id'].statistics
+            self.assertEqual(g.num_records(), stats.num_values)
+            self.assertEqual(0, stats.null_count)
+
+    def test_append(self):
+        more = [create_random_doc() for _ in range(40)]
+        reader = self.storage.create_field_reader('__root__.doc_id')
+        self.assertEqual(1, append_records(self.storage, Document.DESCRIPTOR, more, row_group_size=16))
+        self.assertEqual(1, self.storage.snapshot_id)
+        self.assertEqual(19 + 3, len(self.storage.row_groups()))
+        self.assertIsNotNone(self.storage.row_groups()[-1].columns['__root__.name.url'].bloom_filter)
+
+        # readers opened before keep their snapshot
+        self.assertEqual(to_rdv(self.simple.create_field_reader('__root__.doc_id')), to_rdv(reader))
+        builder = MessageAssemblyBuilder(self.storage.field_graph, Document)
+        assemble(self.storage, builder)
+        self.assertEqual([str(d) for d in self.docs + more], [str(m) for m in builder.get_msgs()])
+
+        other = create_chunked_storage(Document.DESCRIPTOR, more, fields=['doc_id'])
+        with self.assertRaises(FieldGraphError):
+            self.storage.append(other)
+        self.assertEqual(1, self.storage.snapshot_id)
+
+    def test_compact(self):
+        for _ in range(5):
+            append_records(self.storage, Document.DESCRIPTOR, [create_random_doc() for _ in range(3)])
+        builder = MessageAssemblyBuilder(self.storage.field_graph, Document)
+        assemble(self.storage, builder)
+        expected = [str(m) for m in builder.get_msgs()]
+        fields = ['doc_id', 'name.url']
+        before = rows(scan(self.storage, fields))
+        reader = self.storage.create_field_reader('__root__.name.url')
+        old = to_rdv(self.storage.create_field_reader('__root__.name.url'))
+
+        self.assertEqual(6, compact(self.storage, target_size=100))
+        self.assertEqual([96, 96, 96, 27], [g.num_records() for g in self.storage.row_groups()])
+        self.assertEqual(6, compact(self.storage, target_size=100))
+        self.assertEqual(old, to_rdv(reader))
+        self.assertEqual(before, rows(scan(self.storage, fields)))
+        builder = MessageAssemblyBuilder(self.storage.field_graph, Document)
+        assemble(self.storage, builder)
+        self.assertEqual(expected, [str(m) for m in builder.get_msgs()])
+
+        for g in self.storage.row_groups():
+            chunk = g.columns['__root__.doc_id']
+            self.assertEqual(g.num_records(), chunk.statistics.num_values)
+            self.assertEqual(min(chunk.values), chunk.statistics.min_value)
+            self.assertIsNotNone(g.columns['__root__.name.url'].bloom_filter)
+            self.assertIsNone(chunk.bloom_filter)
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+
+import unittest
+
+from .document_pb2 import Document
+from dremel.assembly import MessageAssemblyBuilder, assemble
+from dremel.cache import ResultCache
+from dremel.chunked import create_chunked_storage
+from dremel.consts import *
+from dremel.evolution import EvolutionError, evolve
+from dremel.field_graph import create_field_graph
+from dremel.predicate import RangePredicate
+from dremel.profiling import explain_analyze
+from dremel.reader import scan
+from dremel.simple import create_simple_storage
+from .utils import create_random_doc
+
+
+def rows(it):
+    return [(values[:], level) for values, level in it]
+
+
+def evolve_schema(field_graph, added=(), renamed=None):
+    """ Schema of `field_graph` with `added` fields of (path, label, parent path), and fields renamed. """
+    renamed = renamed or dict()
+    schema = field_graph.to_schema()
+    for desc in schema.field_descriptor:
+        desc.path = renamed.get(desc.path, desc.path)
+    for edge in schema.field_graph.edge:
+        edge.from_field = renamed.get(edge.from_field, edge.from_field)
+        edge.to_fields[:] = [renamed.get(f, f) for f in edge.to_fields]
+    descs = dict((d.path, d) for d in schema.field_descriptor)
+    edges = dict((e.from_field, e) for e in schema.field_graph.edge)
+    for path, label, parent in added:
+        parent_desc = descs[parent]
+        r = parent_desc.max_repetition_level + (1 if label == LABEL_REPEATED else 0)
+        d = parent_desc.definition_level + (0 if label == LABEL_REQUIRED else 1)
+        descs[path] = schema.field_descriptor.add(path=path, cpp_type=CPPTYPE_STRING, label=label,
+                                                  max_repetition_level=r, definition_level=d)
+        edges[parent].to_fields.append(path)
+    return create_field_graph(schema)
+
+
+class EvolutionTest(unittest.TestCase):
+    def setUp(self):
+        self.docs = sorted([create_random_doc() for _ in range(200)], key=lambda d: d.doc_id)
+        self.storage = create_chunked_storage(Document.DESCRIPTOR, self.docs, row_group_size=50)
+        self.field_graph = evolve_schema(self.storage.field_graph, [
+            ('__root__.title', LABEL_OPTIONAL, '__root__'),
+            ('__root__.links.comment', LABEL_REPEATED, '__root__.links'),
+            ('__root__.name.language.script', LABEL_OPTIONAL, '__root__.name.language'),
+        ])
+
+    def test_missing_fields(self):
+        evolved = evolve(self.storage, self.field_graph)
+        self.assertEqual(['__root__.links.comment', '__root__.name.language.script', '__root__.title'],
+                         sorted(evolved.missing_fields()))
+
+        expected = rows(scan(self.storage, ['doc_id', 'name.language.code']))
+        self.assertEqual([(values + [None, None], level) for values, level in expected],
+                         rows(scan(evolved, ['doc_id', 'name.language.code', 'name.language.script', 'title'])))
+
+        # missing columns are NULL where their ancestors are defined
+        reader = evolved.row_groups()[0].create_field_reader('__root__.links.comment')
+        levels = []
+        reader.next()
+        while not reader.done():
+            levels.append((reader.repetition_level(), reader.definition_level()))
+            reader.next()
+        self.assertEqual([(0, 1 if d.HasField('links') else 0) for d in self.docs[:50]], levels)
+
+        # no values of stored columns are read for missing ones
+        _, profile = explain_analyze(scan, evolved, ['links.comment', 'title'])
+        self.assertEqual(len(self.docs), profile.columns['__root__.title'].entries_read)
+        self.assertEqual(0, sum(c.values_read for c in profile.columns.values()))
+
+    def test_assemble(self):
+        evolved = evolve(self.storage, self.field_graph)
+        builder = MessageAssemblyBuilder(evolved.field_graph, Document)
+        assemble(evolved, builder)
+        self.assertEqual([str(d) for d in self.docs], [str(m) for m in builder.get_msgs()])
+
+    def test_aliases(self):
+        field_graph = evolve_schema(self.storage.field_graph, renamed={
+            '__root__.links': '__root__.refs',
+            '__root__.links.forward': '__root__.refs.forward',
+            '__root__.links.backward': '__root__.refs.backward',
+            '__root__.doc_id': '__root__.id',
+        })
+        evolved = evolve(self.storage, field_graph, {'refs': 'links', 'id': 'doc_id'})
+        self.assertEqual([], evolved.missing_fields())
+        self.assertEqual(rows(scan(self.storage, ['doc_id', 'links.forward'])),
+                         rows(scan(evolved, ['id', 'refs.forward'])))
+
+        predicates = [RangePredicate('doc_id', self.docs[120].doc_id)]
+        self.assertEqual(rows(scan(self.storage, ['doc_id'], predicates)),
+                         rows(scan(evolve(self.storage, self.field_graph), ['doc_id'], predicates)))
+        self.assertEqual(rows(scan(self.storage, ['doc_id'], predicates)),
+                         rows(scan(evolved, ['id'], [RangePredicate('id', self.docs[120].doc_id)])))
+
+    def test_snapshot_key(self):
+        # views of one graph reading other columns are cached apart
+        aliases = {'name.language.script': 'name.language.country'}
+        evolved = evolve(self.storage, self.field_graph)
+        aliased = evolve(self.storage, self.field_graph, aliases)
+        self.assertEqual(evolved.snapshot_key(), evolve(self.storage, self.field_graph).snapshot_key())
+        self.assertNotEqual(evolved.snapshot_key(), aliased.snapshot_key())
+
+        results = ResultCache()
+        fields = ['name.language.country', 'name.language.script']
+        self.assertEqual(ResultCache().query(scan, evolved, fields), results.query(scan, evolved, fields))
+        self.assertEqual(ResultCache().query(scan, aliased, fields), results.query(scan, aliased, fields))
+        self.assertNotEqual(results.query(scan, evolved, fields), results.query(scan, aliased, fields))
+
+    def test_simple_storage(self):
+        storage = create_simple_storage(Document.DESCRIPTOR, self.docs)
+        evolved = evolve(storage, self.field_graph)
+        self.assertEqual([([d.doc_id, None], 0) for d in self.docs], rows(scan(evolved, ['doc_id', 'title'])))
+
+    def test_incompatible(self):
+        with self.assertRaises(EvolutionError):
+            evolve(self.storage, self.field_graph, {'title': 'name.url'})
+        with self.assertRaises(EvolutionError):
+            evolve(self.storage, self.field_graph, {'title': 'doc_id'})
+        with self.assertRaises(EvolutionError):
+            evolve(self.storage, evolve_schema(self.storage.field_graph, [
+                ('__root__.links.comment', LABEL_REQUIRED, '__root__.links')]))
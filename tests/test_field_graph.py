@@ -1,12 +1,16 @@
 #!/usr/bin/env python
 
+import os
+import tempfile
 import unittest
 
 from google.protobuf import text_format
 from google.protobuf.descriptor import *
 
 from dremel.schema_pb2 import Schema, SchemaFieldDescriptor, SchemaFieldGraph
-from dremel.field_graph import FieldGraph, create_field_graph
+from dremel.field_graph import FieldGraph, create_field_graph, load_schema, save_schema
+from dremel.writer import new_message_writer
+from .document_pb2 import Document
 
 
 class FieldGraphTest(unittest.TestCase):
@@ -41,3 +45,37 @@ field_graph {
         self.assertTrue(graph.get_field('__root__'))
         self.assertTrue(graph.get_field('__root__.a'))
         self.assertFalse(graph.get_field('__root__.b'))
+
+    def test_node_attributes(self):
+        graph = new_message_writer(Document.DESCRIPTOR).field_graph
+        for node in graph.list_fields():
+            desc = node.descriptor
+            self.assertEqual(desc.path, node.path)
+            self.assertEqual(desc.path.split('.')[-1], node.name)
+            self.assertEqual(desc.label, node.label)
+            self.assertEqual(desc.max_repetition_level, node.max_repetition_level)
+            self.assertEqual(desc.definition_level, node.definition_level)
+            self.assertFalse(hasattr(node, '__dict__'))
+        code = graph.get_field('__root__.name.language.code')
+        self.assertEqual((2, 2, 'code'), (code.max_repetition_level, code.definition_level, code.name))
+
+    def test_schema(self):
+        graph = new_message_writer(Document.DESCRIPTOR).field_graph
+        schema = graph.to_schema()
+        edges = dict((e.from_field, list(e.to_fields)) for e in schema.field_graph.edge)
+        self.assertEqual(['__root__.doc_id', '__root__.links', '__root__.name'], edges['__root__'])
+        self.assertNotIn('__root__.doc_id', edges)
+
+        loaded = create_field_graph(schema)
+        self.assertEqual(graph.layout(), loaded.layout())
+        self.assertEqual(graph.fingerprint, loaded.fingerprint)
+        self.assertEqual([n.path for n in graph.root.leaf_nodes], [n.path for n in loaded.root.leaf_nodes])
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'schema.pb')
+            save_schema(path, graph)
+            self.assertEqual(graph.fingerprint, load_schema(path).fingerprint)
+
+        projected = new_message_writer(Document.DESCRIPTOR, ['doc_id', 'name.url']).field_graph
+        self.assertNotEqual(graph.fingerprint, projected.fingerprint)
+        self.assertEqual(projected.fingerprint,
+                         new_message_writer(Document.DESCRIPTOR, ['doc_id', 'name.url']).field_graph.fingerprint)
@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+
+import concurrent.futures
+import os
+import tempfile
+import time
+import unittest
+
+from .document_pb2 import Document
+from dremel import file as column_file
+from dremel.assembly import MessageAssemblyBuilder, assemble
+from dremel.chunked import compact, create_chunked_storage
+from dremel.encoding import (CODECS, EncodingError, INT_ENCODINGS, DELTA, DELTA_OF_DELTA, FRAME_OF_REFERENCE,
+                             choose_codec, choose_encoding, encode_values, decode_values)
+from dremel.field_graph import FieldGraphError
+from dremel.file import FileError, append_storage, compact_file, open_storage, read_fingerprint, write_storage
+from dremel.aggregate import sum_values
+from dremel.predicate import EqualPredicate
+from dremel.reader import scan
+from .test_simple import to_rdv
+from .utils import create_random_doc
+
+
+class ColumnFileTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'docs.dremel')
+        self.docs = [create_random_doc() for _ in range(300)]
+        self.storage = create_chunked_storage(Document.DESCRIPTOR, self.docs, row_group_size=64,
+                                              bloom_filter_fields=['name.url'])
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_encoding(self):
+        for cpp_type, values in [(1, [-1, 2**31 - 1]), (4, [0, 2**64 - 1]), (5, [0.5, -1e100]),
+                                 (7, [True, False]), (9, ['', 'ünïcode', 'x' * 1000]),
+                                 (9, [b'\x00\xff', b''])]:
+            self.assertEqual(values, list(decode_values(cpp_type, encode_values(cpp_type, values))))
+        for encoding in INT_ENCODINGS:
+            for values in [[], [7], [3, 1, 2], list(range(-50, 1000, 3)), [i * i for i in range(300)],
+                           [-2**63, 2**63 - 1, 0]]:
+                self.assertEqual(values, list(decode_values(2, encode_values(2, values, encoding), encoding)))
+        self.assertEqual(DELTA, choose_encoding(2, list(range(100, 200))))
+        self.assertEqual(DELTA_OF_DELTA, choose_encoding(2, [i * i for i in range(1000)]))
+        self.assertEqual(FRAME_OF_REFERENCE, choose_encoding(2, [1000, 4000, 2000, 1500]))
+        self.assertEqual('none', choose_codec(os.urandom(10000)))
+        self.assertIn(choose_codec(b'abcd' * 10000), CODECS)
+
+    def test_round_trip(self):
+        write_storage(self.path, self.storage, codecs={'doc_id': 'none', 'name.url': 'lzma'})
+        with open_storage(self.path) as storage:
+            self.assertEqual(len(self.storage.row_groups()), len(storage.row_groups()))
+            for field in self.storage.list_fields():
+                self.assertEqual(to_rdv(self.storage.create_field_reader(field)),
+                                 to_rdv(storage.create_field_reader(field)))
+
+            group = storage.row_groups()[0]
+            self.assertEqual('none', group.columns['__root__.doc_id'].codec)
+            self.assertEqual('lzma', group.columns['__root__.name.url'].codec)
+            self.assertIsNotNone(group.columns['__root__.name.url'].bloom_filter)
+            self.assertIsNone(group.columns['__root__.doc_id'].bloom_filter)
+
+            builder = MessageAssemblyBuilder(storage.field_graph, Document)
+            assemble(storage, builder)
+            self.assertEqual([str(d) for d in self.docs], [str(m) for m in builder.get_msgs()])
+
+    def test_integer_columns(self):
+        docs = sorted(self.docs, key=lambda d: d.doc_id)
+        storage = create_chunked_storage(Document.DESCRIPTOR, docs, row_group_size=64)
+        write_storage(self.path, storage, default_codec='none')
+        with open_storage(self.path) as storage:
+            for group in storage.row_groups():
+                doc_ids = group.columns['__root__.doc_id']
+                self.assertNotEqual('plain', doc_ids.encoding)
+                self.assertEqual('plain', group.columns['__root__.name.url'].encoding)
+                self.assertEqual(sorted(doc_ids.values[0:len(doc_ids.values)]),
+                                 list(doc_ids.values[0:len(doc_ids.values)]))
+            self.assertEqual(sum(d.doc_id for d in docs), sum_values(storage, 'doc_id').value)
+            self.assertEqual(sum(sum(d.links.forward) for d in docs),
+                             sum_values(storage, 'links.forward').value)
+
+    def test_lazy_pages(self):
+        write_storage(self.path, self.storage, page_size=16)
+        docs = [d for d in self.docs if any(n.HasField('url') for n in d.name)]
+        needle = docs[len(docs) // 2]
+        url = [n.url for n in needle.name if n.HasField('url')][0]
+
+        decoded = []
+        decode = column_file.decode_values
+        def counting_decode(*args):
+            values = decode(*args)
+            decoded.append(len(values))
+            return values
+        with open_storage(self.path) as storage:
+            column_file.decode_values = counting_decode
+            try:
+                rows = list(scan(storage, ['doc_id', 'name.language.code'],
+                                 [EqualPredicate('name.url', url)]))
+            finally:
+                column_file.decode_values = decode
+        self.assertIn(needle.doc_id, [v[0] for v, _ in rows])
+
+        # pages of pruned row groups and rejected records are not decoded
+        total = sum(len(g.columns[f'__root__.{f}'].values) for g in self.storage.row_groups()
+                    for f in ['doc_id', 'name.url', 'name.language.code'])
+        self.assertLess(sum(decoded), total / 2)
+
+    def test_append(self):
+        write_storage(self.path, self.storage)
+        more = [create_random_doc() for _ in range(100)]
+        with open_storage(self.path) as old, open_storage(self.path) as storage:
+            self.assertEqual(0, storage.snapshot_id)
+            self.assertEqual(1, storage.append(create_chunked_storage(Document.DESCRIPTOR, more[:50])))
+            self.assertEqual(2, append_storage(self.path, create_chunked_storage(Document.DESCRIPTOR, more[50:])))
+            self.assertEqual(1, storage.snapshot_id)
+            self.assertEqual(2, storage.reload())
+
+            builder = MessageAssemblyBuilder(storage.field_graph, Document)
+            assemble(storage, builder)
+            self.assertEqual([str(d) for d in self.docs + more], [str(m) for m in builder.get_msgs()])
+
+            # opened before the appends, nothing new is seen
+            self.assertEqual(0, old.snapshot_id)
+            builder = MessageAssemblyBuilder(old.field_graph, Document)
+            assemble(old, builder)
+            self.assertEqual([str(d) for d in self.docs], [str(m) for m in builder.get_msgs()])
+
+        # a failed append leaves the file as it was
+        size = os.path.getsize(self.path)
+        with self.assertRaises(EncodingError):
+            append_storage(self.path, create_chunked_storage(Document.DESCRIPTOR, more), default_codec='nothing')
+        self.assertEqual(size, os.path.getsize(self.path))
+        with open_storage(self.path) as storage:
+            self.assertEqual(2, storage.snapshot_id)
+
+        # files keep fingerprints of their fields
+        self.assertEqual(self.storage.field_graph.fingerprint, read_fingerprint(self.path))
+        with self.assertRaises(FieldGraphError):
+            append_storage(self.path, create_chunked_storage(Document.DESCRIPTOR, more, ['doc_id']))
+
+    def test_append_size(self):
+        # footers of appends list the new row groups only, whatever the file holds
+        write_storage(self.path, self.storage)
+        more = create_chunked_storage(Document.DESCRIPTOR, self.docs[:10])
+        sizes = [os.path.getsize(self.path)]
+        for _ in range(4):
+            append_storage(self.path, more)
+            sizes.append(os.path.getsize(self.path))
+        growth = [b - a for a, b in zip(sizes, sizes[1:])]
+        self.assertLess(max(growth) - min(growth), 16)
+        with open_storage(self.path) as storage:
+            self.assertEqual(len(self.docs) + 40, storage.num_records())
+            self.assertEqual(4, storage.snapshot_id)
+
+    def test_partial_append(self):
+        write_storage(self.path, self.storage)
+        size = os.path.getsize(self.path)
+        more = [create_random_doc() for _ in range(20)]
+        append_storage(self.path, create_chunked_storage(Document.DESCRIPTOR, more))
+        with open(self.path, 'rb') as fd:
+            data = fd.read()
+
+        # readers during an append, or after a killed one, see the snapshot before it
+        for cut in range(size + 1, len(data), max(1, (len(data) - size) // 17)):
+            with open(self.path, 'wb') as fd:
+                fd.write(data[:cut])
+            with open_storage(self.path) as storage:
+                self.assertEqual(0, storage.snapshot_id)
+                self.assertEqual(len(self.docs), storage.num_records())
+
+        # and appends start from there
+        self.assertEqual(1, append_storage(self.path, create_chunked_storage(Document.DESCRIPTOR, more)))
+        self.assertEqual(data, open(self.path, 'rb').read())
+
+    def test_concurrent_appends(self):
+        write_storage(self.path, self.storage)
+        batches = [[create_random_doc() for _ in range(5)] for _ in range(8)]
+        with concurrent.futures.ThreadPoolExecutor(4) as executor:
+            snapshot_ids = list(executor.map(
+                lambda docs: append_storage(self.path, create_chunked_storage(Document.DESCRIPTOR, docs)), batches))
+        self.assertEqual(list(range(1, 9)), sorted(snapshot_ids))
+        with open_storage(self.path) as storage:
+            self.assertEqual(sorted(d.doc_id for d in self.docs + sum(batches, [])),
+                             sorted(values[0] for values, _ in scan(storage, ['doc_id'])))
+
+    def test_compact(self):
+        write_storage(self.path, self.storage)
+        for i in range(0, 20, 4):
+            append_storage(self.path, create_chunked_storage(Document.DESCRIPTOR, self.docs[i:i+4]))
+        with open_storage(self.path) as old:
+            self.assertEqual(6, compact_file(self.path, target_size=200))
+            self.assertEqual(5, old.snapshot_id)
+            self.assertEqual(10, len(old.row_groups()))
+            expected = to_rdv(old.create_field_reader('__root__.name.url'))
+            with open_storage(self.path) as storage:
+                self.assertEqual(6, storage.snapshot_id)
+                self.assertEqual([192, 128], [g.num_records() for g in storage.row_groups()])
+                self.assertEqual(expected, to_rdv(storage.create_field_reader('__root__.name.url')))
+                self.assertIsNotNone(storage.row_groups()[1].columns['__root__.name.url'].bloom_filter)
+
+            # reloads switch to the new file, row groups read before stay readable
+            row_groups, file_id = old.row_groups(), old.file_id
+            self.assertEqual(6, old.reload())
+            self.assertNotEqual(file_id, old.file_id)
+            self.assertEqual([192, 128], [g.num_records() for g in old.row_groups()])
+            self.assertEqual(expected, to_rdv(old.create_field_reader('__root__.name.url')))
+            self.assertEqual(10, len(row_groups))
+            self.assertEqual(len(self.docs) + 20, sum(len(to_rdv(g.create_field_reader('__root__.doc_id')))
+                                                      for g in row_groups))
+        self.assertEqual(6, compact_file(self.path, target_size=200))
+
+        # compactions in memory of opened files fail rather than being lost
+        append_storage(self.path, create_chunked_storage(Document.DESCRIPTOR, self.docs[:4]))
+        with open_storage(self.path) as storage:
+            with self.assertRaises(FileError):
+                compact(storage, target_size=200)
+            self.assertEqual(7, storage.snapshot_id)
+            self.assertEqual(3, len(storage.row_groups()))
+
+    def test_append_during_compaction(self):
+        write_storage(self.path, self.storage)
+        more = [create_random_doc() for _ in range(10)]
+        with concurrent.futures.ThreadPoolExecutor(1) as executor:
+            with column_file.locked(self.path):
+                # like a compaction about to replace the file
+                write_storage(f'{self.path}.compact', self.storage)
+                future = executor.submit(append_storage, self.path, create_chunked_storage(Document.DESCRIPTOR, more))
+                time.sleep(0.1)
+                self.assertFalse(future.done())
+                os.replace(f'{self.path}.compact', self.path)
+            # waiting appends go to the new file
+            self.assertEqual(1, future.result(timeout=10))
+        with open_storage(self.path) as storage:
+            self.assertEqual(len(self.docs) + len(more), storage.num_records())
+
+    def test_invalid_file(self):
+        with open(self.path, 'wb') as fd:
+            fd.write(b'not a column file')
+        with self.assertRaises(FileError):
+            open_storage(self.path)
+
+    def test_readahead(self):
+        write_storage(self.path, self.storage, page_size=16)
+        fields = ['doc_id', 'name.url', 'name.language.code']
+        with open_storage(self.path) as storage:
+            expected = [(values[:], level) for values, level in scan(storage, fields)]
+
+        with concurrent.futures.ThreadPoolExecutor(4) as executor:
+            with open_storage(self.path, readahead=2, executor=executor) as storage:
+                self.assertEqual(expected, [(values[:], level) for values, level in scan(storage, fields)])
+                predicates = [EqualPredicate('name.url', 'nothing')]
+                self.assertEqual([], list(scan(storage, fields, predicates, limit=1)))
+
+                # the next row group is read while the current one is scanned
+                chunks = [g.columns['__root__.doc_id'] for g in storage.row_groups()]
+                rows = scan(storage, ['doc_id'])
+                next(rows)
+                self.assertGreater(chunks[1].num_read_ahead, 0)
+                self.assertEqual([0] * (len(chunks) - 2), [c.num_read_ahead for c in chunks[2:]])
+
+                # pages read ahead are bounded, and dropped once readers move past them
+                for chunk in chunks:
+                    self.assertLessEqual(chunk.num_read_ahead, storage.readahead + 2)
+                rows.close()
+                list(scan(storage, ['doc_id']))
+                self.assertEqual([0] * len(chunks), [c.num_read_ahead for c in chunks])
+
+    def test_buffers(self):
+        write_storage(self.path, self.storage, codecs={'doc_id': 'none', 'name.url': 'none'}, page_size=16)
+        with open_storage(self.path) as storage:
+            for group, expected in zip(storage.row_groups(), self.storage.row_groups()):
+                for path in ['__root__.doc_id', '__root__.name.url', '__root__.name.language.code']:
+                    buffers = group.columns[path].buffers()
+                    chunk = expected.columns[path]
+                    self.assertEqual(list(chunk.repetition_levels), list(buffers.repetition_levels))
+                    self.assertEqual(list(chunk.definition_levels), list(buffers.definition_levels))
+                    self.assertEqual(list(chunk.values), list(buffers.values))
+                doc_ids = group.columns['__root__.doc_id'].buffers().values
+                self.assertIsInstance(doc_ids, memoryview)
+                self.assertEqual('q', doc_ids.format)
+                del doc_ids
+
+            reader = storage.create_field_reader('__root__.doc_id')
+            batch = reader.read_buffers(10)
+            self.assertEqual((10, 10, 10), tuple(len(b) for b in batch))
+            self.assertEqual([d.doc_id for d in self.docs[:10]], batch.values.tolist())
+            del batch
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+
+import unittest
+
+from google.protobuf.descriptor import FieldDescriptor
+
+from .document_pb2 import Document
+from dremel.arrow import export_columns
+from dremel.assembly import MessageAssemblyBuilder, assemble
+from dremel.chunked import create_chunked_storage
+from dremel.importer import ImporterError, import_columns, import_levels
+from dremel.schema_pb2 import Schema
+from dremel.simple import create_simple_storage
+from .test_simple import to_rdv
+from .utils import create_random_doc
+
+
+def to_schema(field_graph):
+    schema = Schema()
+    def _(node):
+        desc = schema.field_descriptor.add()
+        desc.CopyFrom(node.descriptor)
+        if node.child_nodes:
+            # NOTE(me): the root of writers has no cpp type
+            desc.cpp_type = FieldDescriptor.CPPTYPE_MESSAGE
+            edge = schema.field_graph.edge.add()
+            edge.from_field = node.descriptor.path
+            edge.to_fields.extend(c.descriptor.path for c in node.child_nodes)
+    field_graph.root.node_accept(_)
+    return schema
+
+
+def to_levels(storage):
+    columns = dict()
+    for path in storage.list_fields():
+        reps, defs, values = [], [], []
+        for v, r, d in to_rdv(storage.create_field_reader(path)):
+            reps.append(r)
+            defs.append(d)
+            if v is not None:
+                values.append(v)
+        columns[path.split('.', 1)[1]] = (reps, defs, values)
+    return columns
+
+
+def assemble_docs(storage):
+    builder = MessageAssemblyBuilder(storage.field_graph, Document)
+    assemble(storage, builder)
+    return [str(m) for m in builder.get_msgs()]
+
+
+class ImporterTest(unittest.TestCase):
+    def setUp(self):
+        self.docs = [create_random_doc() for _ in range(200)]
+        self.simple = create_simple_storage(Document.DESCRIPTOR, self.docs)
+        self.schema = to_schema(self.simple.field_graph)
+
+    def test_import_levels(self):
+        storage = import_levels(self.schema, to_levels(self.simple), row_group_size=64,
+                                bloom_filter_fields=['name.url'])
+        self.assertEqual([64, 64, 64, 8], [g.num_records() for g in storage.row_groups()])
+        self.assertIsNotNone(storage.row_groups()[0].columns['__root__.name.url'].bloom_filter)
+        for field in self.simple.list_fields():
+            self.assertEqual(to_rdv(self.simple.create_field_reader(field)),
+                             to_rdv(storage.create_field_reader(field)))
+        self.assertEqual([str(d) for d in self.docs], assemble_docs(storage))
+
+        empty = import_levels(self.schema, dict((f, ([], [], [])) for f in to_levels(self.simple)))
+        self.assertEqual(0, empty.num_records())
+
+    def test_invalid_levels(self):
+        def check(field, levels):
+            columns = to_levels(self.simple)
+            if levels is None:
+                del columns[field]
+            else:
+                columns[field] = levels
+            with self.assertRaises(ImporterError):
+                import_levels(self.schema, columns)
+
+        reps, defs, values = to_levels(self.simple)['name.url']
+        check('name.url', None)
+        check('name.url', (reps[:-1], defs, values))
+        check('name.url', ([1] + reps[1:], defs, values))
+        check('name.url', ([3] + reps[1:], defs, values))
+        check('name.url', (reps, [9] + defs[1:], values))
+        check('name.url', (reps, defs, values[1:]))
+        check('name.url', (reps[:reps.index(0, 1)], defs[:reps.index(0, 1)], values[:1]))
+        check('nothing', ([], [], []))
+        check('doc_id', ([-1], [0], []))
+        reps, defs, values = to_levels(self.simple)['doc_id']
+        check('doc_id', (reps, defs, [str(v) for v in values]))
+
+        # repetitions of an undefined field
+        reps, defs, values = to_levels(self.simple)['links.backward']
+        i = reps.index(1)
+        j = defs[:i].count(2)
+        self.assertEqual(2, defs[i])
+        check('links.backward', (reps, defs[:i] + [1] + defs[i + 1:], values[:j] + values[j + 1:]))
+        # and after an entry where it is undefined
+        j = defs[:i - 1].count(2)
+        self.assertEqual(2, defs[i - 1])
+        check('links.backward', (reps, defs[:i - 1] + [1] + defs[i:], values[:j] + values[j + 1:]))
+
+        # values without levels
+        columns = dict((f, ([], [], [])) for f in to_levels(self.simple))
+        columns['doc_id'] = ([], [], [1, 2, 3])
+        with self.assertRaises(ImporterError):
+            import_levels(self.schema, columns)
+
+    def test_import_columns(self):
+        chunked = create_chunked_storage(Document.DESCRIPTOR, self.docs)
+        storage = import_columns(self.schema, export_columns(chunked), row_group_size=50)
+        self.assertEqual(4, len(storage.row_groups()))
+        for field in self.simple.list_fields():
+            self.assertEqual(to_rdv(self.simple.create_field_reader(field)),
+                             to_rdv(storage.create_field_reader(field)))
+        self.assertEqual([str(d) for d in self.docs], assemble_docs(storage))
+
+    def test_invalid_columns(self):
+        column = export_columns(self.simple)
+        column.children[2].offsets[-1] += 1
+        with self.assertRaises(ImporterError):
+            import_columns(self.schema, column)
+
+        column = export_columns(self.simple)
+        column.children[0].type = 'string'
+        with self.assertRaises(ImporterError):
+            import_columns(self.schema, column)
+
+        column = export_columns(self.simple)
+        del column.children[1]
+        with self.assertRaises(ImporterError):
+            import_columns(self.schema, column)
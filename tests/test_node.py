@@ -31,3 +31,9 @@ class NodeTest(unittest.TestCase):
         nodes = set()
         root.node_accept(lambda n: nodes.add(n))
         self.assertEqual(set([root, node1, node2, root2, root3]), nodes)
+
+    def test_slots(self):
+        for node in [Node(), CompositeNode()]:
+            self.assertFalse(hasattr(node, '__dict__'))
+            with self.assertRaises(AttributeError):
+                node.anything = 1
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+
+import os
+import tempfile
+import threading
+import unittest
+
+from .document_pb2 import Document
+from dremel.assembly import MessageAssemblyBuilder, assemble
+from dremel.chunked import create_chunked_storage
+from dremel.file import open_storage, write_storage
+from dremel.predicate import RangePredicate
+from dremel.profiling import explain_analyze, get_profile, profiling
+from dremel.reader import scan
+from .utils import create_random_doc
+
+
+def rows(it):
+    return [(values[:], level) for values, level in it]
+
+
+class ProfilingTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'docs.dremel')
+        self.docs = sorted([create_random_doc() for _ in range(200)], key=lambda d: d.doc_id)
+        self.storage = create_chunked_storage(Document.DESCRIPTOR, self.docs, row_group_size=50)
+        write_storage(self.path, self.storage)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_scan(self):
+        fields = ['doc_id', 'name.url']
+        predicates = [RangePredicate('doc_id', self.docs[120].doc_id)]
+        with open_storage(self.path) as storage:
+            results, profile = explain_analyze(scan, storage, fields, predicates)
+            self.assertEqual(rows(scan(storage, fields, predicates)), results)
+        self.assertIsNone(get_profile())
+
+        self.assertEqual(2, profile.row_groups_skipped)
+        self.assertEqual(2, profile.row_groups_scanned)
+        self.assertEqual({'fetch', 'filter', 'value'}, set(profile.operators))
+        self.assertGreater(profile.operators['filter'].calls, 0)
+        doc_id = profile.columns['__root__.doc_id']
+        # filtered and projected
+        self.assertEqual(100 + 80, doc_id.entries_read)
+        self.assertEqual(doc_id.entries_read, doc_id.values_read)
+        self.assertGreater(doc_id.pages_decoded, 0)
+        self.assertGreater(doc_id.bytes_decoded, 0)
+        self.assertGreater(doc_id.pages_skipped, 0)
+        self.assertEqual(0, profile.columns['__root__.name.url'].entries_read -
+                         sum(max(1, len(d.name)) for d in self.docs[120:]))
+        self.assertIn('filter', profile.report())
+        self.assertIn('name.url', str(profile))
+        self.assertEqual(profile.row_groups_skipped, profile.to_dict()['row_groups_skipped'])
+
+    def test_shred_and_assemble(self):
+        with profiling() as profile:
+            storage = create_chunked_storage(Document.DESCRIPTOR, self.docs, row_group_size=50)
+            builder = MessageAssemblyBuilder(storage.field_graph, Document)
+            assemble(storage, builder)
+        self.assertEqual([str(d) for d in self.docs], [str(m) for m in builder.get_msgs()])
+        self.assertEqual(len(self.docs), profile.operators['shred'].calls)
+        self.assertEqual(4, profile.operators['encode'].calls)
+        self.assertGreater(profile.operators['assemble'].seconds, profile.operators['protobuf'].seconds)
+        self.assertEqual(sum(len(d.name) for d in self.docs if d.name),
+                         profile.columns['__root__.name.url'].entries_read -
+                         sum(1 for d in self.docs if not d.name))
+        self.assertIn('_set_value', MessageAssemblyBuilder.__dict__)
+        self.assertNotIn('_set_value', builder.__dict__)
+
+    def test_disabled(self):
+        with profiling() as profile:
+            pass
+        rows(scan(self.storage, ['doc_id']))
+        self.assertEqual({}, profile.columns)
+        self.assertEqual({}, profile.operators)
+
+    def test_threads(self):
+        # profiles of overlapping threads, left in the order they were entered
+        barrier = threading.Barrier(2, timeout=10)
+        profiles = dict()
+
+        def first():
+            with profiling() as profile:
+                barrier.wait()  # both profiling
+                rows(scan(self.storage, ['doc_id']))
+                barrier.wait()
+            profiles['first'] = profile, get_profile()
+            barrier.wait()  # left before the second one scans again
+
+        def second():
+            barrier.wait()
+            with profiling() as profile:
+                barrier.wait()
+                barrier.wait()
+                rows(scan(self.storage, ['name.url']))
+            profiles['second'] = profile, get_profile()
+
+        threads = [threading.Thread(target=first), threading.Thread(target=second)]
+        with profiling() as main:
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        self.assertIsNone(get_profile())
+        self.assertEqual({}, main.columns)
+        (first_profile, first_after), (second_profile, second_after) = profiles['first'], profiles['second']
+        self.assertIsNone(first_after)
+        self.assertIsNone(second_after)
+        self.assertEqual(['__root__.doc_id'], list(first_profile.columns))
+        self.assertEqual(['__root__.name.url'], list(second_profile.columns))
+
+        # work of worker threads is collected into the profile of the query
+        with open_storage(self.path, readahead=2) as storage:
+            _, profile = explain_analyze(scan, storage, ['doc_id'])
+        self.assertEqual(len(self.docs), profile.columns['__root__.doc_id'].entries_read)
+        self.assertGreater(profile.columns['__root__.doc_id'].pages_decoded, 0)
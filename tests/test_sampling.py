@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+
+import itertools
+import random
+import unittest
+
+from .document_pb2 import Document
+from dremel.aggregate import count_records, count_values, sum_values
+from dremel.chunked import create_chunked_storage
+from dremel.predicate import RangePredicate
+from dremel.profiling import explain_analyze
+from dremel.reader import scan, select_records
+from dremel.sampling import Sample, SampleError
+from dremel.simple import create_simple_storage
+from dremel.sketch import approx_quantiles
+from .utils import create_random_doc
+
+
+class SamplingTest(unittest.TestCase):
+    def setUp(self):
+        random.seed(2023)
+        self.docs = [create_random_doc() for _ in range(2000)]
+        self.storage = create_simple_storage(Document.DESCRIPTOR, self.docs)
+
+    def test_sample(self):
+        with self.assertRaises(SampleError):
+            Sample(0)
+        selection = Sample(0.5, seed=7, block_size=3).selection()
+        picked = [next(selection) for _ in range(30)]
+        self.assertEqual([picked[i - i % 3] for i in range(30)], picked)
+
+    def test_scan(self):
+        fields = ['doc_id', 'name.url']
+        sample = Sample(0.1, seed=1)
+        rows = [(v[:], level) for v, level in scan(self.storage, fields, sample=sample)]
+        self.assertEqual(rows, [(v[:], level) for v, level in scan(self.storage, fields, sample=sample)])
+
+        kept = [d.doc_id for d, selected in zip(self.docs, sample.selection()) if selected]
+        self.assertEqual(kept, [v[0] for v, level in rows if level == 0])
+
+        # sampling and filters are combined
+        predicates = [RangePredicate('doc_id', upper=300000)]
+        filtered = [v[0] for v, level in scan(self.storage, ['doc_id'], predicates, sample=sample)]
+        self.assertEqual([i for i in kept if i <= 300000], filtered)
+
+        self.assertEqual([], list(scan(self.storage, fields, sample=Sample(1e-9))))
+        self.assertEqual(len(self.docs),
+                         len(list(scan(self.storage, ['doc_id'], sample=Sample(1.0)))))
+
+    def test_estimates(self):
+        urls = sum(1 for d in self.docs for n in d.name if n.HasField('url'))
+        forward = sum(sum(d.links.forward) for d in self.docs)
+        self.assertEqual((len(self.docs), 0.0), count_records(self.storage, 'doc_id'))
+        self.assertEqual((urls, 0.0), count_values(self.storage, 'name.url'))
+        self.assertEqual((forward, 0.0), sum_values(self.storage, 'links.forward'))
+
+        # 95% intervals hold the exact values for most seeds
+        for block_size in [1, 10]:
+            covered = [0, 0, 0]
+            for seed in range(100):
+                sample = Sample(0.2, seed=seed, block_size=block_size)
+                for i, (expected, estimate) in enumerate([
+                        (len(self.docs), count_records(self.storage, 'doc_id', sample)),
+                        (urls, count_values(self.storage, 'name.url', sample)),
+                        (forward, sum_values(self.storage, 'links.forward', sample))]):
+                    self.assertGreater(estimate.error, 0)
+                    covered[i] += estimate.lower <= expected <= estimate.upper
+            self.assertTrue(all(n >= 85 for n in covered), covered)
+
+    def test_row_groups(self):
+        with self.assertRaises(SampleError):
+            Sample(0.5, block_size=3, by_row_group=True)
+        storage = create_chunked_storage(Document.DESCRIPTOR, self.docs, row_group_size=25)
+        sample = Sample(0.2, seed=6, by_row_group=True)
+        kept = [g for i, g in enumerate(storage.row_groups()) if sample.keeps_row_group(i)]
+        self.assertLess(0, len(kept))
+        self.assertLess(len(kept), len(storage.row_groups()) / 2)
+
+        # skipped row groups are not read at all
+        rows, profile = explain_analyze(scan, storage, ['doc_id', 'name.url'], sample=sample)
+        self.assertEqual([(v[:], level) for g in kept for v, level in scan(g, ['doc_id', 'name.url'])], rows)
+        self.assertEqual(len(storage.row_groups()) - len(kept), profile.row_groups_skipped)
+        self.assertEqual(sum(g.num_records() for g in kept), profile.columns['__root__.doc_id'].entries_read)
+        selection = list(itertools.islice(select_records(storage, [], sample), len(self.docs)))
+        self.assertEqual([d.doc_id for d, selected in zip(self.docs, selection) if selected],
+                         [v[0] for v, level in rows if level == 0])
+
+        # estimates scale by row groups, the sampling units
+        urls = sum(1 for d in self.docs for n in d.name if n.HasField('url'))
+        covered = [0, 0]
+        for seed in range(100):
+            sample = Sample(0.2, seed=seed, by_row_group=True)
+            for i, (expected, estimate) in enumerate([
+                    (len(self.docs), count_records(storage, 'doc_id', sample)),
+                    (urls, count_values(storage, 'name.url', sample))]):
+                covered[i] += estimate.lower <= expected <= estimate.upper
+        self.assertTrue(all(n >= 80 for n in covered), covered)
+
+    def test_sketch(self):
+        sketch = approx_quantiles(self.storage, 'doc_id', sample=Sample(0.25, seed=5))
+        self.assertLess(sketch.count, len(self.docs) / 2)
+        self.assertAlmostEqual(500000, sketch.quantile(0.5), delta=100000)
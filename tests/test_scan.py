@@ -1,10 +1,14 @@
 #!/usr/bin/env python
 
+import collections
 import unittest
 
-from dremel.reader import scan
-from dremel.field_graph import FieldGraphError
-from .utils import create_test_storage
+from .document_pb2 import Document
+from dremel.reader import FieldReader, FieldStorage, ReadError, scan, select_records, top_k
+from dremel.predicate import EqualPredicate, RangePredicate, FunctionPredicate
+from dremel.profiling import explain_analyze
+from dremel.simple import create_simple_storage
+from .utils import create_test_storage, create_random_doc
 
 
 class ScanTest(unittest.TestCase):
@@ -17,7 +21,146 @@ class ScanTest(unittest.TestCase):
         for values, fetch_level in scan(self.storage, ['doc_id', 'name.url', 'name.language.code']):
             print(values, fetch_level)
 
-    def test_invalid_repeated_fields(self):
-        with self.assertRaisesRegex(FieldGraphError, 'independently-repeated fields'):
-            for values, fetch_level in scan(self.storage, ['name.url', 'links.backward']):
-                print(values, fetch_level)
+    def test_independently_repeated_fields(self):
+        docs = [create_random_doc() for _ in range(200)]
+        storage = create_simple_storage(Document.DESCRIPTOR, docs)
+        self.assertEqual(len(docs), storage.num_records())
+        fields = ['name.url', 'doc_id', 'links.backward']
+        expected = []
+        for doc in docs:
+            urls = [n.url if n.HasField('url') else None for n in doc.name] or [None]
+            backward = list(doc.links.backward) or [None]
+            expected.append([[url, doc.doc_id, b] for url in urls for b in backward])
+
+        rows, profile = explain_analyze(scan, storage, fields)
+        records = []
+        for values, level in rows:
+            if level == 0:
+                records.append([])
+            records[-1].append(values)
+        self.assertEqual(expected, records)
+        # every column is read once
+        self.assertEqual(sum(max(1, len(d.name)) for d in docs), profile.columns['__root__.name.url'].entries_read)
+        self.assertEqual(len(docs), profile.columns['__root__.doc_id'].entries_read)
+
+        predicates = [RangePredicate('doc_id', upper=500000)]
+        scanned = [values[:] for values, level in scan(storage, fields, predicates, limit=5)]
+        self.assertEqual([row for rows in expected if rows[0][1] <= 500000 for row in rows][:len(scanned)], scanned)
+        self.assertEqual(5, len(set(row[1] for row in scanned)))
+
+        ranked = [values[:] for values, level in top_k(storage, fields, 'doc_id', 3)]
+        self.assertEqual([row for rows in sorted(expected, key=lambda rows: rows[0][1])[:3] for row in rows], ranked)
+
+    def test_select_records(self):
+        self.assertEqual(
+            [False, True],
+            sorted(select_records(self.storage, [EqualPredicate('doc_id', 20)])))
+        self.assertEqual(
+            [True, True],
+            list(select_records(self.storage, [FunctionPredicate('name.url', lambda v: v is None or v.startswith('http'))])))
+
+    def test_filter(self):
+        rows = [(values[:], level) for values, level in
+                scan(self.storage, ['doc_id', 'name.url'], [EqualPredicate('name.url', 'http://C')])]
+        self.assertEqual([([20, 'http://C'], 0)], rows)
+
+    def test_filter_random_documents(self):
+        docs = [create_random_doc() for _ in range(200)]
+        storage = create_simple_storage(Document.DESCRIPTOR, docs)
+        fields = ['doc_id', 'name.url', 'name.language.code']
+        predicates = [RangePredicate('doc_id', 0, 500000),
+                      FunctionPredicate('name.language.code', lambda v: v is not None and v < 'n')]
+
+        expected = []
+        for doc in docs:
+            if doc.doc_id > 500000:
+                continue
+            if not any(l.code < 'n' for n in doc.name for l in n.language):
+                continue
+            expected.append(doc.doc_id)
+        scanned = [values[0] for values, level in scan(storage, fields, predicates) if level == 0]
+        self.assertEqual(expected, scanned)
+
+    def test_late_materialization(self):
+        reads = []
+        class CountingReader(FieldReader):
+            def __init__(self, reader):
+                super().__init__()
+                self._reader = reader
+            @property
+            def descriptor(self):
+                return self._reader.descriptor
+            @property
+            def field_node(self):
+                return self._reader.field_node
+            def repetition_level(self):
+                return self._reader.repetition_level()
+            def next_repetition_level(self):
+                return self._reader.next_repetition_level()
+            def definition_level(self):
+                return self._reader.definition_level()
+            def value(self):
+                reads.append(self.field_node.path)
+                return self._reader.value()
+            def done(self):
+                return self._reader.done()
+            def next(self):
+                self._reader.next()
+            def skip_record(self):
+                self._reader.skip_record()
+        class CountingStorage(FieldStorage):
+            def __init__(self, storage):
+                super().__init__()
+                self._storage = storage
+            @property
+            def field_graph(self):
+                return self._storage.field_graph
+            def num_records(self):
+                return self._storage.num_records()
+            def create_field_reader(self, field_path):
+                reader = self._storage.create_field_reader(field_path)
+                return CountingReader(reader) if reader is not None else None
+
+        storage = CountingStorage(self.storage)
+        rows = list(scan(storage, ['name.url'], [EqualPredicate('doc_id', 20)]))
+        self.assertEqual(1, len(rows))
+        # only the values of the surviving record are read
+        self.assertEqual(1, reads.count('__root__.name.url'))
+
+    def test_limit(self):
+        docs = [create_random_doc() for _ in range(100)]
+        storage = create_simple_storage(Document.DESCRIPTOR, docs)
+        fields = ['doc_id', 'name.language.code']
+        rows = [(values[:], level) for values, level in scan(storage, fields)]
+        limited = [(values[:], level) for values, level in scan(storage, fields, limit=10)]
+        self.assertEqual(10, len([r for r in limited if r[1] == 0]))
+        self.assertEqual(rows[:len(limited)], limited)
+        self.assertEqual([], list(scan(storage, fields, limit=0)))
+
+        predicates = [RangePredicate('doc_id', upper=500000)]
+        expected = [d.doc_id for d in docs if d.doc_id <= 500000][:5]
+        self.assertEqual(expected, [values[0] for values, level in
+                                    scan(storage, ['doc_id'], predicates, limit=5)])
+
+    def test_top_k(self):
+        docs = [create_random_doc() for _ in range(100)]
+        storage = create_simple_storage(Document.DESCRIPTOR, docs)
+        fields = ['doc_id', 'name.url']
+
+        rows = list(top_k(storage, fields, 'doc_id', 7))
+        self.assertEqual(sorted(d.doc_id for d in docs)[:7],
+                         [values[0] for values, level in rows if level == 0])
+        urls = collections.defaultdict(set)
+        for d in docs:
+            urls[d.doc_id].update(n.url for n in d.name if n.HasField('url'))
+        for values, level in rows:
+            self.assertTrue(values[1] is None or values[1] in urls[values[0]])
+
+        rows = list(top_k(storage, ['doc_id'], 'doc_id', 3, descending=True,
+                          predicates=[RangePredicate('doc_id', upper=500000)]))
+        self.assertEqual(sorted([d.doc_id for d in docs if d.doc_id <= 500000], reverse=True)[:3],
+                         [values[0] for values, _ in rows])
+
+    def test_top_k_repeated_field(self):
+        with self.assertRaisesRegex(ReadError, 'repeated field'):
+            list(top_k(self.storage, ['doc_id'], 'name.url', 1))
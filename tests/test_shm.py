@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+
+import concurrent.futures
+import pickle
+import unittest
+
+from .document_pb2 import Document
+from dremel.aggregate import sum_values
+from dremel.assembly import MessageAssemblyBuilder, assemble
+from dremel.chunked import create_chunked_storage
+from dremel.reader import scan
+from dremel.shm import SharedMemoryError, attach_storage, create_shared_storage
+from .test_simple import to_rdv
+from .utils import create_random_doc
+
+
+def sum_doc_ids(storage):
+    return sum_values(storage, 'doc_id').value
+
+
+class SharedStorageTest(unittest.TestCase):
+    def setUp(self):
+        self.docs = [create_random_doc() for _ in range(200)]
+        self.storage = create_chunked_storage(Document.DESCRIPTOR, self.docs, row_group_size=64,
+                                              bloom_filter_fields=['name.url'])
+        self.shared = create_shared_storage(self.storage)
+
+    def tearDown(self):
+        self.shared.close()
+
+    def test_attach(self):
+        with attach_storage(self.shared.name) as storage:
+            self.assertEqual(self.storage.snapshot_key(), storage.snapshot_key())
+            for field in self.storage.list_fields():
+                self.assertEqual(to_rdv(self.storage.create_field_reader(field)),
+                                 to_rdv(storage.create_field_reader(field)))
+            chunk = storage.row_groups()[0].columns['__root__.doc_id']
+            self.assertIsInstance(chunk.values, memoryview)
+            self.assertIsNotNone(storage.row_groups()[0].columns['__root__.name.url'].bloom_filter)
+
+            builder = MessageAssemblyBuilder(storage.field_graph, Document)
+            assemble(storage, builder)
+            self.assertEqual([str(d) for d in self.docs], [str(m) for m in builder.get_msgs()])
+            fields = ['doc_id', 'name.url']
+            self.assertEqual([(v[:], l) for v, l in scan(self.storage, fields)],
+                             [(v[:], l) for v, l in scan(storage, fields)])
+            del chunk
+
+    def test_workers(self):
+        self.assertEqual(self.shared.name, pickle.loads(pickle.dumps(self.shared)).name)
+        with concurrent.futures.ProcessPoolExecutor(2) as executor:
+            results = list(executor.map(sum_doc_ids, [self.shared] * 2))
+        self.assertEqual([sum(d.doc_id for d in self.docs)] * 2, results)
+
+    def test_unlinked(self):
+        name = self.shared.name
+        self.shared.close()
+        with self.assertRaises(SharedMemoryError):
+            attach_storage(name)
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+
+import pickle
+import random
+import unittest
+
+from .document_pb2 import Document
+from dremel.simple import create_simple_storage
+from dremel.sketch import (HyperLogLog, QuantileSketch, CountMinSketch, SketchError,
+                           column_values, approx_count_distinct, approx_quantiles,
+                           approx_heavy_hitters)
+from .utils import create_random_doc
+
+
+class SketchTest(unittest.TestCase):
+    def test_hyperloglog(self):
+        a, b = HyperLogLog(12), HyperLogLog(12)
+        a.update(range(0, 30000))
+        b.update(range(20000, 50000))
+        self.assertAlmostEqual(30000, a.estimate(), delta=30000 * 4 * a.relative_error())
+        a.merge(b)
+        self.assertAlmostEqual(50000, a.estimate(), delta=50000 * 4 * a.relative_error())
+        # small cardinalities are almost exact
+        self.assertAlmostEqual(10, HyperLogLog().update('abcdefghij').estimate(), delta=0.5)
+        with self.assertRaises(SketchError):
+            a.merge(HyperLogLog(10))
+
+    def test_quantiles(self):
+        values = list(range(100000))
+        random.shuffle(values)
+        parts = [QuantileSketch(k=200, seed=i).update(values[i::4]) for i in range(4)]
+        sketch = parts[0]
+        for part in parts[1:]:
+            sketch.merge(pickle.loads(pickle.dumps(part)))
+        self.assertEqual(len(values), sketch.count)
+        for q, value in zip([0.1, 0.5, 0.99], sketch.quantiles([0.1, 0.5, 0.99])):
+            self.assertAlmostEqual(q * len(values), value, delta=0.02 * len(values))
+        self.assertAlmostEqual(0.25, sketch.rank(25000), delta=0.02)
+
+    def test_heavy_hitters(self):
+        values = ['hot'] * 500 + ['warm'] * 200 + [str(i) for i in range(5000)]
+        random.shuffle(values)
+        a = CountMinSketch(capacity=8).update(values[:3000])
+        b = CountMinSketch(capacity=8).update(values[3000:])
+        a.merge(b)
+        hitters = a.heavy_hitters(2)
+        self.assertEqual(['hot', 'warm'], [v for v, _ in hitters])
+        self.assertGreaterEqual(hitters[0][1], 500)
+        self.assertLess(hitters[0][1], 520)
+
+    def test_columns(self):
+        docs = [create_random_doc() for _ in range(500)]
+        storage = create_simple_storage(Document.DESCRIPTOR, docs)
+        urls = [n.url for d in docs for n in d.name if n.HasField('url')]
+        self.assertEqual(urls, list(column_values(storage, 'name.url')))
+
+        distinct = approx_count_distinct(storage, 'name.url')
+        self.assertAlmostEqual(len(set(urls)), distinct.estimate(), delta=len(urls) * 0.05)
+
+        doc_ids = sorted(d.doc_id for d in docs)
+        median = approx_quantiles(storage, 'doc_id').quantile(0.5)
+        self.assertAlmostEqual(0.5, doc_ids.index(median) / len(doc_ids), delta=0.05)
+
+        forward = approx_heavy_hitters(storage, 'links.forward')
+        self.assertEqual(sum(len(d.links.forward) for d in docs), forward.count)
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+
+import json
+import os
+import tempfile
+import unittest
+
+from .document_pb2 import Document
+from dremel.file import compact_file
+from dremel.predicate import EqualPredicate, RangePredicate
+from dremel.profiling import profiling
+from dremel.table import MANIFEST, SCHEMA, TableError, create_table, open_table
+from .utils import create_random_doc
+
+
+def doc_ids(rows):
+    return [values[0] for values, fetch_level in rows]
+
+
+class TableTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'docs')
+        self.docs = [create_random_doc() for _ in range(300)]
+        self.table = create_table(self.path, Document.DESCRIPTOR, self.docs,
+                                  partition_by=[('doc_id', 100000)], row_group_size=32)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_partitions(self):
+        keys = sorted(set(d.doc_id // 100000 * 100000 for d in self.docs))
+        self.assertEqual(keys, [p['key'][0] for p in self.table.partitions()])
+        self.assertEqual(len(self.docs), self.table.num_records())
+
+        expected = sorted(d.doc_id for d in self.docs)
+        self.assertEqual(expected, sorted(doc_ids(self.table.scan(['doc_id'], max_workers=4))))
+
+        predicates = [RangePredicate('doc_id', 250000, 420000)]
+        self.assertEqual(3, len(self.table.prune(predicates)))
+        self.assertEqual([i for i in expected if 250000 <= i <= 420000],
+                         sorted(doc_ids(self.table.scan(['doc_id'], predicates))))
+        self.assertEqual([], self.table.prune([EqualPredicate('doc_id', -1)]))
+        self.assertEqual(10, len(doc_ids(self.table.scan(['doc_id'], limit=10))))
+
+    def test_early_stop(self):
+        # partitions are scanned a few rows ahead, and not any further once the consumer stops
+        expected = list(self.table.scan(['doc_id']))[0]
+        with profiling() as profile:
+            rows = self.table.scan(['doc_id'], max_queued=2)
+            first = next(rows)
+            rows.close()
+        self.assertEqual(expected, first)
+        entries_read = profile.columns['__root__.doc_id'].entries_read
+        self.assertLessEqual(entries_read, len(self.table.partitions()) * 4)
+
+    def test_append(self):
+        old = open_table(self.path)
+        more = [create_random_doc() for _ in range(50)]
+        self.assertEqual(2, self.table.append(Document.DESCRIPTOR, more))
+        expected = sorted(d.doc_id for d in self.docs + more)
+        self.assertEqual(expected, sorted(doc_ids(open_table(self.path).scan(['doc_id']))))
+
+        # tables opened before keep their snapshot
+        self.assertEqual(1, old.snapshot_id)
+        self.assertEqual(sorted(d.doc_id for d in self.docs), sorted(doc_ids(old.scan(['doc_id']))))
+        self.assertEqual(2, old.reload())
+
+        # fields are kept next to partitions, and records of other fields are refused
+        self.assertEqual(self.table.fingerprint, old.field_graph.fingerprint)
+        field_graph = old.field_graph
+        old.reload()
+        self.assertIsNot(field_graph, old.field_graph)
+        self.assertIsNotNone(old.field_graph.get_field('__root__.name.language.code'))
+        manifest_path = os.path.join(self.path, MANIFEST)
+        with open(manifest_path) as fd:
+            manifest = json.load(fd)
+        manifest['options']['fields'] = ['doc_id']
+        with open(manifest_path, 'w') as fd:
+            json.dump(manifest, fd)
+        num_records = self.table.num_records()
+        with self.assertRaises(TableError):
+            open_table(self.path).append(Document.DESCRIPTOR, more)
+        self.assertEqual(num_records, open_table(self.path).num_records())
+
+    def test_stale_handles(self):
+        # appends of tables opened before others add to the latest snapshot
+        first, second = open_table(self.path), open_table(self.path)
+        more = [create_random_doc() for _ in range(20)]
+        for i, doc in enumerate(more):
+            doc.doc_id = (1 + i % 2) * 1000000 + i
+        self.assertEqual(2, first.append(Document.DESCRIPTOR, more[0::2]))
+        self.assertEqual(3, second.append(Document.DESCRIPTOR, more[1::2]))
+        table = open_table(self.path)
+        self.assertEqual(12, len(table.partitions()))
+        self.assertEqual(len(set(p['file'] for p in table.partitions())), len(table.partitions()))
+        self.assertEqual(sorted(d.doc_id for d in self.docs + more), sorted(doc_ids(table.scan(['doc_id']))))
+        self.assertEqual([], [f for f in os.listdir(self.path) if f.endswith('.tmp')])
+
+    def test_append_without_fingerprint(self):
+        # tables written before fingerprints take the fields of their partitions
+        manifest_path = os.path.join(self.path, MANIFEST)
+        with open(manifest_path) as fd:
+            manifest = json.load(fd)
+        fingerprint = manifest.pop('fingerprint')
+        fields = manifest['options']['fields']
+        manifest['options']['fields'] = ['doc_id']
+        with open(manifest_path, 'w') as fd:
+            json.dump(manifest, fd)
+        os.remove(os.path.join(self.path, SCHEMA))
+        with self.assertRaises(TableError):
+            open_table(self.path).append(Document.DESCRIPTOR, self.docs[:10])
+
+        manifest['options']['fields'] = fields
+        with open(manifest_path, 'w') as fd:
+            json.dump(manifest, fd)
+        table = open_table(self.path)
+        self.assertIsNone(table.field_graph)
+        table.append(Document.DESCRIPTOR, self.docs[:10])
+        self.assertEqual(fingerprint, table.fingerprint)
+        self.assertEqual(fingerprint, table.field_graph.fingerprint)
+
+    def test_compact(self):
+        first = open_table(self.path)
+        more = [create_random_doc() for _ in range(300)]
+        self.table.append(Document.DESCRIPTOR, more)
+        before = open_table(self.path)
+        for partition in self.table.partitions():
+            compact_file(os.path.join(self.path, partition['file']), target_size=1000)
+
+        # compacted files hold the snapshots they replace, even after appends
+        expected = sorted(d.doc_id for d in self.docs + more)
+        self.assertEqual(expected, sorted(doc_ids(before.scan(['doc_id']))))
+        last = [create_random_doc() for _ in range(50)]
+        self.table.append(Document.DESCRIPTOR, last)
+        self.assertEqual(expected, sorted(doc_ids(before.scan(['doc_id']))))
+        self.assertEqual(sorted(d.doc_id for d in self.docs + more + last),
+                         sorted(doc_ids(open_table(self.path).scan(['doc_id']))))
+
+        # snapshots merged by compactions are gone
+        with self.assertRaises(TableError):
+            list(first.scan(['doc_id']))
+
+    def test_invalid_partition(self):
+        with self.assertRaises(TableError):
+            create_table(os.path.join(self.tmp_dir.name, 'x'), Document.DESCRIPTOR, [], partition_by=['name'])
+        with self.assertRaises(TableError):
+            create_table(self.path, Document.DESCRIPTOR, [], partition_by=['doc_id'])
+        with self.assertRaises(TableError):
+            open_table(self.tmp_dir.name)
@@ -102,3 +102,7 @@ class WriterTest(unittest.TestCase):
         writer = new_message_writer(Document().DESCRIPTOR)
         field_graph = writer.field_graph
         print(field_graph.dump())
+
+    def test_slots(self):
+        writer = new_message_writer(Document().DESCRIPTOR)
+        writer.node_accept(lambda node: self.assertFalse(hasattr(node, '__dict__')))